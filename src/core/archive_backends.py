@@ -0,0 +1,703 @@
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import rarfile
+
+from core.blob_store import new_digest
+from core.user_config import load_user_config
+
+# Optional in-process readers, the 7z command line is the fallback when they are missing.
+# libarchive-c also needs the libarchive shared library, loading it fails without one
+try:
+    import libarchive
+except (ImportError, OSError, AttributeError):
+    libarchive = None
+try:
+    import py7zr
+    from py7zr.io import Py7zIO, WriterFactory
+except ImportError:
+    py7zr = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Point rarfile to the bundled binary
+rarfile.UNRAR_TOOL = "/app/bin/unrar"
+
+# Members are copied to disk in chunks this big, so a multi GB file never sits in memory
+EXTRACT_CHUNK_SIZE = 4 * 1024 * 1024
+# Progress callbacks are throttled to this interval, in seconds
+PROGRESS_INTERVAL = 0.1
+# "45% 12 - Textures/foo.dds" as printed by 7z -bsp1, the file count is optional
+_SEVEN_ZIP_PROGRESS = re.compile(r"(\d+)%(?:\s+(\d+))?")
+
+# Zip archives holding less than this are extracted on one thread, a pool would cost more than it saves
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+TAR_ZSTD_SUFFIXES = (".tar.zst", ".tzst")
+
+# Threads allowed to write extracted data at the same time, across every extraction (see disk_write_slots)
+DEFAULT_DISK_WRITERS = 2
+_disk_write_slots = None
+_disk_write_slots_lock = threading.Lock()
+
+class ExtractionCancelled(Exception):
+    pass
+
+class ExtractionProgress:
+    """Counts extracted bytes and entries, reports them at a throttled rate and checks for cancellation
+
+    The callback receives {'fraction', 'bytes_done', 'bytes_total', 'entries_done', 'entries_total'},
+    totals are None when the archive format does not tell them upfront. Backends also record every
+    file they write in written, {path relative to destination_path: (size, hash)}. Hashes (see
+    core.blob_store) are computed while streaming when hash_files is set, None otherwise or when
+    the backend does not stream the file."""
+
+    def __init__(self, callback=None, cancel_event=None, bytes_total=None, entries_total=None, destination_path=None,
+                 hash_files: bool = False):
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.bytes_total = bytes_total
+        self.entries_total = entries_total
+        self.bytes_done = 0
+        self.entries_done = 0
+        self.fraction = 0.0
+        self.last_report = 0.0
+        self.written = {}
+        self.hash_files = hash_files
+        # Target paths are always os.path.join(destination_path, relative path), slicing is enough to get the latter back
+        self.prefix_length = len(os.path.join(destination_path, "")) if destination_path else 0
+        # Parallel extraction advances from several threads
+        self.lock = threading.Lock()
+
+    def digest(self):
+        return new_digest() if self.hash_files else None
+
+    def wrote(self, target_path: str, size: int, content_hash: str = None):
+        with self.lock:
+            self.written[target_path[self.prefix_length:]] = (size, content_hash)
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExtractionCancelled()
+
+    def advance(self, bytes_done: int = 0, entries_done: int = 0, fraction: float = None):
+        with self.lock:
+            self.bytes_done += bytes_done
+            self.entries_done += entries_done
+            if fraction is not None:
+                self.fraction = fraction
+            elif self.bytes_total:
+                self.fraction = min(self.bytes_done / self.bytes_total, 1.0)
+            elif self.entries_total:
+                self.fraction = min(self.entries_done / self.entries_total, 1.0)
+
+            now = time.monotonic()
+            if now - self.last_report < PROGRESS_INTERVAL:
+                return
+            self.last_report = now
+        self.report()
+
+    def report(self):
+        if self.callback is None:
+            return
+        self.callback({
+            'fraction': self.fraction,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'entries_done': self.entries_done,
+            'entries_total': self.entries_total
+        })
+
+    def finish(self):
+        self.fraction = 1.0
+        self.report()
+
+def normalise_member_name(member_name: str):
+    """Relative path a member is extracted to, None when nothing is left of it
+
+    Archives built on Windows may use backslashes as separators, leading slashes and '..' segments
+    are dropped like zipfile does."""
+    segments = [segment for segment in member_name.replace("\\", "/").split("/") if segment not in ("", ".", "..")]
+    return "/".join(segments) if segments else None
+
+def _wanted_targets(destination_path: str, targets: dict):
+    """manifest path -> paths it is written to, None when every member goes to its own path"""
+    if targets is None:
+        return None
+    wanted = {}
+    for target, source in targets.items():
+        wanted.setdefault(source, []).append(os.path.join(destination_path, target))
+    return wanted
+
+def _target_paths(path: str, destination_path: str, wanted) -> list:
+    if wanted is None:
+        return [os.path.join(destination_path, path)]
+    return wanted.get(path, [])
+
+def _read_chunks(source):
+    while chunk := source.read(EXTRACT_CHUNK_SIZE):
+        yield chunk
+
+def disk_write_slots() -> threading.BoundedSemaphore:
+    """Shared by every extraction so concurrent installs keep decompressing on all their threads
+    while only a few of them write to the disk at once, set with the disk_writers setting"""
+    global _disk_write_slots
+    with _disk_write_slots_lock:
+        if _disk_write_slots is None:
+            writers = (load_user_config() or {}).get("disk_writers") or DEFAULT_DISK_WRITERS
+            _disk_write_slots = threading.BoundedSemaphore(max(1, int(writers)))
+        return _disk_write_slots
+
+def _write_member(chunks, target_paths: list, progress: ExtractionProgress):
+    """Writes a member chunk by chunk to its first target, checking for cancellation between chunks.
+    Other targets (a FOMOD installing the same file twice) get copies"""
+    write_slots = disk_write_slots()
+    digest = progress.digest()
+    size = 0
+    os.makedirs(os.path.dirname(target_paths[0]), exist_ok=True)
+    with open(target_paths[0], 'wb') as target:
+        for chunk in chunks:
+            progress.check_cancelled()
+            # The chunk was decompressed outside the slot, only the write waits for the disk
+            with write_slots:
+                target.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            size += len(chunk)
+            progress.advance(bytes_done=len(chunk))
+    content_hash = digest.hexdigest() if digest is not None else None
+    progress.wrote(target_paths[0], size, content_hash)
+    for target_path in target_paths[1:]:
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copy2(target_paths[0], target_path)
+        progress.wrote(target_path, size, content_hash)
+    progress.advance(entries_done=1)
+
+def default_extraction_workers() -> int:
+    # zlib releases the GIL while inflating, so threads keep every core busy.
+    # One or two cores gain nothing over extracting serially
+    cpu_count = os.cpu_count() or 1
+    return 1 if cpu_count <= 2 else min(8, cpu_count)
+
+def _partition(entries: list, workers: int, weight) -> list:
+    """Spreads entries over workers so each gets about the same total weight, heaviest first"""
+    partitions = [[] for _ in range(workers)]
+    totals = [0] * workers
+    for entry in sorted(entries, key=weight, reverse=True):
+        lightest = totals.index(min(totals))
+        partitions[lightest].append(entry)
+        totals[lightest] += weight(entry)
+    return [partition for partition in partitions if partition]
+
+def _extract_via_scratch(destination_path: str, targets: dict, progress: ExtractionProgress, extract_to):
+    """For tools that can only extract members to their own path: extract_to(scratch_dir) writes them
+    to a scratch folder next to destination_path, they are then renamed to their targets"""
+    scratch_dir = tempfile.mkdtemp(prefix=".nomm-extract-", dir=os.path.dirname(os.path.abspath(destination_path)))
+    try:
+        extract_to(scratch_dir)
+        # A member installed to several places is copied, its last target gets the extracted file itself
+        remaining = Counter(targets.values())
+        for target, source in targets.items():
+            source_path = os.path.join(scratch_dir, source)
+            target_path = os.path.join(destination_path, target)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            remaining[source] -= 1
+            if remaining[source]:
+                shutil.copy2(source_path, target_path)
+            else:
+                os.replace(source_path, target_path)
+            progress.wrote(target_path, os.path.getsize(target_path))
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+class ExtractionBackend:
+    """Reads some archive formats, see register_backend
+
+    Manifests are [(relative path, size, crc)] of the files of an archive, paths as normalise_member_name
+    gives them and crc None when the format has none. extract() writes every member to its own path
+    below destination_path, or only targets ({path below destination_path: manifest path}) when given,
+    and records each file it writes with progress.wrote()."""
+    name = None
+    suffixes = ()
+
+    def available(self) -> bool:
+        return True
+
+    def handles(self, archive_path: str) -> bool:
+        return archive_path.lower().endswith(self.suffixes)
+
+    def list(self, archive_path: str) -> list:
+        raise NotImplementedError
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        raise NotImplementedError
+
+    def read(self, archive_path: str, member_path: str) -> bytes:
+        raise NotImplementedError
+
+class _IndexedArchiveBackend(ExtractionBackend):
+    """Formats with a central index (zip, rar), every member can be opened on its own"""
+
+    def open(self, archive_path: str):
+        raise NotImplementedError
+
+    @staticmethod
+    def _is_dir(member) -> bool:
+        return member.is_dir() or member.filename.endswith("\\")
+
+    def _members(self, archive) -> dict:
+        members = {}
+        for member in archive.infolist():
+            path = normalise_member_name(member.filename)
+            if path is not None and not self._is_dir(member):
+                members[path] = member
+        return members
+
+    def list(self, archive_path: str) -> list:
+        with self.open(archive_path) as archive:
+            return [(path, member.file_size, member.CRC) for path, member in self._members(archive).items()]
+
+    def _entries(self, archive, destination_path: str, wanted) -> list:
+        """(member, target paths) to extract, folders first. A path that several members
+        normalise to is written once, by the last of them"""
+        entries = {}
+        for member in archive.infolist():
+            path = normalise_member_name(member.filename)
+            if path is None:
+                continue
+            if self._is_dir(member):
+                if wanted is None:
+                    entries[path] = (member, [os.path.join(destination_path, path)])
+            elif target_paths := _target_paths(path, destination_path, wanted):
+                entries.pop(path, None)
+                entries[path] = (member, target_paths)
+        return sorted(entries.values(), key=lambda entry: not self._is_dir(entry[0]))
+
+    def _write_entries(self, archive, entries: list, progress: ExtractionProgress):
+        for member, target_paths in entries:
+            progress.check_cancelled()
+            if self._is_dir(member):
+                os.makedirs(target_paths[0], exist_ok=True)
+                progress.advance(entries_done=1)
+                continue
+            with archive.open(member) as source:
+                _write_member(_read_chunks(source), target_paths, progress)
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        with self.open(archive_path) as archive:
+            entries = self._entries(archive, destination_path, _wanted_targets(destination_path, targets))
+            progress.bytes_total = sum(member.file_size for member, _ in entries)
+            progress.entries_total = len(entries)
+            self._write_entries(archive, entries, progress)
+
+    def read(self, archive_path: str, member_path: str) -> bytes:
+        with self.open(archive_path) as archive:
+            return archive.read(self._members(archive)[member_path])
+
+class ZipBackend(_IndexedArchiveBackend):
+    """Zip members are compressed independently, large archives are inflated on a thread pool
+    where every worker reads through its own file handle"""
+    name = "zipfile"
+    suffixes = (".zip",)
+
+    def open(self, archive_path: str):
+        return zipfile.ZipFile(archive_path, 'r')
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        workers = (load_user_config() or {}).get("extraction_threads") or default_extraction_workers()
+        with self.open(archive_path) as archive:
+            entries = self._entries(archive, destination_path, _wanted_targets(destination_path, targets))
+            progress.bytes_total = sum(member.file_size for member, _ in entries)
+            progress.entries_total = len(entries)
+            if workers <= 1 or len(entries) < 2 or progress.bytes_total < PARALLEL_MIN_BYTES:
+                self._write_entries(archive, entries, progress)
+                return
+            # Folders are created upfront so workers only ever write files
+            folders = [entry for entry in entries if self._is_dir(entry[0])]
+            self._write_entries(archive, folders, progress)
+
+        def worker(partition):
+            with self.open(archive_path) as worker_archive:
+                self._write_entries(worker_archive, partition, progress)
+
+        # Every path is written by a single member, so the result does not depend on the order workers finish in
+        files = [entry for entry in entries if not self._is_dir(entry[0])]
+        partitions = _partition(files, workers, lambda entry: entry[0].compress_size)
+        with ThreadPoolExecutor(max_workers=len(partitions)) as pool:
+            for _ in pool.map(worker, partitions):
+                pass
+
+class RarBackend(_IndexedArchiveBackend):
+    name = "rarfile"
+    suffixes = (".rar",)
+
+    def open(self, archive_path: str):
+        return rarfile.RarFile(archive_path, 'r')
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        with self.open(archive_path) as archive:
+            if not archive.is_solid():
+                return super().extract(archive_path, destination_path, progress, targets)
+            # Opening members one by one would decompress a solid archive again for each of them
+            progress.check_cancelled()
+            if targets is None:
+                archive.extractall(destination_path)
+                for path, member in self._members(archive).items():
+                    progress.wrote(os.path.join(destination_path, path), member.file_size)
+            else:
+                members = self._members(archive)
+                selected = [members[source] for source in dict.fromkeys(targets.values())]
+                _extract_via_scratch(destination_path, targets, progress, lambda scratch_dir: archive.extractall(scratch_dir, members=selected))
+
+class TarBackend(ExtractionBackend):
+    """Tarballs, compressed or not. Zstandard needs the zstandard module"""
+    name = "tarfile"
+    suffixes = TAR_SUFFIXES + TAR_ZSTD_SUFFIXES
+
+    def handles(self, archive_path: str) -> bool:
+        if archive_path.lower().endswith(TAR_ZSTD_SUFFIXES):
+            return zstandard is not None
+        return super().handles(archive_path)
+
+    @contextmanager
+    def open(self, archive_path: str):
+        """(tar, raw file), tarballs have no index so members are read in order in stream mode"""
+        with open(archive_path, 'rb') as raw:
+            fileobj = raw
+            if archive_path.lower().endswith(TAR_ZSTD_SUFFIXES):
+                fileobj = zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+            with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+                yield tar, raw
+
+    def list(self, archive_path: str) -> list:
+        with self.open(archive_path) as (tar, _):
+            return [(path, member.size, None) for member in tar
+                    if member.isfile() and (path := normalise_member_name(member.name)) is not None]
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        wanted = _wanted_targets(destination_path, targets)
+        archive_size = os.path.getsize(archive_path) or 1
+        with self.open(archive_path) as (tar, raw):
+            # Links and special files are skipped, a mod only needs regular files
+            for member in tar:
+                progress.check_cancelled()
+                path = normalise_member_name(member.name)
+                if path is None:
+                    continue
+                if member.isdir() and wanted is None:
+                    os.makedirs(os.path.join(destination_path, path), exist_ok=True)
+                elif member.isfile() and (target_paths := _target_paths(path, destination_path, wanted)):
+                    _write_member(_read_chunks(tar.extractfile(member)), target_paths, progress)
+                # Nothing tells the size upfront, the position in the compressed file does
+                progress.advance(fraction=min(raw.tell() / archive_size, 1.0))
+
+    def read(self, archive_path: str, member_path: str) -> bytes:
+        with self.open(archive_path) as (tar, _):
+            for member in tar:
+                if member.isfile() and normalise_member_name(member.name) == member_path:
+                    return tar.extractfile(member).read()
+        raise KeyError(member_path)
+
+class LibarchiveBackend(ExtractionBackend):
+    """Every format libarchive reads, in process. Needs libarchive-c"""
+    name = "libarchive"
+    suffixes = (".7z", ".zip", ".rar") + TAR_SUFFIXES + TAR_ZSTD_SUFFIXES
+
+    def available(self) -> bool:
+        return libarchive is not None
+
+    def list(self, archive_path: str) -> list:
+        with libarchive.file_reader(archive_path) as archive:
+            # Entries whose data is not read are skipped
+            return [(path, entry.size, None) for entry in archive
+                    if entry.isfile and (path := normalise_member_name(entry.pathname)) is not None]
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        wanted = _wanted_targets(destination_path, targets)
+        archive_size = os.path.getsize(archive_path) or 1
+        with libarchive.file_reader(archive_path) as archive:
+            for entry in archive:
+                progress.check_cancelled()
+                path = normalise_member_name(entry.pathname)
+                if path is None:
+                    continue
+                if entry.isdir and wanted is None:
+                    os.makedirs(os.path.join(destination_path, path), exist_ok=True)
+                elif entry.isfile and (target_paths := _target_paths(path, destination_path, wanted)):
+                    _write_member(entry.get_blocks(EXTRACT_CHUNK_SIZE), target_paths, progress)
+                progress.advance(fraction=min(archive.bytes_read / archive_size, 1.0))
+
+    def read(self, archive_path: str, member_path: str) -> bytes:
+        with libarchive.file_reader(archive_path) as archive:
+            for entry in archive:
+                if entry.isfile and normalise_member_name(entry.pathname) == member_path:
+                    return b"".join(entry.get_blocks())
+        raise KeyError(member_path)
+
+class Py7zrBackend(ExtractionBackend):
+    """7z archives in process with py7zr, members are streamed to disk through a writer factory"""
+    name = "py7zr"
+    suffixes = (".7z",)
+
+    def available(self) -> bool:
+        return py7zr is not None
+
+    def list(self, archive_path: str) -> list:
+        with py7zr.SevenZipFile(archive_path, 'r') as archive:
+            return [(path, info.uncompressed, info.crc32) for info in archive.list()
+                    if not info.is_directory and (path := normalise_member_name(info.filename)) is not None]
+
+    def _extract(self, archive_path: str, destination_path: str, names: list, writer_for):
+        """Runs py7zr on names, writer_for(manifest path) gives the Py7zIO each member is written to"""
+        root = os.path.abspath(destination_path)
+        writers = []
+
+        class Factory(WriterFactory):
+            def create(self, filename):
+                # py7zr hands the path it would have written to, below root
+                writer = writer_for(normalise_member_name(os.path.relpath(filename, root)))
+                writers.append(writer)
+                return writer
+
+        with py7zr.SevenZipFile(archive_path, 'r') as archive:
+            archive.extract(path=root, targets=names, factory=Factory())
+        # Older py7zr versions never close the writers
+        for writer in writers:
+            writer.close()
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        wanted = _wanted_targets(destination_path, targets)
+        with py7zr.SevenZipFile(archive_path, 'r') as archive:
+            infos = archive.list()
+        selected = {}
+        for info in infos:
+            path = normalise_member_name(info.filename)
+            if path is None:
+                continue
+            if info.is_directory:
+                if wanted is None:
+                    os.makedirs(os.path.join(destination_path, path), exist_ok=True)
+            elif _target_paths(path, destination_path, wanted):
+                selected[info.filename] = info.uncompressed
+        progress.bytes_total = sum(selected.values())
+        progress.entries_total = len(selected)
+
+        write_slots = disk_write_slots()
+
+        class FileWriter(Py7zIO):
+            def __init__(self, target_paths):
+                self.target_paths = target_paths
+                self.digest = progress.digest()
+                os.makedirs(os.path.dirname(target_paths[0]), exist_ok=True)
+                self.file = open(target_paths[0], 'wb')
+
+            def write(self, data):
+                progress.check_cancelled()
+                # py7zr decompresses before calling us, only the write waits for the disk like in _write_member
+                with write_slots:
+                    self.file.write(data)
+                if self.digest is not None:
+                    self.digest.update(data)
+                progress.advance(bytes_done=len(data))
+                return len(data)
+
+            def read(self, size=None):
+                return b""
+
+            def seek(self, offset, whence=0):
+                return self.file.tell()
+
+            def seekable(self):
+                return False
+
+            def flush(self):
+                self.file.flush()
+
+            def size(self):
+                return self.file.tell()
+
+            def close(self):
+                if self.file.closed:
+                    return
+                size = self.file.tell()
+                self.file.close()
+                content_hash = self.digest.hexdigest() if self.digest is not None else None
+                progress.wrote(self.target_paths[0], size, content_hash)
+                for target_path in self.target_paths[1:]:
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    shutil.copy2(self.target_paths[0], target_path)
+                    progress.wrote(target_path, size, content_hash)
+                progress.advance(entries_done=1)
+
+        if selected:
+            self._extract(archive_path, destination_path, list(selected),
+                          lambda path: FileWriter(_target_paths(path, destination_path, wanted)))
+
+    def read(self, archive_path: str, member_path: str) -> bytes:
+        with py7zr.SevenZipFile(archive_path, 'r') as archive:
+            names = [info.filename for info in archive.list() if normalise_member_name(info.filename) == member_path]
+        if not names:
+            raise KeyError(member_path)
+        chunks = []
+
+        class MemoryWriter(Py7zIO):
+            def write(self, data):
+                chunks.append(bytes(data))
+                return len(data)
+
+            def read(self, size=None):
+                return b""
+
+            def seek(self, offset, whence=0):
+                return 0
+
+            def seekable(self):
+                return False
+
+            def flush(self):
+                pass
+
+            def size(self):
+                return sum(len(chunk) for chunk in chunks)
+
+        self._extract(archive_path, tempfile.gettempdir(), names[:1], lambda path: MemoryWriter())
+        return b"".join(chunks)
+
+class SevenZipCliBackend(ExtractionBackend):
+    """The 7z command line, opens anything the other backends cannot"""
+    name = "7z"
+
+    def available(self) -> bool:
+        return shutil.which("7z") is not None
+
+    def handles(self, archive_path: str) -> bool:
+        return True
+
+    def list(self, archive_path: str) -> list:
+        # -slt prints one "Key = Value" block per entry, -ba drops the header before the first one
+        output = subprocess.run(
+            ["7z", "l", "-slt", "-ba", archive_path],
+            capture_output=True, text=True, check=True
+        ).stdout
+        manifest = []
+        for block in output.split("\n\n"):
+            fields = dict(line.split(" = ", 1) for line in block.splitlines() if " = " in line)
+            path = normalise_member_name(fields.get("Path", ""))
+            if path is None or fields.get("Folder") == "+" or fields.get("Attributes", "").startswith("D"):
+                continue
+            crc = fields.get("CRC")
+            manifest.append((path, int(fields.get("Size") or 0), int(crc, 16) if crc else None))
+        return manifest
+
+    def _run(self, archive_path: str, destination_path: str, progress: ExtractionProgress, list_file: str = None):
+        # -bsp1 sends progress to stdout, -bso0 drops the file listing so progress is all there is to read
+        command = ["7z", "x", archive_path, f"-o{destination_path}", "-y", "-bsp1", "-bso0"]
+        if list_file:
+            # Only the members named in the list file, -spd so names are not read as wildcards
+            command += ["-spd", f"@{list_file}"]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output_tail = ""
+        try:
+            while chunk := process.stdout.read1(4096):
+                progress.check_cancelled()
+                # Progress is redrawn in place with backspaces and carriage returns rather than new lines
+                text = re.sub(r"[\b\r]", "\n", chunk.decode(errors="replace"))
+                matches = _SEVEN_ZIP_PROGRESS.findall(text)
+                # Anything else is kept for the error message
+                output_tail = (output_tail + re.sub(r"(?m)^\s*\d+%.*$", "", text))[-4096:]
+                if matches:
+                    percent, entries = matches[-1]
+                    progress.entries_done = int(entries) if entries else progress.entries_done
+                    progress.advance(fraction=int(percent) / 100)
+        except ExtractionCancelled:
+            process.terminate()
+            process.wait()
+            raise
+        if process.wait() != 0:
+            message = " ".join(line.strip() for line in output_tail.splitlines() if line.strip())
+            raise Exception(message or f"7z exited with code {process.returncode}")
+
+    def extract(self, archive_path: str, destination_path: str, progress: ExtractionProgress, targets: dict = None):
+        if targets is None:
+            self._run(archive_path, destination_path, progress)
+            # 7z does not say what it wrote, its listing does
+            for path, size, _ in self.list(archive_path):
+                progress.wrote(os.path.join(destination_path, path), size)
+            return
+        progress.entries_total = len(targets)
+
+        def extract_to(scratch_dir):
+            list_file = os.path.join(scratch_dir, ".members")
+            with open(list_file, 'w', encoding='utf-8') as f:
+                f.write("\n".join(dict.fromkeys(targets.values())))
+            self._run(archive_path, scratch_dir, progress, list_file)
+            os.remove(list_file)
+
+        _extract_via_scratch(destination_path, targets, progress, extract_to)
+
+    def read(self, archive_path: str, member_path: str) -> bytes:
+        # -so writes the file to stdout
+        return subprocess.run(
+            ["7z", "e", "-so", "-spd", archive_path, member_path],
+            capture_output=True, check=True
+        ).stdout
+
+_backends = []
+
+def register_backend(backend: ExtractionBackend, position: int = None):
+    """Backends are tried in order, the first available one handling an archive is used
+    unless the extraction_backend setting names another one that can open it"""
+    _backends.insert(len(_backends) if position is None else position, backend)
+
+def get_backends(archive_path: str = None) -> list:
+    """Available backends, only those able to open archive_path when it is given"""
+    return [backend for backend in _backends
+            if backend.available() and (archive_path is None or backend.handles(archive_path))]
+
+def get_backend(archive_path: str) -> ExtractionBackend:
+    backends = get_backends(archive_path)
+    if not backends:
+        raise Exception(f"No extraction backend can open {os.path.basename(archive_path)}, is 7z installed?")
+    preferred = (load_user_config() or {}).get("extraction_backend")
+    return next((backend for backend in backends if backend.name == preferred), backends[0])
+
+def benchmark_backends(archive_path: str, runs: int = 1) -> dict:
+    """Seconds every backend able to open the archive takes to extract it (best of runs), or the error it raised"""
+    results = {}
+    for backend in get_backends(archive_path):
+        timings = []
+        for _ in range(runs):
+            destination_path = tempfile.mkdtemp(prefix=".nomm-benchmark-")
+            try:
+                start = time.perf_counter()
+                backend.extract(archive_path, destination_path, ExtractionProgress())
+                timings.append(time.perf_counter() - start)
+            except Exception as e:
+                results[backend.name] = str(e)
+                break
+            finally:
+                shutil.rmtree(destination_path, ignore_errors=True)
+        else:
+            results[backend.name] = min(timings)
+            print(f"{backend.name}: {os.path.basename(archive_path)} extracted in {min(timings):.3f}s")
+    return results
+
+register_backend(ZipBackend())
+register_backend(RarBackend())
+register_backend(TarBackend())
+register_backend(LibarchiveBackend())
+register_backend(Py7zrBackend())
+register_backend(SevenZipCliBackend())
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+
+from gi.repository import GLib
+
+from core.archive_backends import get_backend
+
+FOMOD_CONFIG_NAME = "fomod/moduleconfig.xml"
+# End of central directory record: signature, disk numbers, entry counts, directory size and offset, comment length
+_ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+_ZIP_END_SIGNATURE = b"PK\x05\x06"
+
+# archive path -> (size, mtime_ns, manifest, FOMOD config path), in front of the on-disk cache
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def list_archive(archive_path: str) -> list:
+    """(relative path, size, crc) of every file in the archive, read from its headers only where the format has them"""
+    return get_backend(archive_path).list(archive_path)
+
+def _cache_path(archive_path: str, cache_dir: str = None) -> str:
+    cache_dir = cache_dir or os.path.join(GLib.get_user_data_dir(), "nomm", "archive-index")
+    key = hashlib.sha1(os.path.abspath(archive_path).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.json")
+
+def _load_manifest(archive_path: str, cache_dir: str = None) -> tuple:
+    archive_path = str(archive_path)
+    stat = os.stat(archive_path)
+    key = (stat.st_size, stat.st_mtime_ns)
+
+    with _manifests_lock:
+        cached = _manifests.get(archive_path)
+    if cached and cached[:2] == key:
+        return cached
+
+    cache_path = _cache_path(archive_path, cache_dir)
+    manifest = None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if (data.get("size"), data.get("mtime_ns")) == key:
+            manifest = [tuple(entry) for entry in data["entries"]]
+            fomod_config = data["fomod"] if "fomod" in data else find_fomod_config(manifest)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if manifest is None:
+        manifest = list_archive(archive_path)
+        fomod_config = find_fomod_config(manifest)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"archive": archive_path, "size": key[0], "mtime_ns": key[1], "fomod": fomod_config, "entries": manifest}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not cache the manifest of {archive_path}: {e}")
+
+    cached = (*key, manifest, fomod_config)
+    with _manifests_lock:
+        _manifests[archive_path] = cached
+    return cached
+
+def get_archive_manifest(archive_path: str, cache_dir: str = None) -> list:
+    """Manifest of the archive, cached in memory and on disk until its size or mtime changes"""
+    return _load_manifest(archive_path, cache_dir)[2]
+
+def get_fomod_config(archive_path: str, cache_dir: str = None):
+    """Path of the FOMOD ModuleConfig.xml in the archive, None for a regular mod. Looked up once per manifest"""
+    return _load_manifest(archive_path, cache_dir)[3]
+
+def find_fomod_config(manifest: list):
+    """Path of the FOMOD ModuleConfig.xml in the manifest, None for a regular mod"""
+    return next((path for path, _, _ in manifest if path.lower().endswith(FOMOD_CONFIG_NAME)), None)
+
+def get_archive_summary(archive_path: str, cache_dir: str = None) -> dict:
+    _, _, manifest, fomod_config = _load_manifest(archive_path, cache_dir)
+    return {
+        'files': len(manifest),
+        'size': sum(size for _, size, _ in manifest),
+        'fomod': fomod_config is not None
+    }
+
+def _zip_central_directory_hash(archive_path: str):
+    """Hash of the zip central directory, None when it can not be located (zip64, damaged archives)"""
+    with open(archive_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        archive_size = f.tell()
+        # The end record is at most 64KiB of comment away from the end of the file
+        tail_size = min(archive_size, _ZIP_END_RECORD.size + 0xFFFF)
+        f.seek(archive_size - tail_size)
+        tail = f.read()
+        position = tail.rfind(_ZIP_END_SIGNATURE)
+        if position < 0 or len(tail) - position < _ZIP_END_RECORD.size:
+            return None
+        *_, directory_size, directory_offset, _ = _ZIP_END_RECORD.unpack_from(tail, position)
+        if 0xFFFFFFFF in (directory_size, directory_offset) or directory_offset + directory_size > archive_size:
+            return None
+        f.seek(directory_offset)
+        digest = hashlib.blake2b(digest_size=16)
+        remaining = directory_size
+        while remaining:
+            chunk = f.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                return None
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+def get_archive_fingerprint(archive_path: str) -> dict:
+    """Size, mtime and a hash of the archive index: the central directory of zips, the manifest of other formats"""
+    archive_path = str(archive_path)
+    stat = os.stat(archive_path)
+    index_hash = _zip_central_directory_hash(archive_path) if archive_path.lower().endswith(".zip") else None
+    if index_hash is None:
+        entries = json.dumps(get_archive_manifest(archive_path)).encode()
+        index_hash = hashlib.blake2b(entries, digest_size=16).hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "index": index_hash}
+
+def same_archive(fingerprint: dict, other: dict) -> bool:
+    """Whether both fingerprints describe the same content, a re-downloaded copy of an archive still matches"""
+    if not fingerprint or not other:
+        return False
+    return (fingerprint.get("size"), fingerprint.get("index")) == (other.get("size"), other.get("index"))
@@ -1,26 +1,20 @@
 import os
 import shutil
-import subprocess
+import tempfile
 import xml.etree.ElementTree as ET
-import zipfile
 import gettext
 from pathlib import Path
 from urllib.parse import unquote
 
-from core.fomod_manager import parse_fomod_xml
-import rarfile
+from core.archive_backends import ExtractionCancelled, ExtractionProgress, get_backend
+from core.archive_index import get_archive_fingerprint, get_archive_manifest, get_fomod_config, same_archive
+from core.blob_store import BlobStore
+from core.fomod_manager import parse_fomod_xml, plan_fomod_selection
+from core.metadata_store import STAGING_METADATA_NAME, get_staging_store
+from core.staging_manifest import find_changed_files
+from core.user_config import load_user_config
 
 _ = gettext.gettext
-# Point rarfile to the bundled binary
-rarfile.UNRAR_TOOL = "/app/bin/unrar"
-
-def get_archive_type(file_path: str) -> str:
-    lower_path = file_path.lower()
-    if lower_path.endswith('.zip'):
-        return 'zip'
-    elif lower_path.endswith('.rar'):
-        return 'rar'
-    return 'other'
 
 # Cleaning method after extracting the archive
 def delete_downloaded_archive(widget, btn, file_name):
@@ -28,52 +22,59 @@ def delete_downloaded_archive(widget, btn, file_name):
     if os.path.exists(zip_path):
         os.remove(zip_path)
 
-def extract_archive(archive_path: str, destination_path: str) -> bool:
-    arc_type = get_archive_type(archive_path)
+def extract_archive(archive_path: str, destination_path: str, progress_callback=None, cancel_event=None) -> dict:
+    """Extracts an archive member by member with the backend chosen for it (see core.archive_backends)
+
+    progress_callback gets throttled progress dicts (see ExtractionProgress), setting cancel_event
+    (a threading.Event) stops the extraction with ExtractionCancelled. Returns (size, hash) of every
+    file written by path relative to destination_path, see ExtractionProgress."""
+    return extract_members(archive_path, destination_path, None, progress_callback, cancel_event)
+
+def extract_members(archive_path: str, destination_path: str, targets: dict, progress_callback=None, cancel_event=None) -> dict:
+    """Extracts only some files of an archive, each straight to its own place
+
+    targets maps a path in destination_path to the manifest path of the member written there,
+    None extracts everything."""
     os.makedirs(destination_path, exist_ok=True)
+    # Files are hashed on their way to the disk so deduplication does not have to read them again
+    hash_files = (load_user_config() or {}).get("staging_deduplication", False)
+    progress = ExtractionProgress(progress_callback, cancel_event, entries_total=len(targets) if targets else None,
+                                  destination_path=destination_path, hash_files=hash_files)
+    backend = get_backend(archive_path)
 
     try:
-        if arc_type == 'zip':
-            with zipfile.ZipFile(archive_path, 'r') as zf:
-                zf.extractall(destination_path)
-        elif arc_type == 'rar':
-            with rarfile.RarFile(archive_path, 'r') as rf:
-                rf.extractall(destination_path)
-        else:
-            subprocess.run(
-                ["7z", "x", archive_path, f"-o{destination_path}", "-y"],
-                capture_output=True, 
-                text=True,
-                check=True
-            )
+        backend.extract(archive_path, destination_path, progress, targets)
+    except ExtractionCancelled:
+        raise
     except Exception as e:
-        raise Exception(f"Error while extracting {arc_type} : {e}")
-        return False
-
-    for root, dirs, files in os.walk(destination_path):
-        for file_name in files:
-            if "\\" in file_name:
-                broken_file_path = os.path.join(root, file_name)
-                relative_segments = file_name.split("\\")
-                
-                correct_file_path = os.path.join(root, *relative_segments)
-                correct_dir_path = os.path.dirname(correct_file_path)
-                
-                os.makedirs(correct_dir_path, exist_ok=True)
-                
-                shutil.move(broken_file_path, correct_file_path)
-                print(_(f"[!] Corrected path malformation: {file_name} -> {os.path.join(*relative_segments)}"))
-    return True
-
-# Builds path toward the desired file by returning the files one by one in a list of string
-def get_all_relative_files(directory_path: str) -> list[str]:
-    all_files = []
-    for root, _, files in os.walk(directory_path):
-        for file in files:
-            full_path = os.path.join(root, file)
-            rel_path = os.path.relpath(full_path, directory_path)
-            all_files.append(rel_path.replace('\\', '/'))
-    return all_files
+        raise Exception(f"Error while extracting with {backend.name} : {e}")
+    progress.finish()
+    return progress.written
+
+def content_hashes(written: dict) -> dict:
+    """path -> hash of the files hashed while they were extracted"""
+    return {path: content_hash for path, (_, content_hash) in written.items() if content_hash}
+
+def read_archive_member(archive_path: str, member_path: str) -> bytes:
+    """Content of one file of the archive, member_path as listed in its manifest"""
+    return get_backend(archive_path).read(archive_path, member_path)
+
+def read_archive_members(archive_path: str, member_paths: list, cancel_event=None) -> dict:
+    """Content of several files of the archive by member path, read in a single pass over it
+
+    A solid archive would otherwise be decompressed again for each member."""
+    contents = {}
+    if not member_paths:
+        return contents
+    with tempfile.TemporaryDirectory(prefix=".nomm-members-") as scratch:
+        extract_members(archive_path, scratch, {path: path for path in member_paths}, cancel_event=cancel_event)
+        for path in member_paths:
+            try:
+                with open(os.path.join(scratch, path), 'rb') as f:
+                    contents[path] = f.read()
+            except FileNotFoundError:
+                print(f"{path} was not found in {os.path.basename(archive_path)}")
+    return contents
 
 # Drop file on the download tab to import mods
 def process_dropped_files(uri_list: list[str], destination_path: str) -> list[str]:
@@ -103,26 +104,108 @@ def process_dropped_files(uri_list: list[str], destination_path: str) -> list[st
 
     return copied_files
 
-def prepare_mod_installation(parent, archive_full_path, mod_staging_dir, filename):
-    if extract_archive(archive_full_path, mod_staging_dir):
-        files = get_all_relative_files(mod_staging_dir)
-        
-        if not files:
-            parent.show_message(_("Error"), _("No files were found in your mod archive."))
-            return
-        
-        fomod_xml_path = next((f for f in files if f.lower().endswith("fomod/moduleconfig.xml")), None)
-        fomod_metadata = None
-        
-        if fomod_xml_path:
-            xml_path = os.path.join(mod_staging_dir, fomod_xml_path)
-            tree = ET.parse(xml_path)
-            fomod_metadata = parse_fomod_xml(tree.getroot())
-        
-        data = {
-            'files': files,
-            'fomod': fomod_metadata
+def _get_blob_store(mod_staging_dir: str) -> BlobStore:
+    staging_dir = os.path.dirname(str(mod_staging_dir))
+    return BlobStore(staging_dir, get_staging_store(os.path.join(staging_dir, STAGING_METADATA_NAME)))
+
+def prepare_mod_installation(parent, archive_full_path, mod_staging_dir, filename, progress_callback=None, cancel_event=None, previous_install=None):
+    """previous_install is the {'mod', 'fingerprint', 'manifest'} recorded by the last install in mod_staging_dir
+    (see core.mod_manager.get_install_record), when the archive did not change only the files missing from
+    the staged tree or modified since are extracted again"""
+    # FOMOD archives are not extracted here: ModuleConfig.xml is read from the archive
+    # and only the selected options are extracted once the user picked them (see extract_fomod_selection)
+    try:
+        manifest = get_archive_manifest(archive_full_path)
+        fomod_xml_path = get_fomod_config(archive_full_path)
+    except Exception as e:
+        print(f"Could not list the contents of {filename}: {e}")
+        manifest, fomod_xml_path = [], None
+    if fomod_xml_path:
+        xml_root = ET.fromstring(read_archive_member(archive_full_path, fomod_xml_path))
+        return {
+            'files': [path for path, _, _ in manifest],
+            'fomod': parse_fomod_xml(xml_root),
+            # Option sources and images are relative to the folder holding fomod/
+            'fomod_root': os.path.dirname(os.path.dirname(fomod_xml_path))
         }
-        return data
-    return None
 
+    try:
+        fingerprint = get_archive_fingerprint(archive_full_path)
+    except Exception as e:
+        print(f"Could not fingerprint {filename}: {e}")
+        fingerprint = None
+
+    reinstall = os.path.isdir(mod_staging_dir)
+    changed_files = None
+    if reinstall and manifest and previous_install and same_archive(previous_install['fingerprint'], fingerprint):
+        changed_files = find_changed_files(mod_staging_dir, manifest, previous_install['manifest'])
+        print(f"{filename} is already staged, {len(changed_files)} of {len(manifest)} files to extract again")
+    
+    try:
+        if changed_files is not None:
+            # Changed files that are hardlinks of deduplicated blobs are removed, the others are rewritten in place
+            _get_blob_store(mod_staging_dir).detach_mod(previous_install['mod'], mod_staging_dir, changed_files)
+            written = {}
+            if changed_files:
+                written = extract_members(archive_full_path, mod_staging_dir, {path: path for path in changed_files}, progress_callback, cancel_event)
+            # The files left in place are those of the manifest too, and still hold the content of their blobs
+            files = [path for path, _, _ in manifest]
+            hashes = {
+                path: blob_hash for path, blob_hash in _get_blob_store(mod_staging_dir).store.get_mod_blobs(previous_install['mod']).items()
+                if path not in written
+            }
+            hashes.update(content_hashes(written))
+        else:
+            # A reinstall must not write through hardlinks shared with the deduplication store
+            if reinstall and previous_install:
+                _get_blob_store(mod_staging_dir).detach_mod(previous_install['mod'], mod_staging_dir)
+            # The backends tell what they wrote, the staging folder does not need to be walked again
+            written = extract_archive(archive_full_path, mod_staging_dir, progress_callback, cancel_event)
+            files = list(written)
+            hashes = content_hashes(written)
+    except ExtractionCancelled:
+        # A new install leaves nothing behind, a cancelled reinstall keeps what was already extracted
+        if not reinstall:
+            shutil.rmtree(mod_staging_dir, ignore_errors=True)
+        print(f"Extraction of {filename} cancelled")
+        return None
+    
+    if not files:
+        parent.show_message(_("Error"), _("No files were found in your mod archive."))
+        return
+    
+    data = {
+        'files': files,
+        'fomod': None,
+        'fingerprint': fingerprint,
+        'hashes': hashes,
+        # None when every file was written
+        'rewritten': changed_files
+    }
+    return data
+
+def extract_fomod_selection(archive_full_path, mod_staging_dir, install_items: list, progress_callback=None, cancel_event=None) -> dict:
+    """Extracts the files of the selected FOMOD options from the archive, straight to their place in the mod folder
+
+    Returns {'files', 'hashes', 'errors'}, files is None when the extraction was cancelled. The mod folder is only
+    replaced once everything is extracted, a failed reinstall keeps the previous one."""
+    archive_files = [path for path, _, _ in get_archive_manifest(archive_full_path)]
+    targets, errors = plan_fomod_selection(archive_files, install_items)
+    if not targets:
+        return {'files': [], 'hashes': {}, 'errors': errors}
+
+    temp_install_dir = f"{mod_staging_dir}_final_fomod"
+    shutil.rmtree(temp_install_dir, ignore_errors=True)
+    try:
+        written = extract_members(archive_full_path, temp_install_dir, targets, progress_callback, cancel_event)
+    except ExtractionCancelled:
+        shutil.rmtree(temp_install_dir, ignore_errors=True)
+        print(f"Extraction of {os.path.basename(archive_full_path)} cancelled")
+        return {'files': None, 'hashes': {}, 'errors': errors}
+    except Exception:
+        shutil.rmtree(temp_install_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(mod_staging_dir, ignore_errors=True)
+    os.rename(temp_install_dir, mod_staging_dir)
+    return {'files': list(written), 'hashes': content_hashes(written), 'errors': errors}
@@ -0,0 +1,113 @@
+import hashlib
+import os
+
+BLOBS_DIR_NAME = ".nomm_blobs"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def new_digest():
+    """Hash object blobs are named after, extraction feeds it while streaming members to disk"""
+    return hashlib.blake2b(digest_size=20)
+
+def hash_file(path: str) -> str:
+    """BLAKE2b of a file, read in chunks so big archives never sit in memory"""
+    digest = new_digest()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BlobStore:
+    """Content-addressed store under the staging root, mod folders hold hardlinks to its blobs"""
+
+    def __init__(self, staging_root: str, store):
+        self.blobs_dir = os.path.join(str(staging_root), BLOBS_DIR_NAME)
+        # StagingStore keeping the reference counts
+        self.store = store
+
+    def blob_path(self, blob_hash: str) -> str:
+        return os.path.join(self.blobs_dir, blob_hash[:2], blob_hash)
+
+    def _share(self, path: str, blob_hash: str) -> bool:
+        """Makes path a hardlink of its blob, returns True when an existing blob was reused"""
+        blob_path = self.blob_path(blob_hash)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            # First copy of this content, the file itself becomes the blob
+            os.link(path, blob_path)
+            return False
+        except FileExistsError:
+            pass
+        if os.path.samefile(path, blob_path):
+            return False
+        tmp_path = f"{path}.nomm-dedup"
+        os.link(blob_path, tmp_path)
+        os.replace(tmp_path, path)
+        return True
+
+    def detach_mod(self, mod: str, mod_dir: str, paths: list = None) -> int:
+        """Unlinks the files of mod that are hardlinks of its blobs, limited to paths when given, so the next write
+        creates a new file
+
+        Extracting over a deduplicated mod folder would otherwise write through the hardlink into the shared blob,
+        and into every other mod using it. Other hardlinks (files deployed with the hardlink strategy) are kept,
+        writing through them updates the game folder too."""
+        blobs = self.store.get_mod_blobs(mod)
+        detached = 0
+        for relative_path in blobs if paths is None else paths:
+            blob_hash = blobs.get(relative_path)
+            if blob_hash is None:
+                continue
+            path = os.path.join(str(mod_dir), relative_path)
+            try:
+                if os.path.samefile(path, self.blob_path(blob_hash)):
+                    os.unlink(path)
+                    detached += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not detach {path}: {e}")
+        return detached
+
+    def deduplicate_mod(self, mod: str, mod_dir: str, mod_files: list, hashes: dict = None) -> dict:
+        """Replaces duplicates among the staged files of mod by hardlinks to a single blob
+
+        hashes holds the hashes computed while extracting, only the other files are read again."""
+        hashes = hashes or {}
+        entries = []
+        reused = 0
+        bytes_saved = 0
+        for relative_path in mod_files:
+            path = os.path.join(str(mod_dir), relative_path)
+            try:
+                if os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                size = os.path.getsize(path)
+                blob_hash = hashes.get(relative_path) or hash_file(path)
+                if self._share(path, blob_hash):
+                    reused += 1
+                    bytes_saved += size
+                entries.append((relative_path, blob_hash, size))
+            except OSError as e:
+                print(f"Could not deduplicate {path}: {e}")
+
+        self.collect(self.store.set_mod_blobs(mod, entries))
+        return {"files": len(entries), "reused": reused, "bytes_saved": bytes_saved}
+
+    def release_mod(self, mod: str) -> int:
+        """Called once the mod folder is gone, deletes the blobs no other mod uses"""
+        return self.collect(self.store.release_mod_blobs(mod))
+
+    def collect(self, orphans: list) -> int:
+        removed = 0
+        for blob_hash in orphans:
+            try:
+                os.unlink(self.blob_path(blob_hash))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not remove blob {blob_hash}: {e}")
+        return removed
+
+    def stats(self) -> dict:
+        return self.store.blob_stats()
@@ -0,0 +1,132 @@
+import threading
+from collections import Counter
+
+from core.path_trie import PathTrie
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+class ConflictIndex:
+    """Inverted index from a relative file path to the mods providing it.
+
+    Kept up to date when a mod is installed, reinstalled or uninstalled, so conflict queries
+    never have to walk every file of every mod again."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # path -> tuple of the mods owning that path, in install order
+        self.owners = PathTrie()
+        # mod -> files it registered, needed to remove it cleanly
+        self.mod_files = {}
+        # sorted tuple of mods -> number of paths they all claim
+        self.groups = Counter()
+        # mod -> {other mod: number of shared paths}
+        self.mod_conflicts = {}
+
+    def _add_owner(self, path: str, mod: str):
+        owners = self.owners.get(path, ())
+        if owners:
+            if len(owners) > 1:
+                self._decrement_group(tuple(sorted(owners)))
+            for other in owners:
+                self.mod_conflicts.setdefault(mod, Counter())[other] += 1
+                self.mod_conflicts.setdefault(other, Counter())[mod] += 1
+            self.groups[tuple(sorted(owners + (mod,)))] += 1
+        self.owners.set(path, owners + (mod,))
+
+    def _remove_owner(self, path: str, mod: str):
+        owners = self.owners.get(path)
+        if not owners or mod not in owners:
+            return
+        if len(owners) > 1:
+            self._decrement_group(tuple(sorted(owners)))
+        owners = tuple(owner for owner in owners if owner != mod)
+        for other in owners:
+            self._decrement_conflict(mod, other)
+            self._decrement_conflict(other, mod)
+        if len(owners) > 1:
+            self.groups[tuple(sorted(owners))] += 1
+        if owners:
+            self.owners.set(path, owners)
+        else:
+            self.owners.pop(path)
+
+    def _decrement_group(self, group: tuple):
+        self.groups[group] -= 1
+        if self.groups[group] <= 0:
+            del self.groups[group]
+
+    def _decrement_conflict(self, mod: str, other: str):
+        counter = self.mod_conflicts.get(mod)
+        if counter is None:
+            return
+        counter[other] -= 1
+        if counter[other] <= 0:
+            del counter[other]
+        if not counter:
+            del self.mod_conflicts[mod]
+
+    def set_mod_files(self, mod: str, files: list):
+        """Registers (or re-registers after a reinstall) the files of a mod"""
+        with self.lock:
+            self.remove_mod(mod)
+            unique_files = tuple(dict.fromkeys(files or []))
+            self.mod_files[mod] = unique_files
+            for path in unique_files:
+                self._add_owner(path, mod)
+
+    def remove_mod(self, mod: str):
+        with self.lock:
+            for path in self.mod_files.pop(mod, ()):
+                self._remove_owner(path, mod)
+
+    def owners_of(self, path: str) -> list:
+        with self.lock:
+            return list(self.owners.get(path, []))
+
+    def files_of(self, mod: str) -> tuple:
+        with self.lock:
+            return self.mod_files.get(mod, ())
+
+    def conflicts_under(self, directory: str) -> dict:
+        """path -> owners of every contested file below directory"""
+        with self.lock:
+            return {path: list(owners) for path, owners in self.owners.items(directory) if len(owners) > 1}
+
+    def conflicts_for(self, mod: str) -> list:
+        """Mods sharing at least one file with mod"""
+        with self.lock:
+            return sorted(self.mod_conflicts.get(mod, {}))
+
+    def conflict_groups(self) -> list:
+        """Every distinct set of mods claiming the same file, same format as check_for_conflicts used to return"""
+        with self.lock:
+            return [list(group) for group in sorted(self.groups)]
+
+    def has_conflicts(self) -> bool:
+        with self.lock:
+            return bool(self.groups)
+
+def build_conflict_index(staging_metadata: dict) -> ConflictIndex:
+    index = ConflictIndex()
+    for mod, mod_info in staging_metadata.get("mods", {}).items():
+        index.set_mod_files(mod, mod_info.get("mod_files", []))
+    return index
+
+def get_conflict_index(staging_meta_path: str, load_metadata) -> ConflictIndex:
+    """Process-wide index for a staging folder, built from the metadata the first time it is needed"""
+    key = str(staging_meta_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is None:
+        index = build_conflict_index(load_metadata(key))
+        with _indexes_lock:
+            index = _indexes.setdefault(key, index)
+    return index
+
+def drop_conflict_index(staging_meta_path: str = None):
+    with _indexes_lock:
+        if staging_meta_path is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(str(staging_meta_path), None)
@@ -0,0 +1,432 @@
+import errno
+import fcntl
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from core.path_trie import PathTrie
+
+# Files handed to a worker at once, keeps the pool overhead low on packs with tens of thousands of files
+BATCH_SIZE = 256
+
+# Strategy asked for -> strategies tried in order, the next one is used as soon as the filesystem refuses one
+STRATEGY_FALLBACKS = {
+    "symlink": ("symlink",),
+    "hardlink": ("hardlink", "copy"),
+    "reflink": ("reflink", "hardlink", "copy"),
+    "copy": ("copy",),
+}
+DEPLOYMENT_STRATEGIES = tuple(STRATEGY_FALLBACKS)
+# Strategies placing a real file, recognised by its inode rather than by where it points
+REAL_FILE_STRATEGIES = ("hardlink", "reflink", "copy")
+# Errors meaning "this filesystem can not do that", as opposed to a problem with one file
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM, errno.EINVAL, errno.ENOTTY, errno.EMLINK, errno.ENOSYS}
+# _IOW(0x94, 9, int), shares the extents of a file on btrfs/xfs instead of copying its content
+FICLONE = 0x40049409
+
+def _place_hardlink(source_item: str, link_item: str):
+    os.link(source_item, link_item)
+
+def _place_reflink(source_item: str, link_item: str):
+    with open(source_item, 'rb') as source:
+        fd = os.open(link_item, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(fd, FICLONE, source.fileno())
+        except OSError:
+            os.close(fd)
+            os.unlink(link_item)
+            raise
+        os.close(fd)
+    shutil.copystat(source_item, link_item)
+
+def _place_copy(source_item: str, link_item: str):
+    with open(source_item, 'rb') as source, open(link_item, 'xb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    shutil.copystat(source_item, link_item)
+
+_PLACERS = {
+    "symlink": os.symlink,
+    "hardlink": _place_hardlink,
+    "reflink": _place_reflink,
+    "copy": _place_copy,
+}
+
+class _StrategyChain:
+    """Current strategy of a deployment run, shared by the workers"""
+
+    def __init__(self, strategy: str):
+        self.strategies = STRATEGY_FALLBACKS.get(strategy, STRATEGY_FALLBACKS["symlink"])
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def current(self) -> Optional[str]:
+        return self.strategies[self.position] if self.position < len(self.strategies) else None
+
+    def demote(self, failed: str) -> Optional[str]:
+        with self.lock:
+            if self.current() == failed:
+                self.position += 1
+            return self.current()
+
+def default_worker_count() -> int:
+    return min(16, (os.cpu_count() or 1) * 2)
+
+class DeploymentResult:
+    """Outcome of a deployment run, replaces the per-file prints"""
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.done = 0
+        self.linked = []
+        self.unlinked = []
+        self.skipped = []
+        self.missing = []
+        self.errors = []
+        self.created_dirs = []
+        self.removed_dirs = []
+        self.folded_dirs = []
+        self.unfolded_dirs = []
+        # Skipped paths whose deployment record no longer matches the file there (replaced or removed by someone else)
+        self.stale = []
+        # (path, strategy, inode) of everything placed in the destination
+        self.records = []
+        self._lock = threading.Lock()
+
+    @property
+    def success(self) -> bool:
+        return not self.errors
+
+    def merge(self, linked=(), unlinked=(), skipped=(), missing=(), errors=(), records=(), stale=()) -> int:
+        with self._lock:
+            self.records.extend(records)
+            self.stale.extend(stale)
+            self.linked.extend(linked)
+            self.unlinked.extend(unlinked)
+            self.skipped.extend(skipped)
+            self.missing.extend(missing)
+            self.errors.extend(errors)
+            self.done += len(linked) + len(unlinked) + len(skipped) + len(missing) + len(errors)
+            return self.done
+
+    def summary(self) -> str:
+        parts = [f"{len(self.linked)} linked", f"{len(self.unlinked)} unlinked", f"{len(self.skipped)} skipped"]
+        if self.missing:
+            parts.append(f"{len(self.missing)} missing in staging")
+        if self.errors:
+            parts.append(f"{len(self.errors)} errors")
+        return ", ".join(parts)
+
+def _parent_dirs(relative_paths: list) -> list:
+    """Every directory needed by relative_paths, each listed once, shallowest first"""
+    dirs = set()
+    for relative_path in relative_paths:
+        parent = os.path.dirname(relative_path)
+        while parent and parent not in dirs:
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+    return sorted(dirs, key=lambda path: (path.count("/"), path))
+
+def _is_below(relative_path: str, directories: set) -> bool:
+    parent = os.path.dirname(relative_path)
+    while parent:
+        if parent in directories:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+def _has_inode(path: str, inode: int) -> bool:
+    """Whether path is still the file NOMM placed there, whatever its content"""
+    try:
+        return os.lstat(path).st_ino == inode
+    except FileNotFoundError:
+        return False
+
+def _points_to(link_path: str, target_path: str) -> bool:
+    """A symlink is matched on the path it holds, so it is still recognised once its target is gone"""
+    try:
+        if os.path.islink(link_path):
+            link_target = os.path.join(os.path.dirname(link_path), os.readlink(link_path))
+            if os.path.normpath(link_target) == os.path.normpath(target_path):
+                return True
+        return os.path.samefile(link_path, target_path)
+    except OSError:
+        return False
+
+def _covers_dir(source_dir: str, relative_dir: str, path_tree: PathTrie) -> bool:
+    """True when path_tree holds every file found in source_dir"""
+    if not path_tree.count(relative_dir):
+        return False
+    for root, dirs, files in os.walk(source_dir):
+        relative_root = os.path.normpath(os.path.join(relative_dir, os.path.relpath(root, source_dir)))
+        for file_name in files:
+            if f"{relative_root}/{file_name}" not in path_tree:
+                return False
+    return True
+
+def _batches(items: list, size: int = BATCH_SIZE):
+    # Sorted so a batch mostly stays in one directory, workers then rarely contend on the same directory lock
+    items = sorted(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class DeploymentExecutor:
+    """Links or unlinks a set of files between a staging folder and a destination.
+
+    Directories are created once, shallowest first, then the per-file syscalls are spread over
+    a bounded thread pool. Progress is reported as (done, total) after each batch."""
+
+    def __init__(self, max_workers: int = None, progress_callback: Optional[Callable[[int, int], None]] = None):
+        self.max_workers = max_workers or default_worker_count()
+        self.progress_callback = progress_callback
+
+    def _run(self, files: list, worker: Callable, result: DeploymentResult):
+        batches = list(_batches(files))
+        if len(batches) <= 1 or self.max_workers <= 1:
+            for batch in batches:
+                self._report(result, worker(batch))
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for outcome in pool.map(worker, batches):
+                self._report(result, outcome)
+
+    def _report(self, result: DeploymentResult, outcome: dict):
+        done = result.merge(**outcome)
+        if self.progress_callback:
+            self.progress_callback(done, result.total)
+
+    def create_dirs(self, dest_dir: str, relative_paths: list, result: DeploymentResult):
+        for relative_dir in _parent_dirs(relative_paths):
+            try:
+                os.mkdir(os.path.join(dest_dir, relative_dir))
+                result.created_dirs.append(relative_dir)
+            except FileExistsError:
+                pass
+            except OSError as e:
+                result.errors.append((relative_dir, str(e)))
+
+    def unfold_dir(self, dest_dir: str, relative_dir: str, result: DeploymentResult):
+        """Replaces a directory symlink by a real directory holding one symlink per file"""
+        link_dir = os.path.join(dest_dir, relative_dir)
+        target_dir = os.path.join(os.path.dirname(link_dir), os.readlink(link_dir))
+        os.unlink(link_dir)
+        os.mkdir(link_dir)
+        result.created_dirs.append(relative_dir)
+        for root, dirs, files in os.walk(target_dir):
+            relative_root = os.path.relpath(root, target_dir)
+            for dir_name in dirs:
+                os.makedirs(os.path.join(link_dir, relative_root, dir_name), exist_ok=True)
+                result.created_dirs.append(os.path.normpath(os.path.join(relative_dir, relative_root, dir_name)))
+            for file_name in files:
+                os.symlink(os.path.join(root, file_name), os.path.join(link_dir, relative_root, file_name))
+        result.unfolded_dirs.append(relative_dir)
+
+    def _prepare_folds(self, source_dir: str, dest_dir: str, relative_paths: list, fold_dirs: list, result: DeploymentResult) -> set:
+        """Unfolds directories linked by other mods and picks the directories this mod can link as a whole"""
+        folded = set()
+        for relative_dir in _parent_dirs(relative_paths):
+            link_dir = os.path.join(dest_dir, relative_dir)
+            if not os.path.islink(link_dir) or _is_below(relative_dir, folded):
+                continue
+            if _points_to(link_dir, os.path.join(source_dir, relative_dir)):
+                # Already folded by this mod on a previous deployment
+                folded.add(relative_dir)
+                continue
+            try:
+                self.unfold_dir(dest_dir, relative_dir, result)
+            except OSError as e:
+                result.errors.append((relative_dir, str(e)))
+
+        for relative_dir in fold_dirs or ():
+            # Topmost directories only, and only when nothing exists there in the game folder yet
+            if _is_below(relative_dir, folded) or relative_dir in folded:
+                continue
+            if os.path.lexists(os.path.join(dest_dir, relative_dir)):
+                continue
+            folded.add(relative_dir)
+            result.folded_dirs.append(relative_dir)
+        return folded
+
+    def link(self, source_dir: str, dest_dir: str, relative_paths: list, fold_dirs: list = None,
+             strategy: str = "symlink", replaceable: dict = None) -> DeploymentResult:
+        """Deploys source_dir/path to dest_dir/path, replacing what other mods deployed there
+
+        strategy picks how files are placed (see STRATEGY_FALLBACKS), replaceable maps the paths deployed
+        by other mods as real files (hardlinks, reflinks, copies) to the inode they were placed with: they are
+        only replaced while that inode is still there. Symlinks are always replaceable.
+        fold_dirs lists directories this mod is the only provider of, shallowest first: those are
+        linked as a single directory symlink when they do not exist in dest_dir."""
+        source_dir = str(source_dir)
+        dest_dir = str(dest_dir)
+        replaceable = replaceable or {}
+        result = DeploymentResult(len(relative_paths))
+        os.makedirs(dest_dir, exist_ok=True)
+
+        # Directories can only be folded with symlinks
+        folded = self._prepare_folds(source_dir, dest_dir, relative_paths, fold_dirs if strategy == "symlink" else None, result)
+        if folded:
+            below_folds = [path for path in relative_paths if _is_below(path, folded)]
+            relative_paths = [path for path in relative_paths if not _is_below(path, folded)]
+            self.create_dirs(dest_dir, relative_paths + list(folded), result)
+            for relative_dir in result.folded_dirs:
+                try:
+                    os.symlink(os.path.join(source_dir, relative_dir), os.path.join(dest_dir, relative_dir), target_is_directory=True)
+                except OSError as e:
+                    result.errors.append((relative_dir, str(e)))
+            result.merge(linked=below_folds, records=[(path, "folded", None) for path in below_folds])
+        else:
+            self.create_dirs(dest_dir, relative_paths, result)
+
+        chain = _StrategyChain(strategy)
+
+        def place(source_item: str, link_item: str) -> tuple:
+            # Walks down the fallback chain until a strategy works for this filesystem
+            current = chain.current()
+            while True:
+                try:
+                    _PLACERS[current](source_item, link_item)
+                    inode = None if current == "symlink" else os.lstat(link_item).st_ino
+                    return current, inode
+                except FileExistsError:
+                    raise
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED_ERRNOS:
+                        raise
+                    next_strategy = chain.demote(current)
+                    if next_strategy is None:
+                        raise
+                    if next_strategy != current:
+                        print(f"{current} is not supported in {dest_dir}, falling back to {next_strategy}")
+                    current = next_strategy
+
+        def worker(batch: list) -> dict:
+            outcome = {"linked": [], "skipped": [], "missing": [], "errors": [], "records": [], "stale": []}
+            for relative_path in batch:
+                source_item = os.path.join(source_dir, relative_path)
+                link_item = os.path.join(dest_dir, relative_path)
+                if not os.path.exists(source_item):
+                    outcome["missing"].append(relative_path)
+                    continue
+                try:
+                    # Optimistic path: most of the time nothing is in the way
+                    outcome["records"].append((relative_path, *place(source_item, link_item)))
+                    outcome["linked"].append(relative_path)
+                    continue
+                except FileExistsError:
+                    pass
+                except OSError as e:
+                    outcome["errors"].append((relative_path, str(e)))
+                    continue
+                try:
+                    is_link = os.path.islink(link_item)
+                    if is_link and _points_to(link_item, source_item):
+                        outcome["skipped"].append(relative_path)
+                        outcome["records"].append((relative_path, "symlink", None))
+                    elif not is_link and os.path.samefile(source_item, link_item):
+                        # Already hardlinked to the staging file
+                        outcome["skipped"].append(relative_path)
+                        outcome["records"].append((relative_path, "hardlink", os.lstat(link_item).st_ino))
+                    elif is_link or (relative_path in replaceable and _has_inode(link_item, replaceable[relative_path])):
+                        # (Override) what another mod deployed, or a broken link, is replaced
+                        os.unlink(link_item)
+                        outcome["records"].append((relative_path, *place(source_item, link_item)))
+                        outcome["linked"].append(relative_path)
+                    else:
+                        # A real file from the game or the user, it is never touched
+                        outcome["skipped"].append(relative_path)
+                        if relative_path in replaceable:
+                            outcome["stale"].append(relative_path)
+                except OSError as e:
+                    outcome["errors"].append((relative_path, str(e)))
+            return outcome
+
+        self._run(list(relative_paths), worker, result)
+        return result
+
+    def unlink(self, source_dir: str, dest_dir: str, relative_paths: list, prune_dirs: bool = True, records: dict = None, owned_dirs: set = None) -> DeploymentResult:
+        """Removes the links in dest_dir pointing to source_dir, then the folders left empty
+
+        records maps paths to the (strategy, inode) they were deployed with: files placed as real
+        files (hardlink, reflink, copy) are recognised by their inode instead of their content.
+        When owned_dirs is given only those folders (the ones NOMM created) are pruned."""
+        source_dir = str(source_dir)
+        dest_dir = str(dest_dir)
+        records = records or {}
+        result = DeploymentResult(len(relative_paths))
+
+        # Folded directories go first, files must never be unlinked through a directory symlink
+        folded = set()
+        foreign_folds = set()
+        path_tree = None
+        for relative_dir in _parent_dirs(relative_paths):
+            link_dir = os.path.join(dest_dir, relative_dir)
+            if _is_below(relative_dir, folded | foreign_folds) or not os.path.islink(link_dir):
+                continue
+            if not _points_to(link_dir, os.path.join(source_dir, relative_dir)):
+                foreign_folds.add(relative_dir)
+                continue
+            try:
+                if path_tree is None:
+                    path_tree = PathTrie(relative_paths)
+                if _covers_dir(os.path.join(source_dir, relative_dir), relative_dir, path_tree):
+                    os.unlink(link_dir)
+                    folded.add(relative_dir)
+                    result.removed_dirs.append(relative_dir)
+                else:
+                    # Only part of the folded directory goes away (another mod overrides a file), back to per-file links
+                    self.unfold_dir(dest_dir, relative_dir, result)
+            except OSError as e:
+                result.errors.append((relative_dir, str(e)))
+        if folded or foreign_folds:
+            result.merge(
+                unlinked=[path for path in relative_paths if _is_below(path, folded)],
+                skipped=[path for path in relative_paths if _is_below(path, foreign_folds)]
+            )
+            relative_paths = [path for path in relative_paths if not _is_below(path, folded | foreign_folds)]
+
+        def worker(batch: list) -> dict:
+            outcome = {"unlinked": [], "skipped": [], "errors": [], "stale": []}
+            for relative_path in batch:
+                link_item = os.path.join(dest_dir, relative_path)
+                source_item = os.path.join(source_dir, relative_path)
+                strategy, inode = records.get(relative_path, (None, None))
+                try:
+                    if inode is not None and strategy in REAL_FILE_STRATEGIES:
+                        # Still the file we placed if the inode did not change, whatever its content
+                        if _has_inode(link_item, inode):
+                            os.unlink(link_item)
+                            outcome["unlinked"].append(relative_path)
+                        else:
+                            outcome["skipped"].append(relative_path)
+                            outcome["stale"].append(relative_path)
+                    elif os.path.lexists(link_item) and _points_to(link_item, source_item):
+                        os.unlink(link_item)
+                        outcome["unlinked"].append(relative_path)
+                    else:
+                        outcome["skipped"].append(relative_path)
+                        if relative_path in records:
+                            # Replaced since it was deployed (a file of the user's, another link), the record goes, the file stays
+                            outcome["stale"].append(relative_path)
+                except FileNotFoundError:
+                    # Removed by someone else in the meantime
+                    outcome["skipped"].append(relative_path)
+                except OSError as e:
+                    outcome["errors"].append((relative_path, str(e)))
+            return outcome
+
+        self._run(list(relative_paths), worker, result)
+
+        if prune_dirs:
+            # One pass over the affected folders once the whole batch is done, deepest first so parents
+            # are only tried once their children are gone
+            candidates = _parent_dirs(relative_paths + list(folded))
+            if owned_dirs is not None:
+                candidates = [relative_dir for relative_dir in candidates if relative_dir in owned_dirs]
+            for relative_dir in reversed(candidates):
+                try:
+                    os.rmdir(os.path.join(dest_dir, relative_dir))
+                    result.removed_dirs.append(relative_dir)
+                except OSError:
+                    pass
+        return result
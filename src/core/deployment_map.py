@@ -0,0 +1,210 @@
+import os
+import threading
+from collections import Counter
+
+from core.path_trie import PathTrie
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+class _PathState:
+    __slots__ = ("winner", "providers")
+
+    def __init__(self):
+        self.winner = None
+        # Enabled mods providing the path, a tuple since most paths only have one and a set costs 200+ bytes
+        self.providers = ()
+
+class DeploymentMapEngine:
+    """Keeps which enabled mod wins every deployed path.
+
+    The mod that comes last in the load order wins a path. Enabling, disabling or moving a mod
+    only looks at that mod's files and the other mods providing them, and returns the changes
+    in the format apply_deployment_map_changes expects."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # path -> _PathState (winning mod and providers), the winners are the deployment map itself.
+        # Directory nodes tally {enabled mod: number of its files below}, used to fold directories
+        self.paths = PathTrie()
+        self.mod_files = {}
+        self.enabled = set()
+        self.positions = {}
+
+    @staticmethod
+    def _new_changes() -> dict:
+        return {'additions': {}, 'deletions': {}}
+
+    def _providers(self, path: str) -> tuple:
+        state = self.paths.get(path)
+        return state.providers if state is not None else ()
+
+    def _refresh_path(self, path: str, changes: dict):
+        state = self.paths.get(path)
+        if state is None:
+            return
+        current = state.winner
+        new = max(state.providers, key=lambda mod: self.positions.get(mod, -1)) if state.providers else None
+        if new is None:
+            self.paths.pop(path)
+        else:
+            state.winner = new
+        if new != current:
+            self._record(changes, path, current, new)
+
+    @staticmethod
+    def _record(changes: dict, path: str, current_source, new_source):
+        # Merges with an earlier change of the same path so the delta stays relative to what is on disk
+        if path in changes['deletions']:
+            current_source = changes['deletions'].pop(path)
+        elif path in changes['additions']:
+            current_source = changes['additions'].pop(path)['current_source']
+
+        if new_source is None:
+            if current_source is not None:
+                changes['deletions'][path] = current_source
+        elif new_source != current_source:
+            changes['additions'][path] = {
+                'current_source': current_source,
+                'new_source': new_source
+            }
+
+    @staticmethod
+    def _parent_dirs(path: str):
+        parent = os.path.dirname(path)
+        while parent:
+            yield parent
+            parent = os.path.dirname(parent)
+
+    def set_index(self, index: list):
+        with self.lock:
+            self.positions = {mod: position for position, mod in enumerate(index)}
+
+    def set_mod(self, mod: str, files: list, enabled: bool, changes: dict = None) -> dict:
+        """Registers (or re-registers after a reinstall) a mod"""
+        with self.lock:
+            changes = changes if changes is not None else self._new_changes()
+            was_enabled = mod in self.enabled
+            old_files = self.mod_files.get(mod, ())
+            new_files = tuple(dict.fromkeys(files or []))
+            self.mod_files[mod] = new_files
+
+            if was_enabled:
+                for path in old_files:
+                    state = self.paths.get(path)
+                    if state is not None:
+                        state.providers = tuple(provider for provider in state.providers if provider != mod)
+                    self.paths.tally(path, mod, -1)
+                self.enabled.discard(mod)
+            if enabled:
+                self.enabled.add(mod)
+                for path in new_files:
+                    state = self.paths.get(path)
+                    if state is None:
+                        state = _PathState()
+                        self.paths.set(path, state)
+                    if mod not in state.providers:
+                        state.providers += (mod,)
+                    self.paths.tally(path, mod, 1)
+
+            touched = (old_files if was_enabled else ()) + (new_files if enabled else ())
+            for path in dict.fromkeys(touched):
+                self._refresh_path(path, changes)
+            return changes
+
+    def remove_mod(self, mod: str, changes: dict = None) -> dict:
+        with self.lock:
+            changes = self.set_mod(mod, (), False, changes)
+            self.mod_files.pop(mod, None)
+            return changes
+
+    def enable(self, mod: str, changes: dict = None) -> dict:
+        with self.lock:
+            return self.set_mod(mod, self.mod_files.get(mod, ()), True, changes)
+
+    def disable(self, mod: str, changes: dict = None) -> dict:
+        with self.lock:
+            return self.set_mod(mod, self.mod_files.get(mod, ()), False, changes)
+
+    def move(self, mod: str, index: list, changes: dict = None) -> dict:
+        """Applies a new load order where mod changed position, only its own paths can change winner"""
+        with self.lock:
+            changes = changes if changes is not None else self._new_changes()
+            self.set_index(index)
+            if mod in self.enabled:
+                for path in self.mod_files.get(mod, ()):
+                    if len(self._providers(path)) > 1:
+                        self._refresh_path(path, changes)
+            return changes
+
+    def reorder(self, index: list, changes: dict = None) -> dict:
+        """Applies a whole new load order, only the paths of enabled mods that changed position are refreshed"""
+        with self.lock:
+            changes = changes if changes is not None else self._new_changes()
+            old_positions = self.positions
+            self.set_index(index)
+            paths = {}
+            for mod in self.enabled:
+                if old_positions.get(mod) != self.positions.get(mod):
+                    paths.update(dict.fromkeys(
+                        path for path in self.mod_files.get(mod, ()) if len(self._providers(path)) > 1
+                    ))
+            for path in paths:
+                self._refresh_path(path, changes)
+            return changes
+
+    def files_won_by(self, mod: str) -> list:
+        with self.lock:
+            return [path for path in self.mod_files.get(mod, ()) if self.winner_of(path) == mod]
+
+    def winner_of(self, path: str):
+        with self.lock:
+            state = self.paths.get(path)
+            return state.winner if state is not None else None
+
+    def winners_under(self, directory: str) -> dict:
+        """Deployment map restricted to the files below directory"""
+        with self.lock:
+            return {path: state.winner for path, state in self.paths.items(directory) if state.winner is not None}
+
+    def exclusive_dirs(self, mod: str, files: list) -> list:
+        """Directories where files are everything enabled mods provide below them, shallowest first"""
+        with self.lock:
+            counts = Counter()
+            for path in files:
+                counts.update(self._parent_dirs(path))
+            return sorted(
+                (directory for directory, count in counts.items()
+                 if self.paths.tally_of(directory) == {mod: count}),
+                key=lambda directory: (directory.count("/"), directory)
+            )
+
+    def snapshot(self) -> dict:
+        return self.winners_under("")
+
+def build_deployment_engine(staging_metadata: dict) -> DeploymentMapEngine:
+    engine = DeploymentMapEngine()
+    engine.set_index(staging_metadata.get("index", []))
+    for mod in staging_metadata.get("index", []):
+        mod_info = staging_metadata.get("mods", {}).get(mod)
+        if mod_info is not None:
+            engine.set_mod(mod, mod_info.get("mod_files", []), "enabled_timestamp" in mod_info)
+    return engine
+
+def get_deployment_engine(staging_meta_path: str, load_metadata) -> DeploymentMapEngine:
+    """Process-wide engine for a staging folder, built from the metadata the first time it is needed"""
+    key = str(staging_meta_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+    if engine is None:
+        engine = build_deployment_engine(load_metadata(key))
+        with _engines_lock:
+            engine = _engines.setdefault(key, engine)
+    return engine
+
+def drop_deployment_engine(staging_meta_path: str = None):
+    with _engines_lock:
+        if staging_meta_path is None:
+            _engines.clear()
+        else:
+            _engines.pop(str(staging_meta_path), None)
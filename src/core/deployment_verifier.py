@@ -0,0 +1,136 @@
+import os
+
+from core.deployment_executor import REAL_FILE_STRATEGIES
+from core.path_trie import PathTrie
+
+# missing: expected but nothing there, stale: a NOMM file that is not the expected one (wrong mod, leftover),
+# foreign: something NOMM did not deploy is in the way, broken: a link whose target is gone
+ISSUE_TYPES = ("missing", "stale", "foreign", "broken")
+
+def new_report() -> dict:
+    report = {issue: [] for issue in ISSUE_TYPES}
+    report["ok"] = 0
+    report["scanned"] = 0
+    return report
+
+def _needed_dirs(paths) -> set:
+    dirs = {""}
+    for path in paths:
+        parent = os.path.dirname(path)
+        while parent and parent not in dirs:
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+    return dirs
+
+def _is_staged(target: str, staging_root: str) -> bool:
+    # With the separator, so a sibling folder like staging2 does not count as staging
+    return target.startswith(os.path.join(staging_root, ""))
+
+def _placed_by_nomm(record, inode: int) -> bool:
+    """Whether a real file with this inode is the one NOMM recorded, deployed as a real file"""
+    return record is not None and record[1] in REAL_FILE_STRATEGIES and record[2] == inode
+
+def _link_target(entry_path: str) -> str:
+    target = os.readlink(entry_path)
+    if not os.path.isabs(target):
+        target = os.path.normpath(os.path.join(os.path.dirname(entry_path), target))
+    return target
+
+def placed_by_nomm(path: str, record, staging_root: str) -> bool:
+    """Whether the entry at path is one NOMM deployed: a link into staging, or the real file it recorded
+
+    Checked again right before removing anything, the user may have replaced the entry since it was scanned."""
+    if os.path.islink(path):
+        return _is_staged(_link_target(path), str(staging_root))
+    return _placed_by_nomm(record, os.lstat(path).st_ino)
+
+def scan_deployment(dest_dir: str, expected: dict, records: dict, staging_root: str, report: dict = None) -> dict:
+    """Walks dest_dir once with scandir and compares it with what should be deployed
+
+    expected maps relative paths to (mod, staging source path), records maps relative paths to the
+    (mod, strategy, inode) NOMM recorded when deploying. Only the folders leading to those paths are
+    visited, the rest of the game install is never read. Issues are added to report as (dest, path, mod)."""
+    dest_dir = str(dest_dir)
+    staging_root = str(staging_root)
+    report = report if report is not None else new_report()
+    visit = _needed_dirs(list(expected) + list(records))
+    seen = set()
+    # Built on the first folded directory, so each fold only walks the expected files below it
+    expected_tree = None
+
+    def add(issue: str, path: str, mod=None):
+        report[issue].append((dest_dir, path, mod))
+
+    stack = [""]
+    while stack:
+        relative_dir = stack.pop()
+        try:
+            entries = list(os.scandir(os.path.join(dest_dir, relative_dir)))
+        except OSError:
+            # Folder missing, its expected files are reported as missing below
+            continue
+
+        for entry in entries:
+            relative_path = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+            report["scanned"] += 1
+
+            if entry.is_symlink():
+                target = _link_target(entry.path)
+                if relative_path in expected:
+                    seen.add(relative_path)
+                    mod, source = expected[relative_path]
+                    if target != source:
+                        add("stale" if _is_staged(target, staging_root) else "foreign", relative_path, mod)
+                    elif not os.path.exists(entry.path):
+                        add("broken", relative_path, mod)
+                    else:
+                        report["ok"] += 1
+                elif relative_path in visit:
+                    # Folded directory: every expected file below has to resolve through it
+                    if expected_tree is None:
+                        expected_tree = PathTrie()
+                        for expected_path, expected_entry in expected.items():
+                            expected_tree.set(expected_path, expected_entry)
+                    _check_fold(relative_path, target, entry.path, expected_tree, seen, staging_root, add, report)
+                elif _is_staged(target, staging_root):
+                    # Leftover of a mod that is not deployed there anymore
+                    add("stale" if os.path.exists(entry.path) else "broken", relative_path, records.get(relative_path, (None,))[0])
+
+            elif entry.is_dir(follow_symlinks=False):
+                if relative_path in visit:
+                    stack.append(relative_path)
+
+            elif relative_path in expected:
+                seen.add(relative_path)
+                mod, source = expected[relative_path]
+                record = records.get(relative_path)
+                if not _placed_by_nomm(record, entry.inode()):
+                    # A real file NOMM never placed there, or one replaced since
+                    add("foreign", relative_path, mod)
+                elif record[0] != mod:
+                    add("stale", relative_path, mod)
+                else:
+                    report["ok"] += 1
+
+            elif relative_path in records:
+                if _placed_by_nomm(records[relative_path], entry.inode()):
+                    # Real file NOMM deployed (hardlink, reflink, copy) that is not expected anymore
+                    add("stale", relative_path, records[relative_path][0])
+                else:
+                    add("foreign", relative_path, records[relative_path][0])
+
+    for relative_path in expected.keys() - seen:
+        add("missing", relative_path, expected[relative_path][0])
+    return report
+
+def _check_fold(relative_dir: str, target: str, link_path: str, expected_tree: PathTrie, seen: set, staging_root: str, add, report: dict):
+    prefix = relative_dir + "/"
+    target_exists = os.path.isdir(link_path)
+    for relative_path, (mod, source) in expected_tree.items(relative_dir):
+        seen.add(relative_path)
+        if source != os.path.join(target, relative_path[len(prefix):]):
+            add("stale" if _is_staged(target, staging_root) else "foreign", relative_path, mod)
+        elif not target_exists:
+            add("broken", relative_path, mod)
+        else:
+            report["ok"] += 1
@@ -1,6 +1,5 @@
 import os
 import pprint
-import shutil
 from pathlib import Path
 
 # Parsing the fomod from the XML
@@ -234,52 +233,71 @@ def get_plugin_flags(module_data: dict, plugin_name: str, step_index: int = 0, g
             return plugin['condition_flags']
     return []
 
-def apply_fomod_selection(mod_staging_dir: str, source_folder_name: str, dest_path: str) -> list:
+def _find_fomod_source(files: dict, dirs: dict, normalized_source: str):
+    """(path, is_dir) of a FOMOD source in the archive, matched case insensitively like Windows does
 
-    normalized_source = source_folder_name.replace('\\', '/').strip('/')
-    source_path = None
-    
-    direct_path = os.path.join(mod_staging_dir, normalized_source)
-    if os.path.isdir(direct_path):
-        # checks if direct path is the same as source_path, which means all we have to do is copy the files as it is once extracted
-        source_path = direct_path
-    else:
-        # Explore the folder to find normalized source from the root
-        for root, _, files in os.walk(mod_staging_dir):
-            # Calculates relative root and replaces \\ for compatibility
-            rel_root = os.path.relpath(root, mod_staging_dir).replace('\\', '/')
-            #If we find the folder, then we break
-            if rel_root.lower() == normalized_source.lower() or rel_root.lower().endswith('/' + normalized_source.lower()):
-                source_path = root
-                break
-            # To comment
-            for f in files:
-                rel_file = os.path.relpath(os.path.join(root, f), mod_staging_dir).replace('\\', '/')
-                if rel_file.lower() == normalized_source.lower() or rel_file.lower().endswith('/' + normalized_source.lower()):
-                    source_path = os.path.join(root, f)
-                    break
-            if source_path:
-                break
-            
-    if not source_path:
-        raise FileNotFoundError(f"Could not find folder or file '{normalized_source}' in extracted mod.")
+    A source is looked up from the archive root first, then anywhere in the archive for
+    archives that wrap everything in a mod_name/ folder."""
+    source = normalized_source.lower()
+    if source in dirs:
+        return dirs[source], True
+    if source in files:
+        return files[source], False
+    suffix = '/' + source
+    matches = [(path, True) for key, path in dirs.items() if key.endswith(suffix)]
+    matches += [(path, False) for key, path in files.items() if key.endswith(suffix)]
+    if not matches:
+        return None, False
+    # Shallowest match first, folders before files
+    return min(matches, key=lambda match: (match[0].count('/'), not match[1]))
 
-    copied_files = []
-    # As we now handle multiple dest_path we have to build the dest path too
-    if os.path.isdir(source_path):
-        os.makedirs(dest_path, exist_ok=True)
-        shutil.copytree(source_path, dest_path, dirs_exist_ok=True)
-        
-        for root, _, files in os.walk(source_path):
-            for file in files:
-                rel_path = os.path.relpath(os.path.join(root, file), source_path)
-                copied_files.append(rel_path.replace('\\', '/'))
-    else:
-        os.makedirs(dest_path if os.path.isdir(dest_path) else os.path.dirname(dest_path), exist_ok=True)
-        shutil.copy2(source_path, dest_path)
-        copied_files.append(os.path.basename(source_path))
+def plan_fomod_selection(archive_files: list, install_items: list) -> tuple:
+    """Where every file of the selected options goes, without extracting anything
+
+    archive_files are the archive's relative paths (see core.archive_index). Returns
+    ({path in the mod folder: path in the archive}, [errors]), later items overwrite earlier ones."""
+    files = {path.lower(): path for path in archive_files}
+    dirs = {}
+    for path in archive_files:
+        parent = os.path.dirname(path)
+        while parent and parent.lower() not in dirs:
+            dirs[parent.lower()] = parent
+            parent = os.path.dirname(parent)
+
+    targets = {}
+    target_dirs = set()
+    errors = []
+    for install_item in install_items:
+        install_source = install_item.get('source')
+        if not install_source:
+            continue
+        install_destination = install_item.get('destination') or ""
+
+        normalized_source = install_source.replace('\\', '/').strip('/')
+        source_path, is_dir = _find_fomod_source(files, dirs, normalized_source)
+        if source_path is None:
+            errors.append(f"Could not find folder or file '{normalized_source}' in the archive.")
+            continue
+
+        destination = install_destination.replace('\\', '/')
+        if is_dir:
+            prefix = source_path + '/'
+            planned = [(path[len(prefix):], path) for path in archive_files if path.startswith(prefix)]
+        elif not destination.strip('/') or destination.endswith('/') or destination.strip('/') in target_dirs:
+            # Copied inside the destination folder, otherwise the destination is the file's new path
+            planned = [(os.path.basename(source_path), source_path)]
+        else:
+            planned = [("", source_path)]
+
+        for relative_path, archive_path in planned:
+            target = os.path.normpath(os.path.join(destination.strip('/'), relative_path)).replace('\\', '/')
+            targets[target] = archive_path
+            parent = os.path.dirname(target)
+            while parent:
+                target_dirs.add(parent)
+                parent = os.path.dirname(parent)
 
-    return copied_files
+    return targets, errors
 
 def dump_fomod_data(module_data: dict):
     pprint.pprint(module_data, indent=2, width=120)
@@ -1,8 +1,6 @@
 
 import os
 
-import yaml
-
 from gi.repository import GLib
 
 from core.user_config import update_user_config
@@ -35,12 +33,8 @@ def scan_all_games(game_configs_dir):
             continue
 
         yaml_path = os.path.join(game_configs_dir, filename)
-        try:
-            with open(yaml_path, 'r', encoding='utf-8') as f:
-                yaml_data = yaml.safe_load(f) or {}
-        except Exception as e:
-            print(f"[!] Error processing {filename}: {e}, skipping")
-            continue
+        # Through load_yaml, a config written a moment ago may still be waiting for the metadata writer
+        yaml_data = load_yaml(yaml_path)
 
         if not yaml_data.get("name") or "mods_path" not in yaml_data:
             print("[!] Missing required information in YAML file, skipping...")
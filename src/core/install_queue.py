@@ -0,0 +1,147 @@
+import bisect
+import itertools
+import threading
+from typing import Callable
+
+from core.user_config import load_user_config
+
+# Each install already spreads large zips over several threads (see core.archive_backends),
+# a couple at a time keeps the disk busy without thrashing it
+DEFAULT_PARALLEL_INSTALLS = 2
+
+def default_install_workers() -> int:
+    return max(1, int((load_user_config() or {}).get("parallel_installs") or DEFAULT_PARALLEL_INSTALLS))
+
+class InstallQueue:
+    """Runs installs a few at a time, in the order they were asked for.
+
+    A job is work(cancel_event) run on one of the worker threads, on_done(result, error) is called
+    from that thread once it returns. Interactive steps (FOMOD dialogs) go through request_interaction,
+    which shows them one at a time, earliest install first."""
+
+    def __init__(self, workers: int = None, on_change: Callable[[], None] = None):
+        self.workers = workers or default_install_workers()
+        self.on_change = on_change
+        self._condition = threading.Condition()
+        self._orders = itertools.count()
+        # key -> {'order', 'work', 'on_done', 'cancel_event', 'running'}
+        self._jobs = {}
+        # (order, key) of the jobs waiting for a worker, sorted
+        self._pending = []
+        # (order, tiebreak, show) of the interactive steps waiting for the current one
+        self._interactions = []
+        self._interacting = False
+        self._threads = []
+
+    def __contains__(self, key) -> bool:
+        with self._condition:
+            return key in self._jobs
+
+    def is_running(self, key) -> bool:
+        with self._condition:
+            return key in self._jobs and self._jobs[key]['running']
+
+    def position(self, key):
+        """1 for the next job to start, None when the job is running or not queued"""
+        with self._condition:
+            for index, (_, pending_key) in enumerate(self._pending):
+                if pending_key == key:
+                    return index + 1
+        return None
+
+    def submit(self, key, work: Callable, on_done: Callable = None, order: int = None):
+        """Queues work under key, returns its order or None when key is already queued
+
+        Passing back the order of an earlier job (an install continuing after its FOMOD dialog)
+        keeps its place ahead of the installs asked for after it."""
+        with self._condition:
+            if key in self._jobs:
+                return None
+            if order is None:
+                order = next(self._orders)
+            self._jobs[key] = {
+                'order': order,
+                'work': work,
+                'on_done': on_done,
+                'cancel_event': threading.Event(),
+                'running': False
+            }
+            bisect.insort(self._pending, (order, key))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        self._changed()
+        return order
+
+    def cancel(self, key) -> bool:
+        """Drops a queued job (its on_done gets no result) or asks a running one to stop"""
+        with self._condition:
+            job = self._jobs.get(key)
+            if job is None:
+                return False
+            if job['running']:
+                job['cancel_event'].set()
+                return True
+            del self._jobs[key]
+            self._pending.remove((job['order'], key))
+        if job['on_done']:
+            job['on_done'](None, None)
+        self._changed()
+        return True
+
+    def request_interaction(self, order: int, show: Callable):
+        """Calls show(done) once no other interactive step is open, done() must be called when it closes"""
+        with self._condition:
+            bisect.insort(self._interactions, (order, next(self._orders), show))
+        self._next_interaction()
+
+    def _next_interaction(self):
+        with self._condition:
+            if self._interacting or not self._interactions:
+                return
+            self._interacting = True
+            _, _, show = self._interactions.pop(0)
+
+        released = threading.Event()
+        def done():
+            # Closing a dialog twice must not let two others open
+            if released.is_set():
+                return
+            released.set()
+            with self._condition:
+                self._interacting = False
+            self._next_interaction()
+        show(done)
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                _, key = self._pending.pop(0)
+                job = self._jobs[key]
+                job['running'] = True
+            self._changed()
+
+            result, error = None, None
+            try:
+                result = job['work'](job['cancel_event'])
+            except Exception as e:
+                print(f"Install of {key} failed: {e}")
+                error = e
+
+            with self._condition:
+                self._jobs.pop(key, None)
+            if job['on_done']:
+                # A failing callback must not take the worker down with it, the queue would stall
+                try:
+                    job['on_done'](result, error)
+                except Exception as e:
+                    print(f"Error after the install of {key}: {e}")
+            self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
@@ -0,0 +1,159 @@
+import os
+import threading
+from typing import Callable, Iterable
+
+import yaml
+
+_cache = {}
+_cache_lock = threading.Lock()
+# Marks entries holding data that is queued for writing, those are valid whatever the file on disk says
+_PENDING = object()
+
+class MetadataView(dict):
+    """Shallow view of a cached metadata dict.
+
+    Nested dicts and lists are only copied the first time they are reached through the view,
+    so callers can freely mutate what they get back without touching the cached data,
+    and untouched branches (e.g. other mods' file lists) are never copied at all."""
+
+    __slots__ = ("_owned",)
+
+    def __init__(self, source=()):
+        super().__init__(source)
+        self._owned = set()
+
+    def _own(self, key):
+        value = dict.__getitem__(self, key)
+        if key not in self._owned:
+            if isinstance(value, dict):
+                value = MetadataView(value)
+                dict.__setitem__(self, key, value)
+            elif isinstance(value, list):
+                value = _copy_list(value)
+                dict.__setitem__(self, key, value)
+            self._owned.add(key)
+        return value
+
+    def __getitem__(self, key):
+        return self._own(key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._owned.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._owned.discard(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def get(self, key, default=None):
+        if key in self:
+            return self._own(key)
+        return default
+
+    def values(self):
+        return [self._own(key) for key in self]
+
+    def items(self):
+        return [(key, self._own(key)) for key in self]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self._own(key)
+            dict.__delitem__(self, key)
+            self._owned.discard(key)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self._own(key)
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        dict.update(self, other)
+        self._owned.update(other.keys())
+
+    def copy(self):
+        return MetadataView(self)
+
+def _copy_list(values: list) -> list:
+    copied = list(values)
+    # Most cached lists are plain strings (mod_files, index), only nested containers need wrapping
+    if any(isinstance(value, (dict, list)) for value in copied):
+        copied = [MetadataView(value) if isinstance(value, dict) else _copy_list(value) if isinstance(value, list) else value for value in copied]
+    return copied
+
+def plain_copy(value):
+    """Recursive copy of a metadata structure into plain dicts and lists"""
+    if isinstance(value, dict):
+        return {key: plain_copy(item) for key, item in dict.items(value)}
+    if isinstance(value, list):
+        return [plain_copy(item) for item in value]
+    return value
+
+# Views are dumped like regular dicts
+yaml.SafeDumper.add_representer(MetadataView, yaml.representer.SafeRepresenter.represent_dict)
+
+def _stat_key(paths: Iterable[str]) -> tuple:
+    key = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            key.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            key.append(None)
+    return tuple(key)
+
+def load_cached(path: str, loader: Callable[[], dict], validator_paths: Iterable[str] = None, version=None) -> MetadataView:
+    """Returns a view of the metadata stored at path, only calling loader when the files backing it changed on disk
+
+    version replaces the stat of the files for stores keeping their own change counter."""
+    path = str(path)
+    if version is not None:
+        stat_key = ("version", version)
+    else:
+        validator_paths = tuple(str(p) for p in validator_paths) if validator_paths else (path,)
+        stat_key = _stat_key(validator_paths)
+
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry and (entry[0] is _PENDING or entry[0] == stat_key):
+            return MetadataView(entry[1])
+
+    data = loader()
+    if not isinstance(data, dict):
+        return data
+
+    with _cache_lock:
+        entry = _cache.get(path)
+        if not (entry and entry[0] is _PENDING):
+            _cache[path] = (stat_key, data)
+    return MetadataView(data)
+
+def set_pending(path: str, data: dict):
+    """Serves data for path until it has been written to disk"""
+    with _cache_lock:
+        _cache[str(path)] = (_PENDING, data)
+
+def release_pending(path: str, data: dict):
+    """Called once data has been written, a newer pending write for the same path is kept"""
+    with _cache_lock:
+        entry = _cache.get(str(path))
+        if entry and entry[1] is data:
+            del _cache[str(path)]
+
+def invalidate_cached(path: str = None):
+    """Drops the cached metadata for path, or the whole cache"""
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(str(path), None)
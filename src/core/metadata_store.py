@@ -0,0 +1,423 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
+
+import yaml
+
+STAGING_METADATA_NAME = ".staging.nomm.yaml"
+STAGING_DATABASE_NAME = ".staging.nomm.db"
+SCHEMA_VERSION = 7
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+# Metadata values are stored as JSON, datetimes are tagged so they come back as the same type PyYAML used to give us
+def _encode_value(value) -> str:
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {"__datetime__": obj.isoformat()}
+        if isinstance(obj, date):
+            return {"__date__": obj.isoformat()}
+        raise TypeError(f"Object of type {type(obj).__name__} can not be stored in the staging database")
+    return json.dumps(value, default=default, ensure_ascii=False, sort_keys=True)
+
+def _decode_value(raw: str):
+    def object_hook(obj):
+        if len(obj) == 1:
+            if "__datetime__" in obj:
+                return datetime.fromisoformat(obj["__datetime__"])
+            if "__date__" in obj:
+                return date.fromisoformat(obj["__date__"])
+        return obj
+    return json.loads(raw, object_hook=object_hook)
+
+def is_staging_metadata_path(path: str) -> bool:
+    return os.path.basename(str(path)) == STAGING_METADATA_NAME
+
+class StagingStore:
+    """Transactional SQLite backend for the staging metadata (mods, mod files, load order and info)"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        # Last state written to/read from the database, used to only touch the rows that changed
+        self._snapshot = None
+
+    def _create_schema(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN")
+            cursor.execute("CREATE TABLE IF NOT EXISTS mods (name TEXT PRIMARY KEY, data TEXT NOT NULL, has_files INTEGER NOT NULL DEFAULT 0)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS mod_files (mod TEXT NOT NULL, seq INTEGER NOT NULL, path TEXT NOT NULL, PRIMARY KEY (mod, seq))")
+            cursor.execute("CREATE INDEX IF NOT EXISTS mod_files_path ON mod_files (path)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS load_order (position INTEGER PRIMARY KEY, mod TEXT NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # What is actually deployed in the game folders and how, so undeploying never has to compare files
+            cursor.execute("CREATE TABLE IF NOT EXISTS deployed_files (dest TEXT NOT NULL, path TEXT NOT NULL, mod TEXT NOT NULL, strategy TEXT NOT NULL, inode INTEGER, PRIMARY KEY (dest, path))")
+            cursor.execute("CREATE INDEX IF NOT EXISTS deployed_files_mod ON deployed_files (mod)")
+            # Folders NOMM created in the game folders, the only ones it is allowed to remove again
+            cursor.execute("CREATE TABLE IF NOT EXISTS created_dirs (dest TEXT NOT NULL, path TEXT NOT NULL, PRIMARY KEY (dest, path))")
+            # Content-addressed blobs shared by mod folders, refs counts the mod files pointing to each blob
+            cursor.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL DEFAULT 0)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS mod_blobs (mod TEXT NOT NULL, path TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (mod, path))")
+            # Size and mtime of every staged file, recorded at install time
+            cursor.execute("CREATE TABLE IF NOT EXISTS mod_manifest (mod TEXT NOT NULL, path TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, PRIMARY KEY (mod, path))")
+            # Named profiles, each one an enabled set and a load order
+            cursor.execute("CREATE TABLE IF NOT EXISTS profiles (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            # Write-ahead journal of deployments in progress, cursor is the number of steps already applied
+            cursor.execute("CREATE TABLE IF NOT EXISTS deployment_journal (id INTEGER PRIMARY KEY AUTOINCREMENT, steps TEXT NOT NULL, target TEXT NOT NULL, cursor INTEGER NOT NULL DEFAULT 0, created TEXT NOT NULL)")
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            cursor.execute("COMMIT")
+
+    def get_meta(self, key: str, default=None):
+        row = self.connection.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def generation(self) -> int:
+        """Bumped by every save that changes the metadata. Deployment records, manifests and the journal
+        leave it alone, so the metadata cache is not dropped each time a mod is deployed"""
+        with self.lock:
+            return int(self.get_meta("generation", 0))
+
+    def record_deployment(self, dest: str, mod: str, entries: list):
+        """Stores (path, strategy, inode) entries deployed by mod in dest"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany(
+                "INSERT OR REPLACE INTO deployed_files (dest, path, mod, strategy, inode) VALUES (?, ?, ?, ?, ?)",
+                ((str(dest), path, mod, strategy, inode) for path, strategy, inode in entries)
+            )
+            cursor.execute("COMMIT")
+
+    def forget_deployment(self, dest: str, paths: list):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany("DELETE FROM deployed_files WHERE dest = ? AND path = ?", ((str(dest), path) for path in paths))
+            cursor.execute("COMMIT")
+
+    def record_created_dirs(self, dest: str, paths: list):
+        if not paths:
+            return
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany("INSERT OR IGNORE INTO created_dirs (dest, path) VALUES (?, ?)", ((str(dest), path) for path in paths))
+            cursor.execute("COMMIT")
+
+    def forget_created_dirs(self, dest: str, paths: list):
+        if not paths:
+            return
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany("DELETE FROM created_dirs WHERE dest = ? AND path = ?", ((str(dest), path) for path in paths))
+            cursor.execute("COMMIT")
+
+    def get_created_dirs(self, dest: str) -> set:
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT path FROM created_dirs WHERE dest = ?", (str(dest),))}
+
+    def get_deployment(self, dest: str, paths: list = None) -> dict:
+        """path -> (mod, strategy, inode) for what is deployed in dest, limited to paths when given"""
+        with self.lock:
+            if paths is None:
+                rows = self.connection.execute("SELECT path, mod, strategy, inode FROM deployed_files WHERE dest = ?", (str(dest),))
+                return {path: (mod, strategy, inode) for path, mod, strategy, inode in rows}
+            records = {}
+            paths = list(paths)
+            # Chunked to stay under SQLite's bound parameters limit
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT path, mod, strategy, inode FROM deployed_files WHERE dest = ? AND path IN ({','.join('?' * len(chunk))})",
+                    (str(dest), *chunk)
+                )
+                records.update((path, (mod, strategy, inode)) for path, mod, strategy, inode in rows)
+            return records
+
+    def get_mod_deployment(self, mod: str) -> dict:
+        """dest -> {path: (strategy, inode)} for everything mod has deployed"""
+        with self.lock:
+            deployment = {}
+            for dest, path, strategy, inode in self.connection.execute("SELECT dest, path, strategy, inode FROM deployed_files WHERE mod = ?", (mod,)):
+                deployment.setdefault(dest, {})[path] = (strategy, inode)
+            return deployment
+
+    def set_manifest(self, mod: str, entries: list):
+        """Replaces the manifest of mod with (path, size, mtime_ns) entries"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM mod_manifest WHERE mod = ?", (mod,))
+            cursor.executemany(
+                "INSERT OR REPLACE INTO mod_manifest (mod, path, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                ((mod, path, size, mtime_ns) for path, size, mtime_ns in entries)
+            )
+            cursor.execute("COMMIT")
+
+    def get_manifest(self, mod: str) -> dict:
+        """path -> (size, mtime_ns), empty for mods installed before manifests existed"""
+        with self.lock:
+            rows = self.connection.execute("SELECT path, size, mtime_ns FROM mod_manifest WHERE mod = ?", (mod,))
+            return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def _release_blobs(self, cursor, mod: str) -> list:
+        hashes = [row[0] for row in cursor.execute("SELECT hash FROM mod_blobs WHERE mod = ?", (mod,))]
+        cursor.executemany("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", ((blob_hash,) for blob_hash in hashes))
+        cursor.execute("DELETE FROM mod_blobs WHERE mod = ?", (mod,))
+        orphans = [row[0] for row in cursor.execute("SELECT hash FROM blobs WHERE refs <= 0")]
+        cursor.execute("DELETE FROM blobs WHERE refs <= 0")
+        return orphans
+
+    def set_mod_blobs(self, mod: str, entries: list) -> list:
+        """Points mod at (path, hash, size) blobs, returns the blobs nothing references anymore"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            orphans = set(self._release_blobs(cursor, mod))
+            for path, blob_hash, size in entries:
+                cursor.execute("INSERT OR IGNORE INTO blobs (hash, size, refs) VALUES (?, ?, 0)", (blob_hash, size))
+                cursor.execute("UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (blob_hash,))
+                cursor.execute("INSERT OR REPLACE INTO mod_blobs (mod, path, hash) VALUES (?, ?, ?)", (mod, path, blob_hash))
+                orphans.discard(blob_hash)
+            cursor.execute("COMMIT")
+            return list(orphans)
+
+    def get_mod_blobs(self, mod: str) -> dict:
+        """path -> hash of the blobs mod points at"""
+        with self.lock:
+            return {path: blob_hash for path, blob_hash in self.connection.execute("SELECT path, hash FROM mod_blobs WHERE mod = ?", (mod,))}
+
+    def release_mod_blobs(self, mod: str) -> list:
+        """Drops the references of mod, returns the blobs nothing references anymore"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            orphans = self._release_blobs(cursor, mod)
+            cursor.execute("COMMIT")
+            return orphans
+
+    def blob_stats(self) -> dict:
+        with self.lock:
+            blobs, stored, referenced = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * refs), 0) FROM blobs"
+            ).fetchone()
+        return {"blobs": blobs, "stored_bytes": stored, "referenced_bytes": referenced, "bytes_saved": referenced - stored}
+
+    def get_profiles(self) -> dict:
+        with self.lock:
+            return {name: _decode_value(raw_data) for name, raw_data in self.connection.execute("SELECT name, data FROM profiles ORDER BY name")}
+
+    def get_profile(self, name: str):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM profiles WHERE name = ?", (name,)).fetchone()
+        return _decode_value(row[0]) if row else None
+
+    def set_profile(self, name: str, profile: dict):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO profiles (name, data) VALUES (?, ?)", (name, _encode_value(profile)))
+
+    def delete_profile(self, name: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM profiles WHERE name = ?", (name,))
+
+    def begin_journal(self, steps: list, target: dict) -> int:
+        """Persists a deployment plan before anything is changed on disk, synced so it survives a power loss"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("PRAGMA synchronous=FULL")
+            try:
+                cursor.execute(
+                    "INSERT INTO deployment_journal (steps, target, cursor, created) VALUES (?, ?, 0, ?)",
+                    (_encode_value(steps), _encode_value(target), datetime.now().isoformat())
+                )
+                return cursor.lastrowid
+            finally:
+                cursor.execute("PRAGMA synchronous=NORMAL")
+
+    def advance_journal(self, journal_id: int, position: int):
+        with self.lock:
+            self.connection.execute("UPDATE deployment_journal SET cursor = ? WHERE id = ?", (position, journal_id))
+
+    def end_journal(self, journal_id: int):
+        with self.lock:
+            self.connection.execute("DELETE FROM deployment_journal WHERE id = ?", (journal_id,))
+
+    def get_pending_journals(self) -> list:
+        """(id, steps, target, cursor) of the deployments that never finished, oldest first"""
+        with self.lock:
+            rows = self.connection.execute("SELECT id, steps, target, cursor FROM deployment_journal ORDER BY id").fetchall()
+        return [(journal_id, _decode_value(steps), _decode_value(target), position) for journal_id, steps, target, position in rows]
+
+    def load(self) -> dict:
+        """Reads the whole staging metadata from the database in the same shape as the legacy YAML file"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            files_per_mod = {}
+            # Interned so every reload, the deployment engine and the conflict index share one string per path
+            for mod, path in cursor.execute("SELECT mod, path FROM mod_files ORDER BY mod, seq"):
+                files_per_mod.setdefault(mod, []).append(sys.intern(path))
+
+            mods = {}
+            snapshot_mods = {}
+            for name, raw_data, has_files in cursor.execute("SELECT name, data, has_files FROM mods ORDER BY rowid"):
+                mod_data = _decode_value(raw_data)
+                mod_files = files_per_mod.get(name, [])
+                if has_files:
+                    mod_data["mod_files"] = mod_files
+                mods[name] = mod_data
+                snapshot_mods[name] = (raw_data, tuple(mod_files) if has_files else None)
+
+            index = [row[0] for row in cursor.execute("SELECT mod FROM load_order ORDER BY position")]
+            info = {}
+            snapshot_info = {}
+            for key, raw_value in cursor.execute("SELECT key, value FROM info"):
+                info[key] = _decode_value(raw_value)
+                snapshot_info[key] = raw_value
+
+            self._snapshot = {"mods": snapshot_mods, "index": list(index), "info": snapshot_info}
+            return {"mods": mods, "info": info, "index": index}
+
+    def save(self, data: dict, durable: bool = False) -> bool:
+        """Writes the staging metadata, only touching the rows that differ from the last known state"""
+        with self.lock:
+            if self._snapshot is None:
+                self.load()
+            snapshot = self._snapshot
+            new_mods = {}
+            new_info = {}
+            cursor = self.connection.cursor()
+            # FULL makes SQLite fsync the WAL on commit
+            cursor.execute(f"PRAGMA synchronous={'FULL' if durable else 'NORMAL'}")
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+
+                # Mods and their file lists
+                for name, mod_data in (data.get("mods") or {}).items():
+                    mod_data = dict(mod_data or {})
+                    has_files = "mod_files" in mod_data
+                    mod_files = tuple(mod_data.pop("mod_files", None) or ()) if has_files else None
+                    raw_data = _encode_value(mod_data)
+                    new_mods[name] = (raw_data, mod_files)
+
+                    previous = snapshot["mods"].get(name)
+                    if previous is None:
+                        cursor.execute("INSERT INTO mods (name, data, has_files) VALUES (?, ?, ?)", (name, raw_data, int(has_files)))
+                    elif previous[0] != raw_data or (previous[1] is None) != (mod_files is None):
+                        cursor.execute("UPDATE mods SET data = ?, has_files = ? WHERE name = ?", (raw_data, int(has_files), name))
+
+                    previous_files = previous[1] if previous else None
+                    if previous_files != mod_files:
+                        cursor.execute("DELETE FROM mod_files WHERE mod = ?", (name,))
+                        if mod_files:
+                            cursor.executemany(
+                                "INSERT INTO mod_files (mod, seq, path) VALUES (?, ?, ?)",
+                                ((name, seq, path) for seq, path in enumerate(mod_files))
+                            )
+
+                for name in snapshot["mods"].keys() - new_mods.keys():
+                    cursor.execute("DELETE FROM mods WHERE name = ?", (name,))
+                    cursor.execute("DELETE FROM mod_files WHERE mod = ?", (name,))
+                    cursor.execute("DELETE FROM mod_manifest WHERE mod = ?", (name,))
+
+                # Load order, only the positions that moved are rewritten
+                new_index = list(data.get("index") or [])
+                old_index = snapshot["index"]
+                for position, mod in enumerate(new_index):
+                    if position >= len(old_index) or old_index[position] != mod:
+                        cursor.execute("INSERT OR REPLACE INTO load_order (position, mod) VALUES (?, ?)", (position, mod))
+                if len(old_index) > len(new_index):
+                    cursor.execute("DELETE FROM load_order WHERE position >= ?", (len(new_index),))
+
+                # Info
+                for key, value in (data.get("info") or {}).items():
+                    raw_value = _encode_value(value)
+                    new_info[key] = raw_value
+                    if snapshot["info"].get(key) != raw_value:
+                        cursor.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, raw_value))
+                for key in snapshot["info"].keys() - new_info.keys():
+                    cursor.execute("DELETE FROM info WHERE key = ?", (key,))
+
+                if new_mods != snapshot["mods"] or new_index != old_index or new_info != snapshot["info"]:
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO store_meta (key, value) "
+                        "VALUES ('generation', COALESCE((SELECT CAST(value AS INTEGER) FROM store_meta WHERE key = 'generation'), 0) + 1)"
+                    )
+                cursor.execute("COMMIT")
+            except Exception as e:
+                cursor.execute("ROLLBACK")
+                print(f"Error while writing staging metadata in {self.db_path}: {e}")
+                return False
+
+            self._snapshot = {"mods": new_mods, "index": new_index, "info": new_info}
+            return True
+
+    def import_yaml(self, yaml_path: str) -> bool:
+        """One-time migration of a legacy .staging.nomm.yaml file into the database"""
+        try:
+            with open(yaml_path, 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f) or {}
+        except Exception as e:
+            print(f"Error while migrating {yaml_path}: {e}")
+            return False
+        if not isinstance(data, dict):
+            data = {}
+        if self.save(data):
+            self.set_meta("migrated_from_yaml", datetime.now().isoformat())
+            print(f"Migrated staging metadata from {yaml_path} to {self.db_path}")
+            return True
+        return False
+
+    def export_yaml(self, yaml_path: str) -> bool:
+        """Dumps the database content back to the legacy YAML format"""
+        data = self.load()
+        try:
+            with open(yaml_path, 'w', encoding='utf-8') as f:
+                yaml.safe_dump(data, f, default_flow_style=False)
+            return True
+        except Exception as e:
+            print(f"Error while exporting staging metadata to {yaml_path}: {e}")
+            return False
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def get_staging_store(staging_meta_path: str) -> StagingStore:
+    """Returns the process-wide store for a staging folder, migrating the legacy YAML file on first use"""
+    staging_dir = os.path.dirname(str(staging_meta_path))
+    with _stores_lock:
+        store = _stores.get(staging_dir)
+        if store is None:
+            db_path = os.path.join(staging_dir, STAGING_DATABASE_NAME)
+            store = StagingStore(db_path)
+            if store.get_meta("migrated_from_yaml") is None:
+                yaml_path = os.path.join(staging_dir, STAGING_METADATA_NAME)
+                if os.path.exists(yaml_path):
+                    store.import_yaml(yaml_path)
+                else:
+                    store.set_meta("migrated_from_yaml", "none")
+            _stores[staging_dir] = store
+        return store
+
+def export_staging_metadata(staging_meta_path: str, yaml_path: str = None) -> bool:
+    """Exports the staging database to YAML, next to it by default"""
+    store = get_staging_store(staging_meta_path)
+    if yaml_path is None:
+        yaml_path = os.path.join(os.path.dirname(str(staging_meta_path)), STAGING_METADATA_NAME)
+    return store.export_yaml(yaml_path)
@@ -0,0 +1,127 @@
+import atexit
+import os
+import tempfile
+import threading
+from typing import Callable
+
+import yaml
+
+from core.metadata_cache import plain_copy, release_pending, set_pending
+
+# always: fsync every flush, commit: only fsync explicit commits (shutdown, install...), never: leave it to the OS
+FSYNC_POLICIES = ("always", "commit", "never")
+DEFAULT_DEBOUNCE = 0.5
+
+def atomic_write_yaml(data: dict, path: str, fsync: bool = False) -> bool:
+    """Writes YAML to a temporary file in the same folder then swaps it in, a crash can no longer leave a truncated file"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(data, f, default_flow_style=False)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        tmp_path = None
+        if fsync:
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return True
+    except Exception as e:
+        print(f"Error while writing in {path}: {e}")
+        return False
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class MetadataWriter:
+    """Write-behind service for metadata files.
+
+    Writes to the same path are coalesced: only the latest data is kept and flushed
+    once the debounce delay expires, or straight away at an explicit commit point."""
+
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE, fsync_policy: str = "commit"):
+        self.debounce = debounce
+        self.fsync_policy = fsync_policy
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def configure(self, debounce: float = None, fsync_policy: str = None):
+        if debounce is not None:
+            self.debounce = debounce
+        if fsync_policy is not None:
+            if fsync_policy not in FSYNC_POLICIES:
+                print(f"Unknown metadata fsync policy: {fsync_policy}, keeping {self.fsync_policy}")
+            else:
+                self.fsync_policy = fsync_policy
+
+    def schedule(self, path: str, data: dict, write_fn: Callable[[dict, str, bool], bool] = atomic_write_yaml, commit: bool = False) -> bool:
+        """Queues data to be written to path, readers going through the metadata cache see it immediately
+
+        Returns True once queued, or whether it reached the disk when commit is set."""
+        path = str(path)
+        # Callers keep mutating their dicts after writing them, so we hold on to our own copy
+        snapshot = plain_copy(data)
+        with self._lock:
+            # Under the lock, so the cache and the queue agree on the latest snapshot
+            set_pending(path, snapshot)
+            self._pending[path] = (snapshot, write_fn)
+            if not commit:
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = threading.Timer(self.debounce, self.flush, kwargs={"commit": False})
+                self._timer.daemon = True
+                self._timer.start()
+        if commit:
+            return self.flush(path)
+        return True
+
+    def has_pending(self, path: str = None) -> bool:
+        with self._lock:
+            return bool(self._pending) if path is None else str(path) in self._pending
+
+    def flush(self, path: str = None, commit: bool = True) -> bool:
+        """Writes pending data (for one path, or everything) to disk"""
+        with self._flush_lock:
+            with self._lock:
+                if path is None:
+                    items = list(self._pending.items())
+                    self._pending.clear()
+                    if self._timer is not None:
+                        self._timer.cancel()
+                        self._timer = None
+                elif str(path) in self._pending:
+                    items = [(str(path), self._pending.pop(str(path)))]
+                else:
+                    items = []
+
+            fsync = self.fsync_policy == "always" or (commit and self.fsync_policy == "commit")
+            success = True
+            for item_path, (snapshot, write_fn) in items:
+                if write_fn(snapshot, item_path, fsync):
+                    release_pending(item_path, snapshot)
+                    continue
+                success = False
+                # Stays pending (and served by the cache) until the next flush, unless newer data replaced it meanwhile
+                with self._lock:
+                    self._pending.setdefault(item_path, (snapshot, write_fn))
+            return success
+
+_writer = MetadataWriter()
+
+def get_metadata_writer() -> MetadataWriter:
+    return _writer
+
+def flush_metadata_writes(path: str = None) -> bool:
+    """Explicit commit point: forces pending metadata writes to disk"""
+    return _writer.flush(path, commit=True)
+
+atexit.register(flush_metadata_writes)
@@ -1,24 +1,49 @@
 import os
 import shutil
-import yaml
 import threading
 import subprocess
 from datetime import datetime
 from pathlib import Path
 from typing import List
 from datetime import datetime
-from gi.repository import GLib
 from core.tools import load_yaml, write_yaml
 from core.user_config import load_user_config
+from core.archive_index import get_archive_manifest
 from core.archive_manager import extract_archive
+from core.blob_store import BlobStore
+from core.conflict_index import get_conflict_index
+from core.deployment_executor import (DEPLOYMENT_STRATEGIES, DeploymentExecutor,
+                                      DeploymentResult)
+from core.deployment_map import build_deployment_engine, drop_deployment_engine, get_deployment_engine
+from core.deployment_verifier import new_report, placed_by_nomm, scan_deployment
+from core.metadata_cache import load_cached
+from core.metadata_store import (STAGING_DATABASE_NAME, STAGING_METADATA_NAME,
+                                 get_staging_store, is_staging_metadata_path)
+from core.metadata_writer import flush_metadata_writes, get_metadata_writer
+from core.staging_manifest import (build_manifest, find_missing_files,
+                                   invalidate_missing_files)
 from platforms.steam import add_launch_options
 
 meta_lock = threading.Lock()
 
-#TODO:Change the logic to deploy last mods from the index first
-def deploy_mod_files(staging_dir: str, dest_dir: str, mod_files: list, mod_name: str) -> bool:
-    dest_path = Path(dest_dir)
-    
+def get_deployment_executor(progress_callback=None) -> DeploymentExecutor:
+    user_config = load_user_config() or {}
+    return DeploymentExecutor(user_config.get("deployment_threads"), progress_callback)
+
+def get_deployment_strategy(staging_dir: str) -> str:
+    """How files of this game are placed in the game folder: symlink, hardlink, reflink or copy"""
+    store = get_staging_store(os.path.join(str(staging_dir), STAGING_METADATA_NAME))
+    return store.get_meta("deployment_strategy", "symlink")
+
+def set_deployment_strategy(staging_dir: str, strategy: str) -> bool:
+    # Files already deployed keep the strategy recorded with them, so switching is always safe
+    if strategy not in DEPLOYMENT_STRATEGIES:
+        print(f"Unknown deployment strategy: {strategy}, keeping {get_deployment_strategy(staging_dir)}")
+        return False
+    get_staging_store(os.path.join(str(staging_dir), STAGING_METADATA_NAME)).set_meta("deployment_strategy", strategy)
+    return True
+
+def deploy_mod_files(staging_dir: str, dest_dir: str, mod_files: list, mod_name: str, progress_callback=None) -> DeploymentResult:
     staging_meta_path = os.path.join(Path(staging_dir), ".staging.nomm.yaml")
     staging_metadata = load_staging_metadata(staging_meta_path)
     
@@ -26,49 +51,38 @@ def deploy_mod_files(staging_dir: str, dest_dir: str, mod_files: list, mod_name:
 
     staging_mod_dir = Path(staging_dir) / folder_name
     
-    is_success = True
-
-    for mod_file in mod_files:
-        source_item = Path(staging_mod_dir) / mod_file
-        link_item = Path(dest_path) / mod_file
-
-        if not source_item.exists():
-            print(f"Mod file could not be found while deploying mod : {source_item}")
-            continue
-        
-        # Creates parent folder
-        link_item.parent.mkdir(parents=True, exist_ok=True)
-        
-        # (Override) Delete file if there is conflict
-        if link_item.is_symlink():
-            try:
-                if not os.path.samefile(source_item, link_item):
-                    print(f"Override: replaced {link_item} by {source_item}")
-                    link_item.unlink()
-                else:
-                    print(f"File ignored: {mod_file} was already present in {dest_path}")
-            #TODO: Check error use case
-            except OSError:
-                print(f"Failed to delete {source_item}: {OSError}")
-                
-        # Linking files
-        if not link_item.exists():
-            try:
-                # symlink
-                os.symlink(source_item, link_item)
-                print(f"[+] Successfully linked {source_item}")
-            except Exception as sym_e:
-                print(f"Error creating a Symlink {link_item}: {sym_e}")
-                is_success = False
+    # Optional folding: directories only this mod provides are linked as a whole instead of file by file
+    fold_dirs = None
+    if (load_user_config() or {}).get("deployment_folding", False):
+        fold_dirs = get_deployment_engine(staging_meta_path, load_staging_metadata).exclusive_dirs(mod_name, mod_files)
+    
+    # Files NOMM deployed as real files can be overridden (copies of another mod, or stale copies left by a reinstall)
+    # as long as their inode is the one recorded, anything else that is not a symlink belongs to the game
+    store = get_staging_store(staging_meta_path)
+    replaceable = {
+        path: inode for path, (_, _, inode) in store.get_deployment(dest_dir, mod_files).items()
+        if inode is not None
+    }
+    
+    result = get_deployment_executor(progress_callback).link(
+        staging_mod_dir, dest_dir, mod_files, fold_dirs,
+        strategy=get_deployment_strategy(staging_dir), replaceable=replaceable
+    )
+    # Records of files someone else replaced since would let a later deployment delete them
+    store.forget_deployment(dest_dir, result.stale)
+    store.record_deployment(dest_dir, mod_name, result.records)
+    store.record_created_dirs(dest_dir, result.created_dirs)
+    print(f"Deployed {mod_name}: {result.summary()}")
+    for mod_file, error in result.errors:
+        print(f"Error while deploying {mod_file}: {error}")
     
     # Update game status
-    if not is_success:
-        unlink_mod_files(staging_mod_dir, dest_dir, mod_files)
+    if not result.success:
+        unlink_mod_files(staging_mod_dir, dest_dir, mod_files, mod_name=mod_name)
         staging_metadata["mods"][mod_name].pop("enabled_timestamp", None)
-        write_yaml(staging_metadata, staging_meta_path)
-        return is_success
+        write_staging_metadata(staging_metadata, staging_meta_path)
     
-    return is_success
+    return result
 
 def get_mod_statistics(staging_meta_path: str, downloads_path: str) -> dict:
     stats = {
@@ -114,62 +128,58 @@ def is_mod_installed(archive_filename, staging_metadata) -> bool:
     return False
 
 # Checks if mod files from staging and dest folders are the same and remove the symlink if they are
-def unlink_mod_files(staging_dir: str, dest_dir: str, mod_files: list[str]) -> bool:
-    dest_path = Path(dest_dir)
-    staging_path = Path(staging_dir)
-    
-    success = True
-    
-    for mod_file in mod_files:
-        link_item = dest_path / mod_file
-        source_item = staging_path / mod_file
-
-        if link_item.exists() or link_item.is_symlink():
-            try:
-                if os.path.samefile(source_item, link_item):
-                    link_item.unlink()
-                    print(f"[-] Successfully unlinked {source_item}")
-            except Exception as e:
-                success = False
-                print(f"Failed to unlink {link_item}: {e}")
-
-        current_dir = link_item.parent
-        while current_dir != dest_path:
-            try:
-                current_dir.rmdir()
-            except OSError:
-                break
-            current_dir = current_dir.parent
+def unlink_mod_files(staging_dir: str, dest_dir: str, mod_files: list[str], progress_callback=None, mod_name: str = None) -> DeploymentResult:
+    # staging_dir is the mod folder, the deployment records live in the staging folder above it
+    store = get_staging_store(os.path.join(os.path.dirname(str(staging_dir)), STAGING_METADATA_NAME))
+    records = {
+        path: (strategy, inode)
+        for path, (owner, strategy, inode) in store.get_deployment(dest_dir, mod_files).items()
+        if mod_name is None or owner == mod_name
+    }
+    # Only folders NOMM created are pruned, empty folders shipped with the game stay
+    result = get_deployment_executor(progress_callback).unlink(
+        staging_dir, dest_dir, mod_files, records=records, owned_dirs=store.get_created_dirs(dest_dir)
+    )
+    store.forget_deployment(dest_dir, result.unlinked + result.stale)
+    # Unfolding a directory creates real folders
+    store.record_created_dirs(dest_dir, result.created_dirs)
+    store.forget_created_dirs(dest_dir, result.removed_dirs)
+    for mod_file, error in result.errors:
+        print(f"Failed to unlink {mod_file}: {error}")
     
-    return success
+    return result
 
-def completely_uninstall_mod(staging_dir: str, dest_dir: str, mod_files: list[str]):
-    unlink_mod_files(staging_dir, dest_dir, mod_files)
+def completely_uninstall_mod(staging_dir: str, dest_dir: str, mod_files: list[str], mod_name: str = None):
+    unlink_mod_files(staging_dir, dest_dir, mod_files, mod_name=mod_name)
     
     if os.path.exists(staging_dir):
         shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    # Blobs only this mod used are deleted once its folder is gone
+    if mod_name is not None:
+        get_blob_store(os.path.dirname(str(staging_dir))).release_mod(mod_name)
 
-def check_for_conflicts(staging_meta_path: str) -> list:
-    path_registry = {}
-    staging_metadata = load_staging_metadata(staging_meta_path)
+def get_blob_store(staging_dir: str) -> BlobStore:
+    return BlobStore(staging_dir, get_staging_store(os.path.join(str(staging_dir), STAGING_METADATA_NAME)))
 
-    if not staging_metadata:
-        return []
-
-    for mod in staging_metadata.get("mods", {}):
-        for file_path in staging_metadata["mods"][mod].get("mod_files", []):
-            if file_path not in path_registry:
-                path_registry[file_path] = []
-            path_registry[file_path].append(mod)
-    
-    # Extract only the lists where multiple mods claim the same file
-    conflicts = []
-    for mod_list in path_registry.values():
-        if len(mod_list) > 1:
-            unique_mods = sorted(list(set(mod_list)))
-            if unique_mods not in conflicts:
-                conflicts.append(unique_mods)
+def get_deduplication_stats(staging_dir: str) -> dict:
+    return get_blob_store(staging_dir).stats()
 
+def check_for_conflicts(staging_meta_path: str) -> list:
+    # Answered from the inverted index, which is only updated on install/uninstall
+    return get_conflict_index(staging_meta_path, load_staging_metadata).conflict_groups()
+
+def get_conflicting_mods(staging_meta_path: str, mod_name: str) -> list:
+    return get_conflict_index(staging_meta_path, load_staging_metadata).conflicts_for(mod_name)
+
+def predict_archive_conflicts(archive_path: str, staging_meta_path: str, ignore_mod: str = None) -> dict:
+    """Installed mods the archive would share files with, from its manifest alone. mod -> number of shared files"""
+    conflict_index = get_conflict_index(staging_meta_path, load_staging_metadata)
+    conflicts = {}
+    for path, _, _ in get_archive_manifest(archive_path):
+        for owner in conflict_index.owners_of(path):
+            if owner != ignore_mod:
+                conflicts[owner] = conflicts.get(owner, 0) + 1
     return conflicts
 
 def build_deployment_map(staging_metadata: dict) -> dict:
@@ -177,14 +187,8 @@ def build_deployment_map(staging_metadata: dict) -> dict:
     if not staging_metadata:
         return []
     
-    deployment_map = {}
-    for mod in reversed(staging_metadata["index"]):
-        if "enabled_timestamp" in staging_metadata["mods"][mod]:
-            for file_path in staging_metadata["mods"][mod].get("mod_files", []):
-                if file_path not in deployment_map:
-                    deployment_map[file_path] = mod
-    
-    return deployment_map
+    # Built in the engine's path trie, shared prefixes are only stored once while computing it
+    return build_deployment_engine(staging_metadata).snapshot()
 
 def check_for_deployment_map_change(new_deployment_map: dict, current_deployment_map: dict) -> list:
     changes = {
@@ -206,7 +210,8 @@ def check_for_deployment_map_change(new_deployment_map: dict, current_deployment
     
     return changes
 
-def apply_deployment_map_changes(staging_dir: str, dest_dir: str, changes: dict, mod_name: str) -> bool:
+# Groups a deployment delta per mod: files each mod has to unlink and files each mod has to link
+def group_deployment_changes(changes: dict) -> tuple:
     files_to_unlink = {}
     files_to_link = {}
     
@@ -233,24 +238,129 @@ def apply_deployment_map_changes(staging_dir: str, dest_dir: str, changes: dict,
         
         files_to_unlink[deploying_mod_name].append(file)
     
-    # Starts unlinking files
-    def unlink_files(staging_dir, dest_dir, files_to_unlink, files_to_link):
-        metadata = load_staging_metadata(os.path.join(staging_dir, ".staging.nomm.yaml"))
-        for mod in files_to_unlink:
-            mod_info = metadata["mods"].get(mod, {})
-            folder_name = mod_info.get("folder_name", mod_info.get("display_name", mod))
-            staging_mod_dir = Path(staging_dir) / folder_name
-            unlink_mod_files(staging_mod_dir, dest_dir, files_to_unlink[mod])
-        GLib.idle_add(on_unlink_finish, staging_dir, dest_dir, files_to_link)
-    
-    # Starts deploying files
-    def on_unlink_finish(staging_dir, dest_dir, files_to_link):
-        for mod in files_to_link:
-            if deploy_mod_files(staging_dir, dest_dir, files_to_link[mod], mod) == False:
-                print(f"Error while deploying: {mod}")
-                return False
-    
-    threading.Thread(target=unlink_files, args=(staging_dir, dest_dir, files_to_unlink, files_to_link), daemon=True).start()
+    return files_to_unlink, files_to_link
+
+# Journal ids being applied by this process, recovery leaves them alone
+_running_journals = set()
+_running_journals_lock = threading.Lock()
+
+def plan_deployment_changes(staging_metadata: dict, changes: dict, dest_dir: str = None) -> list:
+    """Turns a deployment delta into ordered steps: every unlink first, then every link"""
+    files_to_unlink, files_to_link = group_deployment_changes(changes)
+    steps = []
+    for action, files_per_mod in (("unlink", files_to_unlink), ("link", files_to_link)):
+        for mod, paths in files_per_mod.items():
+            mod_info = staging_metadata["mods"].get(mod, {})
+            steps.append({
+                "action": action,
+                "mod": mod,
+                "folder": mod_info.get("folder_name", mod_info.get("display_name", mod)),
+                "dest": str(mod_info.get("deployment_path") or dest_dir or ""),
+                "paths": paths
+            })
+    return steps
+
+def _apply_step(staging_dir: str, step: dict, reverse: bool = False) -> bool:
+    action = step["action"]
+    if reverse:
+        action = "link" if action == "unlink" else "unlink"
+    if action == "unlink":
+        return unlink_mod_files(Path(staging_dir) / step["folder"], step["dest"], step["paths"], mod_name=step["mod"]).success
+    return deploy_mod_files(staging_dir, step["dest"], step["paths"], step["mod"]).success
+
+def run_deployment_plan(staging_dir: str, steps: list, target: dict) -> list:
+    """Applies steps behind a write-ahead journal, returns the mods that failed
+
+    target holds the metadata the plan leads to ({"enabled": {mod: state}, "index": load order or None}),
+    recover_deployments compares it with the committed metadata to pick a direction after a crash."""
+    if not steps:
+        return []
+    staging_meta_path = os.path.join(str(staging_dir), STAGING_METADATA_NAME)
+    store = get_staging_store(staging_meta_path)
+    journal_id = store.begin_journal(steps, target)
+    with _running_journals_lock:
+        _running_journals.add(journal_id)
+
+    failed_mods = []
+    try:
+        for position, step in enumerate(steps):
+            if not _apply_step(str(staging_dir), step):
+                print(f"Error while applying {step['action']} of {step['mod']}")
+                failed_mods.append(step["mod"])
+            store.advance_journal(journal_id, position + 1)
+        # Metadata reaches the disk before the journal entry goes away, recover_deployments needs it otherwise
+        if commit_metadata(staging_meta_path):
+            store.end_journal(journal_id)
+        else:
+            print(f"Could not write the metadata of deployment {journal_id}, it will be checked on next start")
+    finally:
+        with _running_journals_lock:
+            _running_journals.discard(journal_id)
+    return failed_mods
+
+def follow_failed_deployments(staging_dir: str, engine, failed_mods: list) -> list:
+    """deploy_mod_files unlinks a mod it could not deploy and marks it as disabled in the metadata: the engine
+    follows, and the files the mod took over from other mods are given back to them. Returns the mods that failed again"""
+    staging_meta_path = os.path.join(str(staging_dir), STAGING_METADATA_NAME)
+    staging_metadata = load_staging_metadata(staging_meta_path)
+    disabled = [mod for mod in dict.fromkeys(failed_mods) if "enabled_timestamp" not in staging_metadata["mods"].get(mod, {})]
+    revert = {'additions': {}, 'deletions': {}}
+    for mod in disabled:
+        engine.disable(mod, revert)
+    failed = run_deployment_plan(staging_dir, plan_deployment_changes(staging_metadata, revert), {"enabled": {mod: False for mod in disabled}, "index": None})
+    if failed:
+        print(f"Could not give back the files of {', '.join(dict.fromkeys(failed))}, verify the deployment to repair it")
+    return failed
+
+def recover_deployments(staging_dir: str) -> dict:
+    """Finishes or undoes deployments interrupted by a crash or by closing NOMM
+
+    When the metadata was committed with the plan's target the remaining steps are applied (roll forward),
+    otherwise the steps already applied are reverted (roll back). The interrupted step is redone both ways,
+    linking and unlinking are idempotent."""
+    staging_meta_path = os.path.join(str(staging_dir), STAGING_METADATA_NAME)
+    store = get_staging_store(staging_meta_path)
+    recovered = {'rolled_forward': 0, 'rolled_back': 0}
+
+    with meta_lock:
+        for journal_id, steps, target, position in store.get_pending_journals():
+            with _running_journals_lock:
+                if journal_id in _running_journals:
+                    continue
+            staging_metadata = load_staging_metadata(staging_meta_path)
+            mods = staging_metadata.get("mods", {})
+            committed = all(
+                ("enabled_timestamp" in mods.get(mod, {})) == state for mod, state in target.get("enabled", {}).items()
+            ) and target.get("index") in (None, staging_metadata.get("index"))
+
+            if committed:
+                print(f"Rolling forward interrupted deployment {journal_id} from step {position + 1}/{len(steps)}")
+                for step in steps[position:]:
+                    _apply_step(str(staging_dir), step)
+                recovered['rolled_forward'] += 1
+            else:
+                print(f"Rolling back interrupted deployment {journal_id} ({position}/{len(steps)} steps applied)")
+                for step in reversed(steps[:position + 1]):
+                    _apply_step(str(staging_dir), step, reverse=True)
+                recovered['rolled_back'] += 1
+            store.end_journal(journal_id)
+
+    if recovered['rolled_forward'] or recovered['rolled_back']:
+        drop_deployment_engine(staging_meta_path)
+    return recovered
+
+def apply_deployment_map_changes(staging_dir: str, dest_dir: str, changes: dict, mod_name: str) -> bool:
+    """Applies a delta in the background, the journal makes it safe to be interrupted"""
+    staging_meta_path = os.path.join(str(staging_dir), STAGING_METADATA_NAME)
+    staging_metadata = load_staging_metadata(staging_meta_path)
+    steps = plan_deployment_changes(staging_metadata, changes, dest_dir)
+    target = {"enabled": {}, "index": list(staging_metadata.get("index", []))}
+
+    def worker():
+        with meta_lock:
+            run_deployment_plan(staging_dir, steps, target)
+
+    threading.Thread(target=worker, daemon=True).start()
     
     return True
 
@@ -333,79 +443,309 @@ def deploy_essential_utility(util_config: dict, downloads_path: str, staging_pat
     if launch_options:
         add_launch_options(steam_base, launch_options, steam_id)
 
-def toggle_mod_state(mod_name: str, mod_files: list, state: bool, staging_dir: str, deployment_map: list) -> dict:
+def toggle_mod_state(mod_name: str, mod_files: list, state: bool, staging_dir: str) -> dict:
     staging_meta_path = os.path.join(staging_dir, ".staging.nomm.yaml")
 
     with meta_lock:
         staging_metadata = load_staging_metadata(staging_meta_path)
 
         if not staging_metadata or mod_name not in staging_metadata.get("mods", {}):
-            return False
+            return {'success': False, 'changes': None}
 
         mod_info = staging_metadata["mods"][mod_name]
         dest_dir = mod_info["deployment_path"]
-        staging_mod_dir = os.path.join(staging_dir, mod_info["folder_name"])
-        mod_files = mod_info.get("mod_files", [])
+        enabled_timestamp = mod_info.get("enabled_timestamp")
 
-        conflicts_exist = check_for_conflicts(staging_meta_path)
-
-        new_deployment_map = {}
-        success = True
+        engine = get_deployment_engine(staging_meta_path, load_staging_metadata)
 
         # state is true so the mod has to be installed/deployed
         if state:
-            # deploy_mod_files return true if it worked, false if it doesn't
             mod_info["enabled_timestamp"] = datetime.now()
-            write_yaml(staging_metadata, staging_meta_path)
-            if conflicts_exist:
-                new_deployment_map = build_deployment_map(staging_metadata)
-                if deployment_map != new_deployment_map:
-                    changes = check_for_deployment_map_change(new_deployment_map, deployment_map)
-                    success = apply_deployment_map_changes(staging_dir, dest_dir, changes, mod_name)
-            else:
-                if deploy_mod_files(staging_dir, dest_dir, mod_files, mod_name):
-                    for mod_file in mod_files:
-                        deployment_map[mod_file] = mod_name
-                    print(f"Successfully deployed mod: {mod_name}")
-                else:
-                    success = False
+            changes = engine.enable(mod_name)
         # state is false, deleting the datas and ensure metadata are set to proper value
         else:
             # Pop is a safety measure to prevent a crash for a missing key
             mod_info.pop("enabled_timestamp", None)
-            write_yaml(staging_metadata, staging_meta_path)
-            # If there is a conflict mods have to be reloaded in case you unloaded a mod that did an override
-            if conflicts_exist:
-                # Recalculating mod files
-                new_deployment_map = build_deployment_map(staging_metadata)
-                if deployment_map != new_deployment_map:
-                    changes = check_for_deployment_map_change(new_deployment_map, deployment_map)
-                    success = apply_deployment_map_changes(staging_dir, dest_dir, changes, mod_name)
-            else:
-                if unlink_mod_files(staging_mod_dir, dest_dir, mod_files):
-                    for mod_file in mod_files:
-                        del deployment_map[mod_file]
-                    print(f"Successfully removed mod: {mod_name}")
-                else:
-                    success = False
-        
-        # Update deployment map
-        if success and conflicts_exist:
-            deployment_map = new_deployment_map
-        
+            changes = engine.disable(mod_name)
+        write_staging_metadata(staging_metadata, staging_meta_path)
+
+        # Only the toggled mod's files, plus the files it overrides or gives back to other mods, are touched
+        steps = plan_deployment_changes(staging_metadata, changes, dest_dir)
+        failed_mods = run_deployment_plan(staging_dir, steps, {"enabled": {mod_name: state}, "index": None})
+        success = not failed_mods
+        if success:
+            print(f"Successfully {'deployed' if state else 'removed'} mod: {mod_name}")
+
+        # Keeps the engine and the game folder in line with the metadata
+        if not success:
+            follow_failed_deployments(staging_dir, engine, failed_mods)
+            if not state and mod_name in failed_mods:
+                # The mod could not be fully removed, it stays enabled and gets back what other mods took over
+                staging_metadata = load_staging_metadata(staging_meta_path)
+                staging_metadata["mods"][mod_name]["enabled_timestamp"] = enabled_timestamp or datetime.now()
+                write_staging_metadata(staging_metadata, staging_meta_path)
+                revert = engine.enable(mod_name)
+                steps = plan_deployment_changes(staging_metadata, revert, dest_dir)
+                if run_deployment_plan(staging_dir, steps, {"enabled": {mod_name: True}, "index": None}):
+                    print(f"Could not restore the deployment of {mod_name}, verify the deployment to repair it")
+
         deployment_output = {
             'success': success,
-            'deployment_map': deployment_map
+            'changes': changes
         }
         
         return deployment_output
 
+def verify_deployment(staging_dir: str) -> dict:
+    """Checks every deployment target against the deployment map, returns missing/stale/foreign/broken entries"""
+    staging_meta_path = os.path.join(str(staging_dir), ".staging.nomm.yaml")
+    staging_metadata = load_staging_metadata(staging_meta_path)
+    engine = get_deployment_engine(staging_meta_path, load_staging_metadata)
+    store = get_staging_store(staging_meta_path)
+
+    # Expected content of each target: relative path -> (mod, staging file)
+    expected_per_dest = {}
+    for path, mod in engine.snapshot().items():
+        mod_info = staging_metadata["mods"].get(mod)
+        if not mod_info or not mod_info.get("deployment_path"):
+            continue
+        folder_name = mod_info.get("folder_name", mod_info.get("display_name", mod))
+        expected_per_dest.setdefault(str(mod_info["deployment_path"]), {})[path] = (mod, os.path.join(str(staging_dir), folder_name, path))
+
+    report = new_report()
+    for dest_dir in set(expected_per_dest) | {str(mod_info.get("deployment_path")) for mod_info in staging_metadata["mods"].values() if mod_info.get("deployment_path")}:
+        scan_deployment(dest_dir, expected_per_dest.get(dest_dir, {}), store.get_deployment(dest_dir), staging_dir, report)
+    return report
+
+def repair_deployment(staging_dir: str, report: dict) -> dict:
+    """Re-applies only the entries verify_deployment flagged, foreign files are reported but never touched"""
+    staging_meta_path = os.path.join(str(staging_dir), ".staging.nomm.yaml")
+    engine = get_deployment_engine(staging_meta_path, load_staging_metadata)
+    store = get_staging_store(staging_meta_path)
+    winners = engine.snapshot()
+    to_deploy = {}
+    leftovers = {}
+
+    with meta_lock:
+        for issue in ("missing", "stale", "broken"):
+            for dest_dir, path, mod in report.get(issue, []):
+                if winners.get(path) is not None:
+                    to_deploy.setdefault((dest_dir, winners[path]), []).append(path)
+                else:
+                    leftovers.setdefault(dest_dir, []).append(path)
+
+        # Links and files left behind by mods that are not deployed there anymore
+        removed_count = 0
+        for dest_dir, paths in leftovers.items():
+            records = store.get_deployment(dest_dir, paths)
+            forgotten = []
+            for path in paths:
+                leftover = os.path.join(dest_dir, path)
+                try:
+                    if not placed_by_nomm(leftover, records.get(path), staging_dir):
+                        # Replaced by the user since, only the record goes
+                        print(f"Keeping {path} in {dest_dir}, NOMM did not place it there")
+                        forgotten.append(path)
+                        continue
+                    os.unlink(leftover)
+                    removed_count += 1
+                    forgotten.append(path)
+                except FileNotFoundError:
+                    forgotten.append(path)
+                except OSError as e:
+                    print(f"Failed to remove {path} from {dest_dir}: {e}")
+            store.forget_deployment(dest_dir, forgotten)
+
+        failed = []
+        for (dest_dir, mod), paths in to_deploy.items():
+            if not deploy_mod_files(str(staging_dir), dest_dir, paths, mod).success:
+                failed.append(mod)
+
+    return {
+        'success': not failed,
+        'repaired': sum(len(paths) for paths in to_deploy.values()) + removed_count,
+        'failed_mods': failed,
+        'foreign': report.get("foreign", [])
+    }
+
+class ModTransaction:
+    """Batch of enable/disable/reorder operations applied as one deployment delta and one metadata commit.
+
+    with ModTransaction(staging_dir) as transaction:
+        transaction.enable("mod_a")
+        transaction.move("mod_b", 0)
+    result = transaction.result
+    """
+
+    def __init__(self, staging_dir: str):
+        self.staging_dir = str(staging_dir)
+        self.staging_meta_path = os.path.join(self.staging_dir, ".staging.nomm.yaml")
+        self.operations = []
+        self.result = None
+
+    def enable(self, mod_name: str):
+        self.operations.append(("enable", mod_name, None))
+        return self
+
+    def disable(self, mod_name: str):
+        self.operations.append(("disable", mod_name, None))
+        return self
+
+    def set_state(self, mod_name: str, state: bool):
+        return self.enable(mod_name) if state else self.disable(mod_name)
+
+    def move(self, mod_name: str, index: int):
+        self.operations.append(("move", mod_name, index))
+        return self
+
+    def set_order(self, index: list):
+        """Replaces the whole load order"""
+        self.operations.append(("reorder", None, list(index)))
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def commit(self) -> dict:
+        """Applies every queued operation, returns {'success', 'changes', 'failed_mods'}"""
+        with meta_lock:
+            staging_metadata = load_staging_metadata(self.staging_meta_path)
+            engine = get_deployment_engine(self.staging_meta_path, load_staging_metadata)
+            changes = {'additions': {}, 'deletions': {}}
+            mods = staging_metadata["mods"]
+            touched_mods = []
+
+            # Metadata and deployment map are updated in memory, the delta of every operation is merged into one
+            for operation, mod_name, index in self.operations:
+                if operation == "reorder":
+                    staging_metadata["index"] = [mod for mod in index if mod in mods]
+                    engine.reorder(staging_metadata["index"], changes)
+                    touched_mods.append((operation, None))
+                    continue
+                if mod_name not in mods:
+                    print(f"Ignoring {operation} of unknown mod: {mod_name}")
+                    continue
+                if operation == "enable":
+                    if "enabled_timestamp" not in mods[mod_name]:
+                        mods[mod_name]["enabled_timestamp"] = datetime.now()
+                    engine.enable(mod_name, changes)
+                elif operation == "disable":
+                    mods[mod_name].pop("enabled_timestamp", None)
+                    engine.disable(mod_name, changes)
+                elif operation == "move" and mod_name in staging_metadata["index"]:
+                    staging_metadata["index"].remove(mod_name)
+                    staging_metadata["index"].insert(index, mod_name)
+                    engine.move(mod_name, staging_metadata["index"], changes)
+                touched_mods.append((operation, mod_name))
+
+            if touched_mods:
+                write_staging_metadata(staging_metadata, self.staging_meta_path)
+
+            # Single journaled pass on the disk: everything that has to go first, then everything that has to be linked
+            target = {
+                "enabled": {mod_name: "enabled_timestamp" in mods[mod_name] for operation, mod_name in touched_mods if mod_name in mods},
+                "index": list(staging_metadata["index"]) if any(operation in ("move", "reorder") for operation, _ in touched_mods) else None
+            }
+            failed_mods = list(dict.fromkeys(run_deployment_plan(self.staging_dir, plan_deployment_changes(staging_metadata, changes), target)))
+            if failed_mods:
+                # staging_metadata still has the failed mods enabled, the helper reads what deploy_mod_files wrote
+                follow_failed_deployments(self.staging_dir, engine, failed_mods)
+
+            commit_metadata(self.staging_meta_path)
+
+        self.operations = []
+        self.result = {
+            'success': not failed_mods,
+            'changes': changes,
+            'failed_mods': failed_mods
+        }
+        return self.result
+
+def set_mods_state(staging_dir: str, mod_names: list, state: bool) -> dict:
+    """Enables or disables several mods in a single transaction"""
+    transaction = ModTransaction(staging_dir)
+    for mod_name in mod_names:
+        transaction.set_state(mod_name, state)
+    return transaction.commit()
+
+# Profiles: named enabled sets and load orders stored in the staging database
+def list_profiles(staging_dir: str) -> dict:
+    return get_staging_store(os.path.join(str(staging_dir), STAGING_METADATA_NAME)).get_profiles()
+
+def get_active_profile(staging_dir: str):
+    return get_staging_store(os.path.join(str(staging_dir), STAGING_METADATA_NAME)).get_meta("active_profile")
+
+def save_profile(staging_dir: str, profile_name: str) -> dict:
+    """Saves the current enabled mods and load order under profile_name"""
+    staging_meta_path = os.path.join(str(staging_dir), STAGING_METADATA_NAME)
+    staging_metadata = load_staging_metadata(staging_meta_path)
+    profile = {
+        "enabled": [mod for mod in staging_metadata["index"] if "enabled_timestamp" in staging_metadata["mods"].get(mod, {})],
+        "index": list(staging_metadata["index"]),
+        "saved_timestamp": datetime.now()
+    }
+    store = get_staging_store(staging_meta_path)
+    store.set_profile(profile_name, profile)
+    store.set_meta("active_profile", profile_name)
+    return profile
+
+def delete_profile(staging_dir: str, profile_name: str):
+    store = get_staging_store(os.path.join(str(staging_dir), STAGING_METADATA_NAME))
+    store.delete_profile(profile_name)
+    if store.get_meta("active_profile") == profile_name:
+        store.set_meta("active_profile", "")
+
+def switch_profile(staging_dir: str, profile_name: str) -> dict:
+    """Applies a profile in one transaction, only the mods whose state or winning files change are touched on disk
+
+    Mods installed after the profile was saved keep their place at the end of the load order and are disabled."""
+    staging_meta_path = os.path.join(str(staging_dir), STAGING_METADATA_NAME)
+    store = get_staging_store(staging_meta_path)
+    profile = store.get_profile(profile_name)
+    if profile is None:
+        print(f"Unknown profile: {profile_name}")
+        return {'success': False, 'changes': {'additions': {}, 'deletions': {}}, 'failed_mods': []}
+
+    staging_metadata = load_staging_metadata(staging_meta_path)
+    mods = staging_metadata["mods"]
+    profile_index = [mod for mod in profile.get("index", []) if mod in mods]
+    known = set(profile_index)
+    target_index = profile_index + [mod for mod in staging_metadata["index"] if mod not in known]
+    target_enabled = set(profile.get("enabled", []))
+
+    transaction = ModTransaction(staging_dir)
+    if target_index != staging_metadata["index"]:
+        transaction.set_order(target_index)
+    for mod_name in target_index:
+        state = mod_name in target_enabled
+        if state != ("enabled_timestamp" in mods.get(mod_name, {})):
+            transaction.set_state(mod_name, state)
+    result = transaction.commit()
+    store.set_meta("active_profile", profile_name)
+    return result
+
 def get_metadata_path(base_folder: str, is_staging: bool = True) -> str:
     filename = ".staging.nomm.yaml" if is_staging else ".downloads.nomm.yaml"
     return os.path.join(base_folder, filename)
 
 def load_staging_metadata(path: str) -> dict:
-    data = load_yaml(path)
+    # Staging metadata lives in a SQLite database next to the legacy YAML file, other metadata files are still plain YAML
+    # Both are served from the metadata cache, so repeated loads within one action don't hit the disk
+    if is_staging_metadata_path(path):
+        db_path = os.path.join(os.path.dirname(str(path)), STAGING_DATABASE_NAME)
+        if os.path.exists(db_path) or os.path.exists(path):
+            store = get_staging_store(path)
+            # Keyed on the store's generation, the WAL also changes with every deployment record
+            data = load_cached(path, store.load, version=store.generation())
+        else:
+            data = {}
+    else:
+        data = load_yaml(path)
     
     # load metadata also initialize the staging_metadata as a safety measure
     if not isinstance(data, dict):
@@ -419,6 +759,19 @@ def load_staging_metadata(path: str) -> dict:
         
     return data
 
+def write_staging_metadata(data: dict, path: str) -> bool:
+    if is_staging_metadata_path(path):
+        # Same write-behind path as the YAML files, rapid toggles end up as a single transaction
+        return get_metadata_writer().schedule(path, data, _save_staging_metadata)
+    return write_yaml(data, path)
+
+def _save_staging_metadata(data: dict, path: str, fsync: bool) -> bool:
+    return get_staging_store(path).save(data, durable=fsync)
+
+# Commit point, used once a user action is complete (install, uninstall, leaving the dashboard...)
+def commit_metadata(path: str = None) -> bool:
+    return flush_metadata_writes(path)
+
 # Removes the mod from the staging metadata -- metadata allows to list mods that are installed
 def remove_mod_from_metadata(path: str, mod_name: str) -> bool:
     data = load_staging_metadata(path)
@@ -428,7 +781,10 @@ def remove_mod_from_metadata(path: str, mod_name: str) -> bool:
         if mod_name in data["index"]:
             data["index"].remove(mod_name)
         
-        write_yaml(data, path)
+        write_staging_metadata(data, path)
+        if is_staging_metadata_path(path):
+            get_conflict_index(path, load_staging_metadata).remove_mod(mod_name)
+            get_deployment_engine(path, load_staging_metadata).remove_mod(mod_name)
         
         staging_path = os.path.dirname(path)
         
@@ -436,19 +792,18 @@ def remove_mod_from_metadata(path: str, mod_name: str) -> bool:
     return False
 
 # Writing the metadata with needed fields
-def finalise_mod_metadata(filename: str, mod_files: list, deployment_target: dict, staging_meta_path: str, downloads_meta_path: str):
-    current_download_metadata = {}
-
+def finalise_mod_metadata(filename: str, mod_files: list, deployment_target: dict, staging_meta_path: str, downloads_meta_path: str, archive_fingerprint: dict = None, file_hashes: dict = None, rewritten_files: list = None):
+    """rewritten_files are the staged files the install wrote, None when it wrote all of them. When the mod is
+    enabled they are deployed again: hardlinks to a replaced file, copies and reflinks would keep the old content"""
     mod_name = filename.replace(".zip", "").replace(".rar", "").replace(".7z", "")
     with meta_lock:
         current_staging_metadata = load_staging_metadata(staging_meta_path)
         # This request should only fail if all previous files were manually added --> can be fixed with a rework of check_index
-        if os.path.exists(downloads_meta_path):
-            with open(downloads_meta_path, 'r') as f:
-                current_download_metadata = yaml.safe_load(f) or {}
+        current_download_metadata = load_yaml(downloads_meta_path)
+        if current_download_metadata:
             if "info" in current_download_metadata:
                 current_staging_metadata["info"] = current_download_metadata["info"]
-            if filename in current_download_metadata.get("mods"):
+            if filename in current_download_metadata.get("mods", {}):
                 mod_data = current_download_metadata["mods"][filename]
                 mod_name = mod_data.get("name", mod_name)
                 current_staging_metadata["mods"][mod_name] = mod_data
@@ -466,13 +821,74 @@ def finalise_mod_metadata(filename: str, mod_files: list, deployment_target: dic
         current_staging_metadata["mods"][mod_name]["archive_name"] = filename
         current_staging_metadata["mods"][mod_name]["install_timestamp"] = datetime.now()
         current_staging_metadata["mods"][mod_name]["deployment_path"] = deployment_target["path"]
+        # Only plain extractions are fingerprinted, a FOMOD selection does not mirror the archive
+        if archive_fingerprint:
+            current_staging_metadata["mods"][mod_name]["archive_fingerprint"] = archive_fingerprint
+        else:
+            current_staging_metadata["mods"][mod_name].pop("archive_fingerprint", None)
         if "folder_name" not in current_staging_metadata["mods"][mod_name]:
             current_staging_metadata["mods"][mod_name]["folder_name"] = current_staging_metadata["mods"][mod_name].get("display_name", current_staging_metadata["mods"][mod_name].get("name")) 
 
         if mod_name not in current_staging_metadata["index"]:
             current_staging_metadata["index"].append(mod_name)
 
-        write_yaml(current_staging_metadata, staging_meta_path)
+        write_staging_metadata(current_staging_metadata, staging_meta_path)
+        commit_metadata(staging_meta_path)
+        get_conflict_index(staging_meta_path, load_staging_metadata).set_mod_files(mod_name, mod_files)
+
+        # Manifest of what was staged, used to spot missing files without stat'ing each of them
+        staging_mod_dir = os.path.join(os.path.dirname(str(staging_meta_path)), current_staging_metadata["mods"][mod_name]["folder_name"])
+        # Optional deduplication: identical files of different mods become hardlinks to one blob, before the manifest so it sees the final files
+        if (load_user_config() or {}).get("staging_deduplication", False):
+            dedup = get_blob_store(os.path.dirname(str(staging_meta_path))).deduplicate_mod(mod_name, staging_mod_dir, mod_files, file_hashes)
+            print(f"Deduplicated {mod_name}: {dedup['reused']} of {dedup['files']} files shared, {dedup['bytes_saved']} bytes saved")
+        get_staging_store(staging_meta_path).set_manifest(mod_name, build_manifest(staging_mod_dir, mod_files))
+        invalidate_missing_files(staging_mod_dir)
+        engine = get_deployment_engine(staging_meta_path, load_staging_metadata)
+        engine.set_index(current_staging_metadata["index"])
+        enabled = "enabled_timestamp" in current_staging_metadata["mods"][mod_name]
+        changes = engine.set_mod(mod_name, mod_files, enabled)
+        if not enabled:
+            return
+
+        staging_dir = os.path.dirname(str(staging_meta_path))
+        steps = plan_deployment_changes(current_staging_metadata, changes)
+        refresh = [
+            path for path in (mod_files if rewritten_files is None else rewritten_files)
+            if path not in changes['additions'] and engine.winner_of(path) == mod_name
+        ]
+        if refresh:
+            steps.append({
+                "action": "link",
+                "mod": mod_name,
+                "folder": current_staging_metadata["mods"][mod_name]["folder_name"],
+                "dest": str(deployment_target["path"]),
+                "paths": refresh
+            })
+        failed_mods = run_deployment_plan(staging_dir, steps, {"enabled": {mod_name: True}, "index": None})
+        if failed_mods:
+            follow_failed_deployments(staging_dir, engine, failed_mods)
+
+# What the last install left in folder_name: the mod staged there, the fingerprint of its archive (None for FOMOD
+# installs) and its staging manifest. Lets a reinstall of the same archive skip the files still in place
+def get_install_record(staging_meta_path: str, folder_name: str):
+    staging_metadata = load_staging_metadata(staging_meta_path)
+    for mod_name, mod_info in staging_metadata.get("mods", {}).items():
+        if mod_info.get("folder_name") != folder_name:
+            continue
+        return {
+            'mod': mod_name,
+            'fingerprint': mod_info.get("archive_fingerprint"),
+            'manifest': get_staging_store(staging_meta_path).get_manifest(mod_name)
+        }
+    return None
+
+# Files listed for the mod that are gone from its staging folder
+def get_missing_files(staging_dir: str, mod_info: dict) -> list:
+    folder_name = mod_info.get("folder_name", mod_info.get("display_name"))
+    if not folder_name:
+        return []
+    return find_missing_files(os.path.join(str(staging_dir), folder_name), mod_info.get("mod_files", []))
 
 # Mostly returns index, will very likely disappear in the future
 def read_index(staging_meta_path: str) -> List[str]:
@@ -488,6 +904,12 @@ def change_mod_index(staging_meta_path: str, mod_name: str, index: int) -> dict:
         mod = current_staging_metadata["index"].pop(pos)
         current_staging_metadata["index"].insert(index, mod)
         
-        write_yaml(current_staging_metadata, staging_meta_path) 
+        write_staging_metadata(current_staging_metadata, staging_meta_path) 
     
-    return current_staging_metadata
\ No newline at end of file
+    return current_staging_metadata
+
+# Moves a mod in the load order and returns the files that have to be redeployed
+def move_mod(staging_meta_path: str, mod_name: str, index: int) -> dict:
+    new_staging_metadata = change_mod_index(staging_meta_path, mod_name, index)
+    engine = get_deployment_engine(staging_meta_path, load_staging_metadata)
+    return engine.move(mod_name, new_staging_metadata["index"])
\ No newline at end of file
@@ -0,0 +1,143 @@
+import sys
+from collections import Counter
+
+_MISSING = object()
+
+class PathNode:
+    """One path segment. Leaves never allocate a children dict"""
+    __slots__ = ("children", "value", "files", "tally")
+
+    def __init__(self):
+        self.children = None
+        self.value = _MISSING
+        # Number of values stored at or below this node
+        self.files = 0
+        # Optional Counter kept per directory, see PathTrie.tally
+        self.tally = None
+
+class PathTrie:
+    """Relative paths stored segment by segment, common prefixes like Content/Paks/~mods are kept once.
+
+    Segments are interned, so the same folder name is a single string object in every trie.
+    Prefix queries (everything below a directory, how many files it holds) only visit that directory."""
+    __slots__ = ("root",)
+
+    def __init__(self, paths=None, value=True):
+        self.root = PathNode()
+        for path in paths or ():
+            self.set(path, value)
+
+    @staticmethod
+    def _split(path: str) -> list:
+        return path.split("/") if path else []
+
+    def _node(self, path: str):
+        node = self.root
+        for segment in self._split(path):
+            if node.children is None:
+                return None
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def _chain(self, path: str, create: bool = False) -> list:
+        """(parent, segment, node) from the root down to path, None when path is not there and create is False"""
+        chain = []
+        node = self.root
+        for segment in self._split(path):
+            child = node.children.get(segment) if node.children is not None else None
+            if child is None:
+                if not create:
+                    return None
+                if node.children is None:
+                    node.children = {}
+                segment = sys.intern(segment)
+                child = node.children[segment] = PathNode()
+            chain.append((node, segment, child))
+            node = child
+        return chain
+
+    def _prune(self, chain: list):
+        # Deepest first, a node goes away once nothing is stored at or below it
+        for parent, segment, node in reversed(chain):
+            if node.files or node.children or node.tally:
+                break
+            del parent.children[segment]
+            if not parent.children:
+                parent.children = None
+
+    def set(self, path: str, value=True):
+        chain = self._chain(path, create=True)
+        node = chain[-1][2] if chain else self.root
+        if node.value is _MISSING:
+            self.root.files += 1
+            for _, _, chain_node in chain:
+                chain_node.files += 1
+        node.value = value
+
+    def get(self, path: str, default=None):
+        node = self._node(path)
+        if node is None or node.value is _MISSING:
+            return default
+        return node.value
+
+    def pop(self, path: str, default=None):
+        chain = self._chain(path)
+        if not chain or chain[-1][2].value is _MISSING:
+            return default
+        value = chain[-1][2].value
+        chain[-1][2].value = _MISSING
+        self.root.files -= 1
+        for _, _, chain_node in chain:
+            chain_node.files -= 1
+        self._prune(chain)
+        return value
+
+    def __contains__(self, path: str) -> bool:
+        node = self._node(path)
+        return node is not None and node.value is not _MISSING
+
+    def __len__(self) -> int:
+        return self.root.files
+
+    def count(self, directory: str = "") -> int:
+        """Number of paths stored below directory"""
+        node = self._node(directory)
+        return node.files if node is not None else 0
+
+    def items(self, directory: str = ""):
+        """(path, value) of everything below directory"""
+        node = self._node(directory)
+        if node is None:
+            return
+        stack = [(directory, node)]
+        while stack:
+            prefix, node = stack.pop()
+            if node.value is not _MISSING and prefix != directory:
+                yield prefix, node.value
+            if node.children:
+                for segment, child in node.children.items():
+                    stack.append((f"{prefix}/{segment}" if prefix else segment, child))
+
+    def paths(self, directory: str = ""):
+        for path, _ in self.items(directory):
+            yield path
+
+    def tally(self, path: str, key, step: int = 1):
+        """Adds step to key in the Counter of every directory above path, in a single descent"""
+        chain = self._chain(path.rpartition("/")[0], create=True)
+        for _, _, node in chain:
+            if node.tally is None:
+                node.tally = Counter()
+            node.tally[key] += step
+            if node.tally[key] <= 0:
+                del node.tally[key]
+                if not node.tally:
+                    node.tally = None
+        if step < 0:
+            self._prune(chain)
+
+    def tally_of(self, directory: str):
+        node = self._node(directory)
+        return node.tally if node is not None else None
@@ -0,0 +1,98 @@
+import os
+import threading
+
+# mod folder -> {"dirs": {relative dir: mtime_ns}, "paths": list, "missing": list}
+_scan_cache = {}
+_scan_cache_lock = threading.Lock()
+
+def build_manifest(mod_dir: str, mod_files: list) -> list:
+    """(relative path, size, mtime_ns) of every staged file, files that can not be read are left out"""
+    manifest = []
+    for relative_path in mod_files:
+        try:
+            stat = os.stat(os.path.join(str(mod_dir), relative_path))
+        except OSError:
+            continue
+        manifest.append((relative_path, stat.st_size, stat.st_mtime_ns))
+    return manifest
+
+def find_changed_files(mod_dir: str, archive_manifest: list, staged_manifest: dict) -> list:
+    """Files of the archive missing from the mod folder, or whose staged copy no longer matches the staging manifest"""
+    changed = []
+    for relative_path, size, _ in archive_manifest:
+        recorded = staged_manifest.get(relative_path)
+        if recorded is None or recorded[0] != size:
+            changed.append(relative_path)
+            continue
+        try:
+            stat = os.stat(os.path.join(str(mod_dir), relative_path))
+        except OSError:
+            changed.append(relative_path)
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != tuple(recorded):
+            changed.append(relative_path)
+    return changed
+
+def _dirs_of(paths) -> set:
+    dirs = {""}
+    for path in paths:
+        parent = os.path.dirname(path)
+        while parent and parent not in dirs:
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+    return dirs
+
+def _dir_mtimes(mod_dir: str, dirs: set) -> dict:
+    mtimes = {}
+    for relative_dir in dirs:
+        try:
+            mtimes[relative_dir] = os.stat(os.path.join(mod_dir, relative_dir)).st_mtime_ns
+        except OSError:
+            mtimes[relative_dir] = None
+    return mtimes
+
+def _scan(mod_dir: str, dirs: set) -> set:
+    """Files found in the folders the manifest uses, one scandir per folder"""
+    found = set()
+    for relative_dir in dirs:
+        try:
+            with os.scandir(os.path.join(mod_dir, relative_dir)) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        found.add(os.path.join(relative_dir, entry.name) if relative_dir else entry.name)
+        except OSError:
+            continue
+    return found
+
+def find_missing_files(mod_dir: str, paths: list) -> list:
+    """Files of paths no longer present in mod_dir
+
+    Removing a file changes the mtime of its folder, so as long as no folder of the mod changed
+    the previous answer is reused and only the folders are stat'ed, never the files."""
+    mod_dir = str(mod_dir)
+    paths = list(paths)
+
+    with _scan_cache_lock:
+        cached = _scan_cache.get(mod_dir)
+    # List comparison is cheap here, cached metadata hands out copies sharing the same string objects
+    if cached and cached["paths"] == paths:
+        dirs = cached["dirs"].keys()
+        mtimes = _dir_mtimes(mod_dir, dirs)
+        if cached["dirs"] == mtimes:
+            return cached["missing"]
+    else:
+        dirs = _dirs_of(paths)
+        mtimes = _dir_mtimes(mod_dir, dirs)
+
+    found = _scan(mod_dir, dirs)
+    missing = [path for path in paths if path not in found]
+    with _scan_cache_lock:
+        _scan_cache[mod_dir] = {"dirs": mtimes, "paths": paths, "missing": missing}
+    return missing
+
+def invalidate_missing_files(mod_dir: str = None):
+    with _scan_cache_lock:
+        if mod_dir is None:
+            _scan_cache.clear()
+        else:
+            _scan_cache.pop(str(mod_dir), None)
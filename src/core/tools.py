@@ -8,8 +8,15 @@ from pathlib import Path
 from typing import Callable, Optional
 from gi.repository import GLib, Gio, Gtk
 
+from core.metadata_cache import load_cached
+from core.metadata_writer import atomic_write_yaml, get_metadata_writer
+
 
 def load_yaml(path: str) -> dict:
+    # Parsed files are cached and only re-read when their mtime/size change
+    return load_cached(path, lambda: _read_yaml(path))
+
+def _read_yaml(path: str) -> dict:
     if os.path.exists(path):
         try:
             with open(path, 'r', encoding='utf-8') as f:
@@ -18,17 +25,10 @@ def load_yaml(path: str) -> dict:
             print(f"Error while loading {path}: {e}")
     return {}
 
-def write_yaml(data: dict, path: str) -> bool:
-    # difference here: creates the path if needed
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    try:
-        with open(path, 'w', encoding='utf-8') as f:
-            yaml.safe_dump(data, f, default_flow_style=False)
-            return True
-    except Exception as e:
-        print(f"Error while writing in {path}: {e}")
-        return False
-    return False
+def write_yaml(data: dict, path: str, commit: bool = False) -> bool:
+    # Writes are coalesced and flushed atomically in the background, see core/metadata_writer.py
+    # commit writes straight away and tells whether the data reached the disk
+    return get_metadata_writer().schedule(path, data, atomic_write_yaml, commit)
 
 def timestamp_converter(timestamp: str, timestamp_type="short") -> str:
     """Converts standard time timestamps (2026-04-28 15:52:14.249614) into localised text"""
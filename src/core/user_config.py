@@ -47,7 +47,8 @@ def write_user_config(data: dict) -> dict:
     """Writes to the user's NOMM configuration file"""
     try: 
         user_config_path = os.path.join(GLib.get_user_data_dir (), 'nomm', 'user_config.yaml')
-        write_yaml(data, user_config_path)
+        if not write_yaml(data, user_config_path, commit=True):
+            return False
     except:
         print("Error: could not write to user config.")
         return False
@@ -15,6 +15,7 @@ from urllib.parse import urlparse
 from gi.repository import Adw, Gdk, Gio, GLib, Gtk
 
 from core.game_scanner import scan_all_games
+from core.metadata_writer import flush_metadata_writes, get_metadata_writer
 from core.tools import (load_yaml,
                         translate_fuse_path, write_yaml)
 from core.user_config import (load_user_config, update_user_config,
@@ -57,6 +58,9 @@ class Nomm(Adw.Application):
         user_data_dir: str = os.path.join(GLib.get_user_data_dir(), 'nomm')
         self.user_config_path: str = os.path.join(user_data_dir, "user_config.yaml")
         self.game_config_path: str = os.path.join(user_data_dir, "game_configs")
+
+        # Metadata files are written in the background, fsync policy can be "always", "commit" or "never"
+        get_metadata_writer().configure(fsync_policy=load_yaml(self.user_config_path).get("metadata_fsync_policy"))
         
         base_path: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -164,6 +168,7 @@ class Nomm(Adw.Application):
     # the download thread event with cancel_all empty event
     def do_shutdown(self):
         self.downloader.cancel_all()
+        flush_metadata_writes()
         Adw.Application.do_shutdown(self)
                   
     def sync_configs(self):
@@ -9,9 +9,10 @@ import requests
 from gi.repository import Adw, Gdk, Gio, Gtk
 
 from core.tools import load_yaml, write_yaml
-from core.mod_manager import (completely_uninstall_mod, get_metadata_path,
-                              get_mod_statistics, load_staging_metadata,
-                              remove_mod_from_metadata)
+from core.mod_manager import (commit_metadata, completely_uninstall_mod,
+                              get_metadata_path, get_mod_statistics,
+                              load_staging_metadata, recover_deployments,
+                              remove_mod_from_metadata, set_deployment_strategy)
 from core.colour_manager import set_accent_colour, reset_accent_colour
 from gui.dashboard_views.downloads_tab import DownloadsTab
 from gui.dashboard_views.mods_tab import ModsTab
@@ -37,6 +38,13 @@ class GameDashboard(Gtk.Box):
         self.downloads_metadata_path = get_metadata_path(self.downloads_path, is_staging=False)
         self.deployment_targets = game_info["mod_paths"]
 
+        # Per game deployment strategy: user choice first, then the game config (e.g. games refusing symlinks)
+        deployment_strategy = user_config.get("deployment_strategies", {}).get(self.game_name, self.game_config.get("deployment_strategy", "symlink"))
+        set_deployment_strategy(self.staging_path, deployment_strategy)
+
+        # Deployments interrupted by a crash are finished or undone before anything reads the game folder
+        recover_deployments(self.staging_path)
+
         # Threading preconfiguration
         self.currently_toggling = set()
         self.currently_installing = set()
@@ -235,9 +243,10 @@ class GameDashboard(Gtk.Box):
         dest_dir = staging_metadata["mods"][mod_name]["deployment_path"]
         staging_mod_dir = os.path.join(self.staging_path, staging_metadata["mods"][mod_name]["folder_name"])
 
-        completely_uninstall_mod(staging_mod_dir, dest_dir, mod_files)
+        completely_uninstall_mod(staging_mod_dir, dest_dir, mod_files, mod_name)
 
         remove_mod_from_metadata(self.staging_metadata_path, mod_name)
+        commit_metadata(self.staging_metadata_path)
 
         self.create_mods_page()
         self.create_downloads_page()
@@ -260,6 +269,7 @@ class GameDashboard(Gtk.Box):
         user_config = load_yaml(self.app.user_config_path)
         user_config["last_selected_game"] = "dashboard"
         write_yaml(user_config, self.app.user_config_path)
+        commit_metadata()
         reset_accent_colour(self._accent_style_provider)
         self.app.return_to_library()
 
@@ -1,20 +1,21 @@
 import gettext
 import os
-import shutil
 import webbrowser
 import threading
 from datetime import datetime
 
-import yaml
 from gi.repository import Adw, Gdk, Gio, GLib, Gtk, Pango
 
+from core.archive_index import get_archive_summary
 from core.archive_manager import (delete_downloaded_archive, extract_archive,
-                                  get_all_relative_files,
+                                  extract_fomod_selection,
                                   process_dropped_files, prepare_mod_installation)
-from core.fomod_manager import apply_fomod_selection, parse_fomod_xml
-from core.mod_manager import (finalise_mod_metadata, is_mod_installed,
-                              load_staging_metadata, remove_mod_from_metadata)
-from core.tools import timestamp_converter, list_archives, create_icon_button
+from core.fomod_manager import parse_fomod_xml
+from core.install_queue import InstallQueue
+from core.mod_manager import (finalise_mod_metadata, get_install_record, is_mod_installed,
+                              load_staging_metadata, predict_archive_conflicts,
+                              remove_mod_from_metadata)
+from core.tools import timestamp_converter, list_archives, create_icon_button, load_yaml
 from gui.dashboard_views.fomod_dialog import FomodSelectionDialog
 
 _ = gettext.gettext
@@ -37,6 +38,8 @@ class DownloadsTab(Gtk.Box):
         self.download_maps = {}
         self.download_lbl_maps = {}
         self.currently_downloading = set()
+        # Extractions run a few at a time, FOMOD dialogs one at a time
+        self.install_queue = InstallQueue(on_change=lambda: GLib.idle_add(self.on_install_queue_changed))
         
         # Action Bar
         action_bar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
@@ -100,15 +103,25 @@ class DownloadsTab(Gtk.Box):
             staging_metadata = load_staging_metadata(self.dashboard.staging_metadata_path)
 
             meta_path = self.dashboard.downloads_metadata_path
-            metadata = {}
-            if os.path.exists(meta_path):
+            metadata = load_yaml(meta_path)
+
+            # Read from the archive headers and cached on disk, nothing is extracted
+            summaries = {}
+            installed_mods = {mod_val.get("archive_name"): mod_key for mod_key, mod_val in (staging_metadata or {}).get("mods", {}).items()}
+            for file_name in files:
+                if file_name in self.currently_downloading:
+                    continue
+                archive_path = os.path.join(self.dashboard.downloads_path, file_name)
                 try:
-                    with open(meta_path, 'r') as meta_f:
-                        metadata = yaml.safe_load(meta_f)
-                except: pass
-            GLib.idle_add(on_data_prepared, files, staging_metadata, meta_path, metadata)
+                    summaries[file_name] = get_archive_summary(archive_path)
+                    summaries[file_name]["conflicts"] = predict_archive_conflicts(
+                        archive_path, self.dashboard.staging_metadata_path, installed_mods.get(file_name)
+                    )
+                except Exception as e:
+                    print(f"Could not read the contents of {file_name}: {e}")
+            GLib.idle_add(on_data_prepared, files, staging_metadata, meta_path, metadata, summaries)
 
-        def on_data_prepared(files, staging_metadata, meta_path, metadata):
+        def on_data_prepared(files, staging_metadata, meta_path, metadata, summaries):
 
             valign = self.scrolled.get_valign()
 
@@ -153,6 +166,23 @@ class DownloadsTab(Gtk.Box):
                             break
                         
                 row.add_suffix(timestamp_box)
+
+                # Contents badge, file count and what installing the archive would conflict with
+                summary = summaries.get(file_name)
+                if summary:
+                    contents_text = _("{} files").format(summary["files"])
+                    if summary["fomod"]:
+                        contents_text = f"{contents_text} · FOMOD"
+                    contents_badge = Gtk.Label(label=contents_text, valign=Gtk.Align.CENTER, margin_end=15)
+                    contents_badge.add_css_class("badge-action-row")
+                    contents_tooltip = _("{} once extracted").format(GLib.format_size(summary["size"]))
+                    if summary["conflicts"]:
+                        contents_badge.add_css_class("warning")
+                        contents_tooltip += "\n" + _("Conflicts with: {}").format(", ".join(
+                            f"{mod} ({count})" for mod, count in sorted(summary["conflicts"].items())
+                        ))
+                    contents_badge.set_tooltip_text(contents_tooltip)
+                    row.add_suffix(contents_badge)
                 
                 # Version badge
                 version_badge = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
@@ -205,7 +235,9 @@ class DownloadsTab(Gtk.Box):
                 if not installed: install_btn.add_css_class("suggested-action")
                 install_btn.set_cursor_from_name("pointer")
                 install_btn.connect("clicked", self.on_install_clicked, file_name, display_name)
-                if (file_name in self.dashboard.currently_installing) or (file_name in self.currently_downloading):
+                extracting = file_name in self.install_queue
+                queue_position = self.install_queue.position(file_name)
+                if (file_name in self.dashboard.currently_installing and not extracting) or (file_name in self.currently_downloading):
                     install_btn.set_sensitive(False)
 
                 # Overlay to display download progress on top of download button
@@ -216,10 +248,15 @@ class DownloadsTab(Gtk.Box):
                 overlay.add_overlay(dl_pbar)
                 overlay.add_overlay(download_lbl)
 
-                if file_name in self.currently_downloading:
+                if file_name in self.currently_downloading or extracting:
                     install_btn.add_css_class('btn-download-before')
                     install_btn.set_label('')
                     download_lbl.set_visible(True)
+                    if queue_position:
+                        download_lbl.set_text(f"#{queue_position}")
+                        install_btn.set_tooltip_text(_("Waiting in the install queue, click to remove it"))
+                    elif extracting:
+                        install_btn.set_tooltip_text(_("Click to cancel the extraction"))
                 else:
                     download_lbl.set_visible(False)
 
@@ -289,32 +326,53 @@ class DownloadsTab(Gtk.Box):
 
     # Install
     def on_install_clicked(self, btn, filename, display_name):
+        # Clicking again while the archive is queued or being extracted cancels it
+        if filename in self.install_queue:
+            self.install_queue.cancel(filename)
+            btn.set_sensitive(False)
+            return
+
         display_name = display_name.replace(".zip", "").replace(".rar", "").replace(".7z", "")
         mod_staging_dir = os.path.join(self.dashboard.staging_path, display_name)
         archive_full_path = os.path.join(self.dashboard.downloads_path, filename)
-        btn.set_sensitive(False)
         
         # Stores the currently installing mod in a local variable in case multiple mods are installing at the same time
         self.dashboard.currently_installing.add(filename)
         
-        def worker():
-            data = prepare_mod_installation(self, archive_full_path, mod_staging_dir, filename)
-            GLib.idle_add(on_extraction_done, data)
+        def on_progress(progress):
+            GLib.idle_add(self.on_extraction_progress, filename, progress)
+        
+        def work(cancel_event):
+            previous_install = get_install_record(self.dashboard.staging_metadata_path, display_name)
+            return prepare_mod_installation(self, archive_full_path, mod_staging_dir, filename, on_progress, cancel_event, previous_install)
                 
-        def on_extraction_done(data):
+        def on_extraction_done(data, error):
+            if filename in self.download_maps:
+                self.download_maps[filename].set_fraction(0.0)
+            if error:
+                self.dashboard.show_message(_("Error"), str(error))
+            if not data:
+                self.dashboard.currently_installing.discard(filename)
+            # Rebuilds the row without the extraction progress
+            self.populate_list()
             if not data:
-                btn.set_sensitive(True)
                 return False
             if data['fomod']:
-                dialog = FomodSelectionDialog(self.dashboard.app.win, data['fomod'], mod_staging_dir, self.dashboard.deployment_targets[0]['path'])
-                dialog.connect("response", self.on_fomod_dialog_response, mod_staging_dir, filename)
-                dialog.present()
+                # Waits for the dialogs of the installs asked for before this one
+                self.install_queue.request_interaction(order, lambda done: GLib.idle_add(show_fomod_dialog, data, done))
                 return False
-            self.resolve_deployment_path(filename, data['files'])
-            btn.set_sensitive(True)
+            self.resolve_deployment_path(filename, data['files'], data['fingerprint'], data['hashes'], data['rewritten'])
+            return False
+
+        def show_fomod_dialog(data, interaction_done):
+            dialog = FomodSelectionDialog(self.dashboard.app.win, data['fomod'], archive_full_path, data['fomod_root'], self.dashboard.deployment_targets[0]['path'])
+            dialog.connect("response", self.on_fomod_dialog_response, mod_staging_dir, filename, archive_full_path, order, interaction_done)
+            dialog.present()
             return False
         
-        threading.Thread(target=worker, daemon=True).start()
+        order = self.install_queue.submit(filename, work, lambda data, error: GLib.idle_add(on_extraction_done, data, error))
+        # Shows its place in the queue
+        self.populate_list()
 
     def on_file_drop(self, _targer, value, _x, _y):
         if isinstance(value, Gdk.FileList):
@@ -341,61 +399,49 @@ class DownloadsTab(Gtk.Box):
     def on_drag_leave(self, _target):
         self.list_box.remove_css_class("drop-active")
 
-    # Consider moving part of this logic into core
-    def on_fomod_dialog_response(self, dialog, response, mod_staging_dir, filename):
-        # As we have multiple files to copy, we loop on items to retrieve every source and it's associated destination
-        if response == Gtk.ResponseType.OK:
-            
-            install_items = dialog.get_global_sources()
-            
-            temp_install_dir = f"{mod_staging_dir}_final_fomod"
-            os.makedirs(temp_install_dir, exist_ok=True)
-            
-            grouped_final_files = []
-            for install_item in install_items:
-                install_source = install_item.get('source')
-                install_destination = install_item.get('destination')
-                
-                if not install_source: 
-                    continue
-                    
-                if not install_destination:
-                    install_destination = ""
-                
-                dest_path = os.path.join(temp_install_dir, install_destination)
-                try:
-                    res = apply_fomod_selection(mod_staging_dir, install_source, dest_path)
-                    if isinstance(res, list):
-                        for f in res:
-                            final_path = os.path.normpath(os.path.join(install_destination, f)).replace('\\', '/')
-                            grouped_final_files.append(final_path)
-                    else:
-                        final_path = os.path.normpath(os.path.join(install_destination, res)).replace('\\', '/')
-                        grouped_final_files.append(final_path)
-                                          
-                except Exception as e:
-                    self.dashboard.show_message(_("Error"), str(e))
-            
-            grouped_final_files = get_all_relative_files(temp_install_dir)
-            
-            if grouped_final_files:
-                shutil.rmtree(mod_staging_dir, ignore_errors=True)
-                os.rename(temp_install_dir, mod_staging_dir)
-                self.resolve_deployment_path(filename, grouped_final_files)
+    def on_fomod_dialog_response(self, dialog, response, mod_staging_dir, filename, archive_full_path, order, interaction_done):
+        # Nothing was extracted yet, only the files of the selected options are
+        install_items = dialog.get_global_sources() if response == Gtk.ResponseType.OK else None
+        dialog.destroy()
+        interaction_done()
+        if install_items is None:
+            self.dashboard.currently_installing.discard(filename)
+            self.populate_list()
+            return
+
+        def on_progress(progress):
+            GLib.idle_add(self.on_extraction_progress, filename, progress)
+
+        def work(cancel_event):
+            # As we have multiple files to copy, every source comes with its own destination
+            return extract_fomod_selection(archive_full_path, mod_staging_dir, install_items, on_progress, cancel_event)
+
+        def on_selection_extracted(result, error):
+            if error:
+                result = {'files': [], 'errors': [str(error)]}
+            elif result is None:
+                # Removed from the queue before it started
+                result = {'files': None, 'errors': []}
+            if filename in self.download_maps:
+                self.download_maps[filename].set_fraction(0.0)
+            if result['errors']:
+                self.dashboard.show_message(_("Error"), "\n".join(result['errors']))
+            if result['files']:
+                self.resolve_deployment_path(filename, result['files'], file_hashes=result.get('hashes'))
             else:
-                shutil.rmtree(mod_staging_dir, ignore_errors=True)
-                shutil.rmtree(temp_install_dir, ignore_errors=True)
-                
-        else:
-            shutil.rmtree(mod_staging_dir, ignore_errors=True)
+                self.dashboard.currently_installing.discard(filename)
+            self.populate_list()
+            return False
 
-        dialog.destroy()
+        # Keeps the place the install had in the queue
+        self.install_queue.submit(filename, work, lambda result, error: GLib.idle_add(on_selection_extracted, result, error), order)
+        self.populate_list()
 
-    def resolve_deployment_path(self, filename: str, extracted_roots: list):
+    def resolve_deployment_path(self, filename: str, extracted_roots: list, archive_fingerprint: dict = None, file_hashes: dict = None, rewritten_files: list = None):
         def on_path_resolved(deployment_target):
             if not deployment_target:
                 return
-            self.finalise_installation(filename, extracted_roots, deployment_target)
+            self.finalise_installation(filename, extracted_roots, deployment_target, archive_fingerprint, file_hashes, rewritten_files)
 
         if len(self.dashboard.deployment_targets) > 1:
             self.choose_deployment_path(on_path_resolved)
@@ -466,7 +512,7 @@ class DownloadsTab(Gtk.Box):
         dialog.connect("response", on_response)
         dialog.present()
 
-    def finalise_installation(self, filename, extracted_roots, deployment_target):
+    def finalise_installation(self, filename, extracted_roots, deployment_target, archive_fingerprint=None, file_hashes=None, rewritten_files=None):
         
         def finalise_metadata():
             try:
@@ -475,7 +521,10 @@ class DownloadsTab(Gtk.Box):
                     extracted_roots, 
                     deployment_target, 
                     self.dashboard.staging_metadata_path, 
-                    self.dashboard.downloads_metadata_path
+                    self.dashboard.downloads_metadata_path,
+                    archive_fingerprint,
+                    file_hashes,
+                    rewritten_files
                 )
             except Exception as error:
                 GLib.idle_add(on_metadata_finalised, error)
@@ -496,6 +545,24 @@ class DownloadsTab(Gtk.Box):
         
         threading.Thread(target=finalise_metadata, daemon=True).start()
         
+    def on_install_queue_changed(self):
+        # Moves the queued rows up without rebuilding the list, rows that just started show their progress
+        for filename, label in self.download_lbl_maps.items():
+            if filename not in self.install_queue:
+                continue
+            position = self.install_queue.position(filename)
+            if position:
+                label.set_text(f"#{position}")
+            elif label.get_text().startswith("#"):
+                label.set_text("0%")
+        return False
+
+    def on_extraction_progress(self, filename: str, progress: dict):
+        if filename in self.download_maps and self.install_queue.is_running(filename):
+            self.download_maps[filename].set_fraction(progress['fraction'])
+            self.download_lbl_maps[filename].set_text(f"{round(progress['fraction'] * 100)}%")
+        return False
+
     def on_download_started(self, downloader, filename):
         if filename not in self.currently_downloading:
             self.currently_downloading.add(filename)
@@ -1,9 +1,13 @@
 import os
 import re
 import gettext
+import threading
 
-from gi.repository import Adw, Gdk, GdkPixbuf, GObject, Gtk
+from gi.repository import Adw, Gdk, GdkPixbuf, Gio, GLib, GObject, Gtk
 
+from core.archive_backends import ExtractionCancelled, normalise_member_name
+from core.archive_index import get_archive_manifest
+from core.archive_manager import read_archive_members
 from core.fomod_manager import (check_for_dependencies,
                                 check_for_plugin_dependencies,
                                 generate_source_from_flags,
@@ -11,9 +15,7 @@ from core.fomod_manager import (check_for_dependencies,
                                 get_fomod_group_options, get_fomod_step_count,
                                 get_plugin_image_path, get_plugin_type,
                                 have_plugins_images, is_step_visible)
-from core.tools import retrieve_casesensitive_paths
 from gui.text_window import TextWindow
-from core.tools import retrieve_casesensitive_paths
 _ = gettext.gettext
 
 class FomodSelectionDialog(Adw.Window):
@@ -22,7 +24,7 @@ class FomodSelectionDialog(Adw.Window):
         'response': (GObject.SignalFlags.RUN_LAST, None, (int,))
     }
     
-    def __init__(self, parent, fomod_metadata, mod_staging_dir, game_dest):
+    def __init__(self, parent, fomod_metadata, archive_path, fomod_root, game_dest):
         
         module_name = fomod_metadata['module_name']
         super().__init__(transient_for=parent, modal=True)
@@ -50,13 +52,18 @@ class FomodSelectionDialog(Adw.Window):
         
         options = get_fomod_group_options(self.module_data)
         
-        # Look for the fomod path in case the archive is 
-        # mod_arc/mod_name/FOMOD instead of mod_arc/FOMOD
-        self.fomod_staging_dir = mod_staging_dir
-        for root, dirs, _files in os.walk(mod_staging_dir):
-            if 'fomod' in [d.lower() for d in dirs]:
-                self.fomod_staging_dir = root
-                break
+        # Images are read straight from the archive, fomod_root is the folder holding fomod/
+        # in case the archive is mod_arc/mod_name/FOMOD instead of mod_arc/FOMOD
+        self.archive_path = archive_path
+        self.fomod_root = fomod_root
+        self.archive_files = {path.lower(): path for path, _, _ in get_archive_manifest(archive_path)}
+        # Every preview image is read once, in a single pass over the archive, away from the main thread
+        self.plugin_images = None
+        self.preview_row = None
+        self.images_cancel_event = threading.Event()
+        self.responded = False
+        self.connect("close-request", self.on_close_request)
+        threading.Thread(target=self.read_plugin_images, args=(self.get_image_members(),), daemon=True).start()
         
         self.game_dest = game_dest
         
@@ -589,16 +596,24 @@ class FomodSelectionDialog(Adw.Window):
         converted_flags = generate_source_from_flags(self.flags_data, self.active_flags)
         self.global_sources.append(converted_flags)
         
-        self.emit("response", Gtk.ResponseType.OK)
+        self.respond(Gtk.ResponseType.OK)
         self.close()
 
     def on_cancel_clicked(self, button):
-        self.emit("response", Gtk.ResponseType.CANCEL)
+        self.respond(Gtk.ResponseType.CANCEL)
         self.close()
+
+    def respond(self, response):
+        # Once only: the buttons close the window too, which goes through on_close_request
+        if self.responded:
+            return
+        self.responded = True
+        self.emit("response", response)
         
     def display_preview(self, listbox, row):
         if row is not None:
             selected_plugin_name = row.name_label
+            self.preview_row = row
             
         if not have_plugins_images(self.module_data, self.current_step, self.current_group):
             self.right_box.set_visible(False)
@@ -616,25 +631,11 @@ class FomodSelectionDialog(Adw.Window):
 
         image_path = get_plugin_image_path(self.module_data, selected_plugin_name, self.current_step, self.current_group)
         
-        if image_path != '':
-            clean_relative_path = image_path.replace('\\', '/')
-            full_image_path = os.path.join(self.fomod_staging_dir, clean_relative_path)
-            try:
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                    full_image_path, 
-                    width=800,
-                    height=800,
-                    preserve_aspect_ratio=True
-                )
-            except:
-                full_image_path = retrieve_casesensitive_paths(full_image_path)
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                    full_image_path, 
-                    width=800,
-                    height=800,
-                    preserve_aspect_ratio=True
-                )
-
+        if image_path != '' and self.plugin_images is None:
+            self.show_no_preview_label(_("Loading preview..."))
+            return
+        pixbuf = self.load_plugin_image(image_path) if image_path != '' else None
+        if pixbuf is not None:
             texture = Gdk.Texture.new_for_pixbuf(pixbuf)
             picture = Gtk.Picture.new_for_paintable(texture)
             picture.set_overflow(Gtk.Overflow.HIDDEN)
@@ -651,8 +652,57 @@ class FomodSelectionDialog(Adw.Window):
         else:
             self.show_no_preview_label()
     
-    def show_no_preview_label(self):
-        no_image_label = Gtk.Label(label="No preview available")
+    def image_member(self, image_path):
+        # Matched case insensitively, FOMODs are written for Windows
+        member_path = normalise_member_name(os.path.join(self.fomod_root, image_path.replace('\\', '/')))
+        return self.archive_files.get(member_path.lower()) if member_path else None
+
+    def get_image_members(self) -> list:
+        members = []
+        for step in self.module_data:
+            for group in step['group']:
+                for plugin in group['plugins']:
+                    member_path = self.image_member(plugin['image_path']) if plugin['image_path'] else None
+                    if member_path is not None and member_path not in members:
+                        members.append(member_path)
+        return members
+
+    def read_plugin_images(self, members):
+        try:
+            images = read_archive_members(self.archive_path, members, self.images_cancel_event)
+        except ExtractionCancelled:
+            return
+        except Exception as e:
+            print(f"Could not read the FOMOD images of {os.path.basename(self.archive_path)}: {e}")
+            images = {}
+        GLib.idle_add(self.on_plugin_images_read, images)
+
+    def on_plugin_images_read(self, images):
+        self.plugin_images = images
+        if self.preview_row is not None:
+            self.display_preview(None, self.preview_row)
+        return False
+
+    def on_close_request(self, window):
+        self.images_cancel_event.set()
+        # Closed from the header bar: the install waiting on the dialog is cancelled
+        self.respond(Gtk.ResponseType.CANCEL)
+        return False
+
+    def load_plugin_image(self, image_path):
+        member_path = self.image_member(image_path)
+        image = self.plugin_images.get(member_path) if member_path else None
+        if image is None:
+            return None
+        try:
+            stream = Gio.MemoryInputStream.new_from_bytes(GLib.Bytes.new(image))
+            return GdkPixbuf.Pixbuf.new_from_stream_at_scale(stream, 800, 800, True, None)
+        except Exception as e:
+            print(f"Could not load FOMOD image {member_path}: {e}")
+            return None
+    
+    def show_no_preview_label(self, text="No preview available"):
+        no_image_label = Gtk.Label(label=text)
         no_image_label.set_hexpand(True)
         no_image_label.set_vexpand(True)
         no_image_label.add_css_class("dim-label")
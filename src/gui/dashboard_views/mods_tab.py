@@ -7,15 +7,17 @@ from pathlib import Path
 
 from gi.repository import Adw, Gdk, GLib, GObject, Gtk, Gio, GdkPixbuf, Pango
 
-from core.mod_manager import (apply_deployment_map_changes, build_deployment_map,
-                              change_mod_index, check_for_conflicts,
-                              check_for_deployment_map_change,
-                              load_staging_metadata, read_index,
-                              toggle_mod_state)
+from core.deployment_map import get_deployment_engine
+from core.mod_manager import (apply_deployment_map_changes, check_for_conflicts,
+                              get_active_profile, get_conflicting_mods, get_missing_files,
+                              list_profiles, move_mod, load_staging_metadata, read_index,
+                              repair_deployment, save_profile, set_mods_state,
+                              switch_profile, toggle_mod_state, verify_deployment,
+                              write_staging_metadata)
 from platforms.nexus import get_nexus_changelog, endorse_nexus_mod
 from platforms.nexus import get_mod_info as get_nexus_mod_info
 from platforms.gamebanana import get_mod_info as get_gamebanana_mod_info
-from core.tools import timestamp_converter, write_yaml, create_icon_button
+from core.tools import timestamp_converter, create_icon_button
 from gui.text_window import TextWindow
 from typing import Optional, Callable
 
@@ -33,9 +35,8 @@ class ModsTab(Gtk.Box):
         
         self.sc = Gtk.ScrolledWindow(vexpand=True)
         
-        # Deployment map is used to redeploy files while moving items
-        staging_metadata = load_staging_metadata(self.dashboard.staging_metadata_path)
-        self.deployment_map = build_deployment_map(staging_metadata)
+        # Deployment map engine is used to redeploy files while moving items
+        get_deployment_engine(self.dashboard.staging_metadata_path, load_staging_metadata)
 
         # Action bar top right
         action_bar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
@@ -57,11 +58,42 @@ class ModsTab(Gtk.Box):
         
         action_bar.append(filter_group)
 
+        # Bulk actions, applied as a single transaction
+        bulk_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        for label, state, selected_only in [
+            (_("Enable all"), True, False),
+            (_("Disable all"), False, False),
+            (_("Enable selected"), True, True)
+        ]:
+            bulk_action_btn = Gtk.Button(label=label, css_classes=["flat"])
+            bulk_action_btn.connect("clicked", self.on_bulk_toggle, state, selected_only)
+            bulk_box.append(bulk_action_btn)
+
+        # Profiles, rebuilt every time the menu opens
+        bulk_box.append(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL))
+        self.profiles_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        bulk_box.append(self.profiles_box)
+        save_profile_btn = Gtk.Button(label=_("Save as profile..."), css_classes=["flat"])
+        save_profile_btn.connect("clicked", self.on_save_profile_clicked)
+        bulk_box.append(save_profile_btn)
+
+        self.bulk_popover = Gtk.Popover(child=bulk_box)
+        self.bulk_popover.connect("show", self.refresh_profiles_menu)
+        self.bulk_menu_btn = Gtk.MenuButton(icon_name="view-more-symbolic", popover=self.bulk_popover, valign=Gtk.Align.CENTER, css_classes=["flat"])
+        self.bulk_menu_btn.set_tooltip_text(_("Enable or disable several mods at once, or switch profile\nCtrl+click mods in the list to select them"))
+        self.bulk_menu_btn.set_cursor_from_name("pointer")
+        action_bar.append(self.bulk_menu_btn)
+
         folder_btn = create_icon_button(
             icon_name="mat-folder-symbolic",
             tooltip=_("Open staging folder"),
             on_click=lambda x: webbrowser.open(f"file://{self.dashboard.staging_path}")
         )
+        self.verify_btn = create_icon_button(
+            icon_name="emblem-ok-symbolic",
+            tooltip=_("Verify deployment\nChecks that the files in the game folder match the enabled mods and offers to repair them."),
+            on_click=self.on_verify_clicked
+        )
         update_btn = create_icon_button(
             icon_name="refresh-mods-symbolic",
             tooltip=_("Refresh Metadata & Check for updates\nThis will replace all current mod metadata with fresh data coming straight from the modding platform."),
@@ -82,6 +114,7 @@ class ModsTab(Gtk.Box):
 
         # Add all the buttons
         action_bar.append(folder_btn)
+        action_bar.append(self.verify_btn)
         action_bar.append(update_btn)
 
         if dashboard.platform in ["steam", "heroic-gog", "heroic-epic"]:
@@ -99,7 +132,7 @@ class ModsTab(Gtk.Box):
         self.append(self.main_content)
 
         # Mod list
-        self.mods_list_box = Gtk.ListBox(css_classes=["dashboard-list"])
+        self.mods_list_box = Gtk.ListBox(css_classes=["dashboard-list"], selection_mode=Gtk.SelectionMode.MULTIPLE)
         self.mods_list_box.set_filter_func(self.filter_mods_func)
         self.mods_list_box.connect("row-activated", self.on_row_clicked) 
         self.mods_list_box.set_overflow(Gtk.Overflow.HIDDEN)
@@ -570,7 +603,7 @@ class ModsTab(Gtk.Box):
             
             staging_metadata = load_staging_metadata(self.dashboard.staging_metadata_path)
             staging_metadata["mods"][mod_index]["alias"] = new_alias
-            write_yaml(staging_metadata, self.dashboard.staging_metadata_path)
+            write_staging_metadata(staging_metadata, self.dashboard.staging_metadata_path)
 
             # Instantly reflect the change on the UI
             self.preview_title.set_label(new_alias)
@@ -640,7 +673,7 @@ class ModsTab(Gtk.Box):
                 staging_metadata = load_staging_metadata(self.dashboard.staging_metadata_path)
                 staging_metadata["mods"][mod_index]["mod_id"] = new_id
                 staging_metadata["mods"][mod_index]["platform"] = new_platform
-                write_yaml(staging_metadata, self.dashboard.staging_metadata_path)
+                write_staging_metadata(staging_metadata, self.dashboard.staging_metadata_path)
 
                 # Reflect the change on the UI
                 self.mod_id_btn.set_label(new_id)
@@ -680,7 +713,7 @@ class ModsTab(Gtk.Box):
                 # Logic to save the new path
                 staging_metadata = load_staging_metadata(self.dashboard.staging_metadata_path)
                 staging_metadata["mods"][mod_index]["deployment_path"] = new_path
-                write_yaml(staging_metadata, self.dashboard.staging_metadata_path)
+                write_staging_metadata(staging_metadata, self.dashboard.staging_metadata_path)
                 
                 # Update UI label immediately
                 self.deployment_label.set_label(new_path)
@@ -706,7 +739,7 @@ class ModsTab(Gtk.Box):
             # Save state to metadata
             staging_metadata = load_staging_metadata(self.dashboard.staging_metadata_path)
             staging_metadata["mods"][mod_index]["endorsed"] = not unendorse
-            write_yaml(staging_metadata, self.dashboard.staging_metadata_path)
+            write_staging_metadata(staging_metadata, self.dashboard.staging_metadata_path)
             self.populate_list()
         else:
             self.dashboard.show_message(_("Failed to endorse"), _("Could not endorse the selected mod, please make sure you have provided your API key and are connected to the internet."))
@@ -721,17 +754,21 @@ class ModsTab(Gtk.Box):
 
             indexed_mods = read_index(self.dashboard.staging_metadata_path)
 
+            # Only the mod folders are stat'ed, a folder is rescanned when its mtime changed
             missing_files_per_mod = {
-                mod: [f for f in staging_metadata["mods"][mod].get("mod_files", [])
-                        if not os.path.exists(staging_path / staging_metadata["mods"][mod]["folder_name"] / f)]
+                mod: get_missing_files(staging_path, staging_metadata["mods"][mod])
                 for mod in staging_metadata.get("mods", {})
             }
 
             conflicts = check_for_conflicts(self.dashboard.staging_metadata_path)
+            conflicts_per_mod = {
+                mod: get_conflicting_mods(self.dashboard.staging_metadata_path, mod)
+                for mod in indexed_mods
+            } if conflicts else {}
 
-            GLib.idle_add(on_data_prepared, staging_path, staging_metadata, indexed_mods, conflicts, missing_files_per_mod)
+            GLib.idle_add(on_data_prepared, staging_path, staging_metadata, indexed_mods, conflicts, conflicts_per_mod, missing_files_per_mod)
             
-        def on_data_prepared(staging_path, staging_metadata, indexed_mods, conflicts, missing_files_per_mod):
+        def on_data_prepared(staging_path, staging_metadata, indexed_mods, conflicts, conflicts_per_mod, missing_files_per_mod):
             valignment = self.sc.get_valign()
             srow = None
             if self.mods_list_box.get_selected_row() != None:
@@ -820,12 +857,7 @@ class ModsTab(Gtk.Box):
                     row.add_prefix(missing_file_badge)
 
                 # Conflits
-                conflicting_mods = []
-                for conflict_list in conflicts:
-                    if mod in conflict_list:
-                        other_mods = conflict_list.copy()
-                        other_mods.remove(mod)
-                        conflicting_mods.extend(other_mods)
+                conflicting_mods = conflicts_per_mod.get(mod, [])
                 if conflicting_mods:
                     conflicts_badge = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
                     conflicts_badge.add_css_class("warning-badge")
@@ -961,14 +993,11 @@ class ModsTab(Gtk.Box):
                 mod_name=mod,
                 mod_files=mod_files,
                 state=state,
-                staging_dir=str(self.dashboard.staging_path),
-                deployment_map=self.deployment_map
+                staging_dir=str(self.dashboard.staging_path)
             )
             GLib.idle_add(on_toggle_done, deployment_output)
             
         def on_toggle_done(deployment_output):
-            if deployment_output["success"] == True:
-                self.deployment_map = deployment_output['deployment_map']
             # UI Fallback if toggle fail
             self.dashboard.currently_toggling.discard(mod)
             switch.set_sensitive(True)
@@ -984,6 +1013,135 @@ class ModsTab(Gtk.Box):
         
         threading.Thread(target=worker, daemon=True).start()
     
+    def on_bulk_toggle(self, btn, state: bool, selected_only: bool):
+        self.bulk_popover.popdown()
+
+        if selected_only:
+            mods = [row.mod_data_index for row in self.mods_list_box.get_selected_rows()]
+        else:
+            mods = read_index(self.dashboard.staging_metadata_path)
+        if not mods:
+            return
+
+        self.run_bulk_operation(lambda: set_mods_state(str(self.dashboard.staging_path), mods, state))
+
+    def run_bulk_operation(self, operation: Callable):
+        # The list is locked until the whole batch is deployed
+        self.bulk_menu_btn.set_sensitive(False)
+        self.mods_list_box.set_sensitive(False)
+
+        def worker():
+            result = operation()
+            GLib.idle_add(on_bulk_done, result)
+
+        def on_bulk_done(result):
+            if not result["success"]:
+                print(f"Some mods could not be deployed: {', '.join(result['failed_mods'])}")
+            self.bulk_menu_btn.set_sensitive(True)
+            self.mods_list_box.set_sensitive(True)
+            self.dashboard.update_indicators()
+            self.populate_list()
+            return False
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def refresh_profiles_menu(self, popover):
+        while child := self.profiles_box.get_first_child():
+            self.profiles_box.remove(child)
+
+        active_profile = get_active_profile(str(self.dashboard.staging_path))
+        for profile_name in list_profiles(str(self.dashboard.staging_path)):
+            profile_btn = Gtk.Button(css_classes=["flat"])
+            profile_btn.set_child(Gtk.Label(label=profile_name, xalign=0))
+            if profile_name == active_profile:
+                profile_btn.add_css_class("accent")
+            profile_btn.set_tooltip_text(_("Switch to this profile"))
+            profile_btn.connect("clicked", self.on_profile_switch, profile_name)
+            self.profiles_box.append(profile_btn)
+
+    def on_profile_switch(self, btn, profile_name: str):
+        self.bulk_popover.popdown()
+        self.run_bulk_operation(lambda: switch_profile(str(self.dashboard.staging_path), profile_name))
+
+    def on_save_profile_clicked(self, btn):
+        self.bulk_popover.popdown()
+        dialog = Adw.MessageDialog(
+            transient_for=self.get_root(),
+            heading=_('Save Profile'),
+            body=_("Saves the enabled mods and the load order. Using an existing name replaces that profile."),
+        )
+
+        dialog.add_response("cancel", _("Cancel"))
+        dialog.add_response("save", _("Save"))
+        dialog.set_response_appearance("save", Adw.ResponseAppearance.SUGGESTED)
+        dialog.set_default_response("save")
+
+        entry_box = Gtk.ListBox()
+        entry_box.add_css_class("boxed-list")
+
+        entry_row = Adw.EntryRow(title=_("Profile Name"))
+        entry_row.set_activates_default(True)
+        active_profile = get_active_profile(str(self.dashboard.staging_path))
+        if active_profile:
+            entry_row.set_text(active_profile)
+
+        entry_box.append(entry_row)
+        dialog.set_extra_child(entry_box)
+
+        def on_response(source_dialog, response_id):
+            if response_id == "save" and entry_row.get_text().strip():
+                save_profile(str(self.dashboard.staging_path), entry_row.get_text().strip())
+            source_dialog.destroy()
+
+        dialog.connect("response", on_response)
+        dialog.present()
+
+    def on_verify_clicked(self, btn):
+        self.verify_btn.set_sensitive(False)
+
+        def worker():
+            report = verify_deployment(str(self.dashboard.staging_path))
+            GLib.idle_add(on_verified, report)
+
+        def on_verified(report):
+            self.verify_btn.set_sensitive(True)
+            issues = len(report["missing"]) + len(report["stale"]) + len(report["broken"])
+            if not issues and not report["foreign"]:
+                self.dashboard.show_message(_("Deployment verified"), _("{} deployed files match the enabled mods.").format(report["ok"]))
+                return False
+
+            body = _("Missing: {}\nStale: {}\nBroken: {}\nBlocked by files NOMM did not deploy: {}").format(
+                len(report["missing"]), len(report["stale"]), len(report["broken"]), len(report["foreign"]))
+            dialog = Adw.MessageDialog(transient_for=self.dashboard.app.win, heading=_("Deployment issues found"), body=body)
+            dialog.add_response("cancel", _("Cancel"))
+            if issues:
+                dialog.add_response("repair", _("Repair"))
+                dialog.set_response_appearance("repair", Adw.ResponseAppearance.SUGGESTED)
+            dialog.connect("response", on_response, report)
+            dialog.present()
+            return False
+
+        def on_response(dialog, response_id, report):
+            dialog.close()
+            if response_id != "repair":
+                return
+            self.verify_btn.set_sensitive(False)
+
+            def repair_worker():
+                result = repair_deployment(str(self.dashboard.staging_path), report)
+                GLib.idle_add(on_repaired, result)
+
+            threading.Thread(target=repair_worker, daemon=True).start()
+
+        def on_repaired(result):
+            self.verify_btn.set_sensitive(True)
+            self.dashboard.show_message(_("Deployment repaired"), _("{} entries were repaired.").format(result["repaired"]))
+            self.dashboard.update_indicators()
+            self.populate_list()
+            return False
+
+        threading.Thread(target=worker, daemon=True).start()
+
     def on_drag_prepare(self, source, x, y, mod_name):
         value = GObject.Value(GObject.TYPE_STRING, mod_name)
         return Gdk.ContentProvider.new_for_value(value)
@@ -999,14 +1157,11 @@ class ModsTab(Gtk.Box):
 
         if mod_name in current_mods:
             target_index = current_mods.index(mod_name)
-            new_staging_metadata = change_mod_index(self.dashboard.staging_metadata_path, value, target_index)
+            changes = move_mod(self.dashboard.staging_metadata_path, value, target_index)
             
             # Redeploy the files that changed
-            new_deployment_map = build_deployment_map(new_staging_metadata)
-            if new_deployment_map != self.deployment_map:
-                changes = check_for_deployment_map_change(new_deployment_map, self.deployment_map)
+            if changes['additions'] or changes['deletions']:
                 apply_deployment_map_changes(self.dashboard.staging_path, dest_dir, changes, mod_name)
-                self.deployment_map = new_deployment_map
             
             # Refresh UI
             self.populate_list()
@@ -1022,7 +1177,7 @@ class ModsTab(Gtk.Box):
         btn.set_sensitive(False)
 
         def on_updates_checked(updated_metadata):
-            write_yaml(updated_metadata, self.dashboard.staging_metadata_path)
+            write_staging_metadata(updated_metadata, self.dashboard.staging_metadata_path)
             self.populate_list()
             btn.set_sensitive(True)
 
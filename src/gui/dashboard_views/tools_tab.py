@@ -4,9 +4,10 @@ import threading
 import webbrowser
 from pathlib import Path
 
-from gi.repository import Adw, Gtk
+from gi.repository import Adw, GLib, Gtk
 
-from core.mod_manager import deploy_essential_utility
+from core.mod_manager import deploy_essential_utility, get_deduplication_stats
+from core.user_config import load_user_config
 
 _ = gettext.gettext
 
@@ -116,6 +117,23 @@ class ToolsTab(Gtk.Box):
             scrolled.set_child(list_box)
             self.append(scrolled)
 
+        # Space saved by the deduplicating staging store
+        if (load_user_config() or {}).get("staging_deduplication", False):
+            stats = get_deduplication_stats(self.dashboard.staging_path)
+            dedup_list = Gtk.ListBox(css_classes=["dashboard-list"], margin_top=20)
+            dedup_list.set_selection_mode(Gtk.SelectionMode.NONE)
+            dedup_list.set_overflow(Gtk.Overflow.HIDDEN)
+            dedup_row = Adw.ActionRow(
+                title=_("Staging deduplication"),
+                subtitle=_("{} unique files stored").format(stats["blobs"])
+            )
+            saved_label = Gtk.Label(label=_("{} saved").format(GLib.format_size(stats["bytes_saved"])))
+            saved_label.add_css_class("badge-action-row")
+            saved_label.set_valign(Gtk.Align.CENTER)
+            dedup_row.add_suffix(saved_label)
+            dedup_list.append(dedup_row)
+            self.append(dedup_list)
+
         # Load Order Button
         load_order_rel = self.dashboard.game_config.get("load_order_path")
         if load_order_rel:
@@ -7,7 +7,6 @@ from urllib.parse import urlsplit, urlunsplit
 from urllib.error import HTTPError
 
 import requests
-import yaml
 from gi.repository import GLib
 
 from core.mod_manager import get_metadata_path, load_staging_metadata, meta_lock
@@ -139,14 +138,11 @@ def handle_nexus_link(nxm_link: str, downloader: Downloader, headers: dict) -> b
     if os.path.exists(game_configs_dir):
         for filename in os.listdir(game_configs_dir):
             if filename.lower().endswith((".yaml", ".yml")):
-                try:
-                    with open(os.path.join(game_configs_dir, filename), 'r') as f:
-                        g_data = yaml.safe_load(f)
-                        if g_data and g_data.get("nexus_id") == nexus_id:
-                            game_folder_name = g_data.get("name", nexus_id)
-                            break
-                except:
-                    continue
+                # load_yaml also sees game configs still waiting to be written
+                g_data = load_yaml(os.path.join(game_configs_dir, filename))
+                if g_data and g_data.get("nexus_id") == nexus_id:
+                    game_folder_name = g_data.get("name", nexus_id)
+                    break
 
     if not game_folder_name:
         print(f"Game {nexus_id} could not be found in game_configs!")
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+pytest.importorskip("gi")
+
+import core.mod_manager as mod_manager
+from core.metadata_store import get_staging_store
+from core.mod_manager import (commit_metadata, repair_deployment, toggle_mod_state,
+                              verify_deployment, write_staging_metadata)
+
+MOD_FILE = "Data/a.txt"
+
+@pytest.fixture
+def deployment(tmp_path, monkeypatch):
+    monkeypatch.setattr(mod_manager, "load_user_config", lambda: {})
+    staging_dir = tmp_path / "staging"
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    source = staging_dir / "A" / MOD_FILE
+    source.parent.mkdir(parents=True)
+    source.write_text("mod")
+    staging_meta_path = str(staging_dir / ".staging.nomm.yaml")
+    write_staging_metadata({
+        "mods": {"A": {"folder_name": "A", "mod_files": [MOD_FILE], "deployment_path": str(game_dir)}},
+        "index": ["A"],
+        "info": {}
+    }, staging_meta_path)
+    commit_metadata(staging_meta_path)
+    return str(staging_dir), game_dir, get_staging_store(staging_meta_path)
+
+def test_repair_keeps_a_file_the_user_put_in_place_of_a_link(deployment):
+    staging_dir, game_dir, store = deployment
+    toggle_mod_state("A", [MOD_FILE], True, staging_dir)
+    user_file = game_dir / MOD_FILE
+    assert user_file.is_symlink()
+    user_file.unlink()
+    user_file.write_text("mine")
+
+    toggle_mod_state("A", [MOD_FILE], False, staging_dir)
+    assert store.get_deployment(str(game_dir)) == {}
+
+    result = repair_deployment(staging_dir, verify_deployment(staging_dir))
+    assert result["repaired"] == 0
+    assert user_file.read_text() == "mine"
+
+@pytest.mark.parametrize("strategy, same_inode", [("symlink", False), ("copy", False), ("copy", True)])
+def test_leftover_records_only_remove_what_nomm_placed(deployment, strategy, same_inode):
+    staging_dir, game_dir, store = deployment
+    user_file = game_dir / MOD_FILE
+    user_file.parent.mkdir(parents=True)
+    user_file.write_text("mine")
+    inode = os.lstat(user_file).st_ino if same_inode else None
+    store.record_deployment(str(game_dir), "A", [(MOD_FILE, strategy, inode)])
+
+    report = verify_deployment(staging_dir)
+    assert [path for _, path, _ in report["stale" if same_inode else "foreign"]] == [MOD_FILE]
+    repair_deployment(staging_dir, report)
+    assert user_file.exists() != same_inode